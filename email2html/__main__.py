@@ -0,0 +1,11 @@
+import os
+import sys
+
+# 各モジュールは同じフォルダのものをそのまま import し合うので、検索パスに入れる
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
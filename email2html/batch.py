@@ -0,0 +1,426 @@
+import os
+from contextlib import nullcontext
+
+import dedup
+import html_slim
+import image_cache
+import image_transcode
+import manifest
+import metrics
+import search_index
+from common import convert_any_email, output_html_path
+from sources import item_label
+
+
+# ============================================================
+# 1 通分の変換（ワーカープロセス側で実行）
+# ============================================================
+def convert_item(item, output_dir: str | None, save_external_images: bool,
+                 layout: str = "files", archive: bool = False, dedup_attachments: bool = False,
+                 slim: bool = False, transcode: dict | None = None):
+    """
+    item は .eml / .msg のパス文字列か、sources が返す dict（mbox の 1 通・Maildir のファイル）。
+    layout は writers.LAYOUTS のどれか。
+    archive=True のときは出力先に書かず、アーカイブに入れる [(名前, 一時ファイルのパス)] を返す。
+    dedup_attachments=True なら同じ内容の添付を出力フォルダのストアへのハードリンクにする。
+    slim=True なら HTML 本文から Outlook だけが使うマークアップなどを除く（html_slim）。
+    transcode を渡すと本文から参照される大きな画像を作り直す（image_transcode.make_options）。
+    """
+    if archive:
+        return _item_entries(item, save_external_images, layout, slim)
+
+    if isinstance(item, str):
+        return convert_any_email(item, output_dir, save_external_images, layout, dedup_attachments,
+                                 slim, transcode)
+
+    from eml_converter import eml_to_html, eml_bytes_to_html
+
+    if "data" in item:
+        return eml_bytes_to_html(item["data"], item["name"], item["output_dir"], save_external_images,
+                                 layout, dedup_attachments, slim, transcode)
+
+    return eml_to_html(item["path"], item["output_dir"], save_external_images, base=item["name"],
+                       layout=layout, dedup_attachments=dedup_attachments, slim=slim,
+                       transcode=transcode)
+
+
+def _item_entries(item, save_external_images: bool, layout: str, slim: bool = False) -> list:
+    """
+    アーカイブに入れる 1 通分。mbox / Maildir の中身は <名前>_html/ の下に置く。
+    大きな EML もストリーミング解析はせず、1 通分をメモリに読み込む。
+    中身は一時ファイルに書き、親プロセスにはパスだけを渡す（writers.message_entries）。
+    """
+    from writers import message_entries
+    from eml_converter import parse_eml_bytes, read_eml
+
+    if isinstance(item, str):
+        base = os.path.splitext(os.path.basename(item))[0]
+        prefix = ""
+        ext = os.path.splitext(item)[1].lower()
+        if ext == ".eml":
+            msg_data = parse_eml_bytes(read_eml(item))
+        elif ext == ".msg":
+            from msg_converter import parse_msg_via_library
+            msg_data = parse_msg_via_library(item)
+        else:
+            raise ValueError("EML または MSG ファイルではありません。")
+    else:
+        base = item["name"]
+        prefix = os.path.basename(item["output_dir"]) + "/"
+        raw = item["data"] if "data" in item else read_eml(item["path"])
+        msg_data = parse_eml_bytes(raw)
+
+    return message_entries(msg_data, base, save_external_images, layout, prefix, slim)
+
+
+def convert_one(item, output_dir: str | None, save_external_images: bool,
+                incremental: bool = False, collect_metrics: bool = False,
+                layout: str = "files", archive: bool = False,
+                dedup_attachments: bool = False, slim: bool = False,
+                transcode: dict | None = None, index: bool = False) -> dict:
+    """
+    convert_item を呼び出し、例外も含めて結果を dict で返す。
+    プロセス間で受け渡すため、例外は文字列にしておく。
+    incremental=True のときはマニフェスト用に元ファイルの情報も返す。
+    collect_metrics=True のときは段階ごとの計測結果を "metrics" に入れる。
+    archive=True のときは書き出す中身を "entries" に入れる（親プロセスがアーカイブに書く）。
+    index=True のときは全文検索の索引に入れる内容を "index" に入れる（親プロセスが索引に書く）。
+    """
+    image_cache.take_stats()
+    dedup.take_stats()
+    html_slim.take_stats()
+    image_transcode.take_stats()
+    metrics.begin(collect_metrics)
+    search_index.begin(index)
+    label = item_label(item)
+    try:
+        # 変換中に書き換えられても次回検出できるよう、変換前の状態を記録する
+        path = _source_path(item)
+        source = manifest.source_info(path) if incremental and path else None
+        html_out = convert_item(item, output_dir, save_external_images, layout, archive,
+                                dedup_attachments, slim, transcode)
+        result = {"path": label, "output": html_out, "error": None, "source": source}
+        if archive:
+            result["entries"] = html_out
+            result["output"] = html_out[0][0]
+    except Exception as e:
+        result = {"path": label, "output": None, "error": f"{type(e).__name__}: {e}"}
+
+    # この 1 件で外部画像キャッシュがどれだけ効いたか
+    result["image_cache"] = image_cache.take_stats()
+    if dedup_attachments:
+        result["dedup"] = dedup.take_stats()
+    if slim:
+        result["slim"] = html_slim.take_stats()
+    if transcode:
+        result["transcode"] = image_transcode.take_stats()
+    doc = search_index.take()
+    if doc is not None and not result["error"]:
+        result["index"] = doc
+    result["metrics"] = metrics.take()
+    return result
+
+
+def _source_path(item) -> str | None:
+    return item if isinstance(item, str) else item.get("path")
+
+
+def _expected_output(item, output_dir: str | None, layout: str = "files") -> str | None:
+    """
+    差分判定に使う出力 HTML（mhtml なら .mht）のパス。mbox の 1 通のようにファイルが無いものは None。
+    """
+    from writers import LAYOUT_EXTS
+
+    ext = LAYOUT_EXTS[layout]
+    if isinstance(item, str):
+        return output_html_path(item, output_dir, ext)
+    if "path" in item:
+        return os.path.join(item["output_dir"], item["name"] + ext)
+    return None
+
+
+def warm_up() -> int:
+    """
+    変換モジュールを先に読み込んでおく（常駐サーバーのワーカーで最初の 1 件を速くする）。
+    """
+    import eml_converter
+    import msg_converter
+    return os.getpid()
+
+
+# ============================================================
+# ワーカー数の決定
+# ============================================================
+def default_workers() -> int:
+    return max(1, os.cpu_count() or 1)
+
+
+def _item_size(item) -> int:
+    if isinstance(item, dict) and "data" in item:
+        return len(item["data"])
+    try:
+        return os.path.getsize(_source_path(item))
+    except OSError:
+        return 0
+
+
+# ============================================================
+# 一括変換（完了した順に結果を返すジェネレータ）
+# ============================================================
+def _cancelled(cancel) -> bool:
+    return cancel is not None and cancel.is_set()
+
+
+def _run(items, output_dir: str | None, save_external_images: bool,
+         workers: int | None, incremental: bool, collect_metrics: bool, cancel=None,
+         pool=None, layout: str = "files", archive: bool = False,
+         dedup_attachments: bool = False, slim: bool = False, transcode: dict | None = None,
+         index: bool = False, skip=None):
+    """
+    skip(item) が結果 dict を返したものは変換せず、その結果をすぐに返す
+    （差分変換で変わっていないもの。実行中の変換が終わるのを待たせない）。
+    """
+    if workers is None:
+        workers = default_workers()
+    if isinstance(items, list):
+        workers = min(workers, len(items) or 1)
+    workers = max(1, workers)
+
+    if workers == 1 and pool is None:
+        for item in items:
+            if _cancelled(cancel):
+                return
+            result = skip(item) if skip else None
+            if result is None:
+                result = convert_one(item, output_dir, save_external_images, incremental,
+                                     collect_metrics, layout, archive, dedup_attachments, slim,
+                                     transcode, index)
+            yield result
+        return
+
+    # プロセスプールの import は重い（logging など）ので、並列にするときだけ読み込む
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+    # 常駐サーバーなどから渡されたプールは使い回し、ここでは閉じない
+    if pool is None:
+        pool_context = ProcessPoolExecutor(max_workers=workers)
+    else:
+        pool_context = nullcontext(pool)
+
+    if isinstance(items, list):
+        # 大きいファイルから投入して、最後に 1 プロセスだけ長く残るのを防ぐ
+        pending = iter(sorted(items, key=_item_size, reverse=True))
+    else:
+        # mbox などは先読みせず、取り出した分だけ投入する
+        pending = iter(items)
+
+    # 2 万件でも Future を溜め込まないよう、投入数は workers の数倍に抑える
+    max_inflight = workers * 4
+
+    with pool_context as pool:
+        inflight = set()
+        exhausted = False
+        while not exhausted or inflight:
+            if _cancelled(cancel):
+                # 未着手の分は取り消し、実行中の分だけ終わるのを待つ
+                for fut in inflight:
+                    fut.cancel()
+                return
+
+            while not exhausted and len(inflight) < max_inflight:
+                item = next(pending, None)
+                if item is None:
+                    exhausted = True
+                    break
+                result = skip(item) if skip else None
+                if result is not None:
+                    yield result
+                    continue
+                inflight.add(pool.submit(convert_one, item, output_dir, save_external_images,
+                                         incremental, collect_metrics, layout, archive,
+                                         dedup_attachments, slim, transcode, index))
+
+            if not inflight:
+                break
+
+            done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield fut.result()
+
+
+def iter_convert(items, output_dir: str | None, save_external_images: bool = False,
+                 workers: int | None = None, incremental: bool = False,
+                 manifest_path: str | None = None, report_path: str | None = None,
+                 cancel=None, pool=None, layout: str = "files", archive_path: str | None = None,
+                 dedup_attachments: bool = False, slim: bool = False,
+                 transcode: dict | None = None, index_path: str | None = None):
+    """
+    items をプロセスプールで並列変換し、終わったものから結果 dict を yield する。
+    items はパスのリストか、sources.iter_sources などのジェネレータ（遅延で取り出す）。
+    workers=1 のときはプールを作らずこのプロセス内で順番に変換する。
+    incremental=True のときは前回から変わっていないファイルを変換せず、
+    skipped=True の結果として返す（マニフェストは manifest_path、省略時は既定の場所）。
+    mbox の中身のようにファイルになっていないメールは毎回変換する。
+    report_path を指定すると段階ごとの計測を有効にし、1 件 1 行の JSONL と
+    集計（<report_path から拡張子を除いたもの>.summary.json）を書き出す。
+    cancel（threading.Event など）が立つと新しい変換を始めずに終了する
+    （変換中のものは最後まで処理され、その結果は返さない）。
+    pool に ProcessPoolExecutor を渡すと新しく作らずにそれを使う（workers は投入数の目安）。
+    layout は出力形式（writers.LAYOUTS）。archive_path（.zip / .tar / .tar.gz）を指定すると
+    個別のファイルは作らず、すべての出力をその 1 ファイルに順に書き込む
+    （結果の output は <archive_path>/<アーカイブ内の名前>）。
+    dedup_attachments=True なら出力フォルダごとのストアで同じ内容の添付を 1 つにまとめ
+    （各メールの _files/ にはハードリンク）、結果の "dedup" に省いたバイト数を入れる。
+    slim=True なら HTML 本文を html_slim で軽量化し、結果の "slim" に前後の大きさを入れる。
+    transcode（image_transcode.make_options）を渡すと本文から参照される大きな画像を
+    作り直し、結果の "transcode" に枚数と前後の大きさを入れる。
+    index_path を指定すると、変換しながら件名・差出人・宛先・本文・添付名を
+    全文検索の索引（search_index.SearchIndex）に入れる（元のメールを読み直さない）。
+    """
+    if archive_path is not None and incremental:
+        raise ValueError("差分変換とアーカイブへの出力は同時に使えません。")
+
+    if isinstance(items, (list, tuple)):
+        items = list(items)
+
+    results = _iter_convert(items, output_dir, save_external_images, workers, incremental,
+                            manifest_path, report_path is not None, cancel, pool,
+                            layout, archive_path is not None, dedup_attachments, slim,
+                            transcode, index_path is not None)
+    if archive_path is not None:
+        results = _write_archive(results, archive_path)
+    if index_path is not None:
+        results = _write_index(results, index_path)
+
+    if report_path is None:
+        yield from results
+        return
+
+    with metrics.Report(report_path) as report:
+        for result in results:
+            report.add(result)
+            yield result
+
+
+def _write_archive(results, archive_path: str):
+    from writers import ArchiveWriter, remove_entries
+
+    with ArchiveWriter(archive_path) as archive:
+        for result in results:
+            entries = result.pop("entries", None)
+            if entries:
+                try:
+                    names = archive.add(entries)
+                finally:
+                    # ワーカーが書いた一時ファイルは、アーカイブに入れたら要らない
+                    remove_entries(entries)
+                result["output"] = os.path.join(archive_path, names[0])
+            yield result
+
+
+def _write_index(results, index_path: str):
+    with search_index.SearchIndex(index_path) as index:
+        for result in results:
+            doc = result.pop("index", None)
+            if doc is not None:
+                index.add(result["output"], result["path"], doc)
+            yield result
+
+
+def _iter_convert(items, output_dir, save_external_images, workers, incremental,
+                  manifest_path, collect_metrics, cancel, pool, layout, archive, dedup_attachments,
+                  slim, transcode, index):
+    if not incremental:
+        yield from _run(items, output_dir, save_external_images, workers, False, collect_metrics,
+                        cancel, pool, layout, archive, dedup_attachments, slim, transcode, index)
+        return
+
+    options = {"save_external_images": bool(save_external_images)}
+    if layout != "files":
+        # 既定の形式では以前のマニフェストをそのまま使えるよう、キーに含めない
+        options["layout"] = layout
+    if slim:
+        options["slim"] = True
+    if transcode:
+        options["transcode"] = transcode
+    if index:
+        # 索引を使い始めたときは、前回変換した分も索引に入るよう変換し直す
+        options["index"] = True
+
+    with manifest.Manifest(manifest_path) as m:
+        def skip(item):
+            html_out = _expected_output(item, output_dir, layout)
+            if html_out and m.is_up_to_date(_source_path(item), html_out, options):
+                return {"path": item_label(item), "output": html_out, "error": None,
+                        "skipped": True, "image_cache": {}}
+            return None
+
+        for result in _run(items, output_dir, save_external_images, workers, True, collect_metrics,
+                           cancel, pool, layout, archive, dedup_attachments, slim, transcode,
+                           index, skip):
+            # 記録対象（ファイルのあるもの）は path がそのまま元ファイルのパス
+            if not result["error"] and result.get("source"):
+                m.record(result["path"], result["output"], result["source"], options)
+            yield result
+
+
+# ============================================================
+# 一括変換（進捗コールバック付き）
+# ============================================================
+def convert_many(items, output_dir: str | None, save_external_images: bool = False,
+                 workers: int | None = None, progress=None,
+                 incremental: bool = False, manifest_path: str | None = None,
+                 report_path: str | None = None, cancel=None,
+                 layout: str = "files", archive_path: str | None = None,
+                 dedup_attachments: bool = False, slim: bool = False,
+                 transcode: dict | None = None, index_path: str | None = None) -> list:
+    """
+    items を一括変換して結果 dict のリストを返す。
+    progress(done, total, result) が指定されていれば 1 件終わるごとに呼ぶ。
+    items がジェネレータのときは件数が分からないので total は None。
+    結果の並びは完了順（入力順ではない）。
+    """
+    total = len(items) if hasattr(items, "__len__") else None
+    results = []
+
+    for result in iter_convert(items, output_dir, save_external_images, workers,
+                               incremental, manifest_path, report_path, cancel,
+                               layout=layout, archive_path=archive_path,
+                               dedup_attachments=dedup_attachments, slim=slim,
+                               transcode=transcode, index_path=index_path):
+        results.append(result)
+        if progress:
+            progress(len(results), total, result)
+
+    return results
+
+
+# ============================================================
+# バッチ全体の集計
+# ============================================================
+def summarize(results) -> dict:
+    """
+    件数と外部画像キャッシュ・添付の重複排除・HTML の軽量化・画像の変換の集計。計測付きで変換した結果なら
+    段階ごとの所要時間のパーセンタイルも "metrics" に入れる。
+    """
+    summary = {"total": 0, "converted": 0, "skipped": 0, "failed": 0, "image_cache": {},
+               "dedup": {}, "slim": {}, "transcode": {}}
+    timings = metrics.Summary()
+
+    for r in results:
+        summary["total"] += 1
+        if r["error"]:
+            summary["failed"] += 1
+        elif r.get("skipped"):
+            summary["skipped"] += 1
+        else:
+            summary["converted"] += 1
+        image_cache.merge_stats(summary["image_cache"], r.get("image_cache"))
+        image_cache.merge_stats(summary["dedup"], r.get("dedup"))
+        image_cache.merge_stats(summary["slim"], r.get("slim"))
+        image_cache.merge_stats(summary["transcode"], r.get("transcode"))
+        timings.add(r)
+
+    if timings.seconds:
+        summary["metrics"] = timings.result()
+    return summary
\ No newline at end of file
@@ -0,0 +1,809 @@
+import os
+import re
+import sys
+import json
+import time
+import base64
+import pickle
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import http.server
+import tracemalloc
+import urllib.request
+from email.message import EmailMessage
+
+import metrics
+from common import (
+    FALLBACK_ENCODINGS,
+    decode_bytes,
+    replace_cid_images,
+    process_html,
+    name_attachments,
+)
+from writers import write_output
+
+
+# ============================================================
+# 計測ユーティリティ
+# ============================================================
+def measure(func, repeat: int = 3) -> dict:
+    """
+    func() の最短実行時間と、tracemalloc で見たメモリ確保量のピークを返す。
+    """
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def print_table(title: str, rows: dict):
+    print(title)
+    for name, r in rows.items():
+        print(f"  {name:<12} {r['seconds'] * 1000:9.1f} ms   peak {r['peak_bytes'] / 1024 / 1024:8.1f} MB")
+
+
+# ============================================================
+# 外部画像のダウンロード（ローカルの http.server に対して）
+#   接続の使い回し・ホスト単位の同時接続数・タイムアウト・サイズ上限を確かめる
+# ============================================================
+class _ImageHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+    disable_nagle_algorithm = True  # ヘッダーと本文を別々に送っても待たされないように
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.stats["connections"] += 1
+
+    def do_GET(self):
+        srv = self.server
+        with srv.lock:
+            srv.stats["requests"] += 1
+            srv.in_flight += 1
+            srv.stats["max_in_flight"] = max(srv.stats["max_in_flight"], srv.in_flight)
+
+        try:
+            if self.path == "/big.png":
+                self._send_big()
+                return
+
+            time.sleep(srv.slow if self.path == "/slow.png" else srv.delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(srv.image)))
+            self.end_headers()
+            self.wfile.write(srv.image)
+        finally:
+            with srv.lock:
+                srv.in_flight -= 1
+
+    def _send_big(self):
+        # Content-Length を付けないので、クライアントは読みながら上限を確かめるしかない
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        chunk = bytes(64 * 1024)
+        try:
+            for _ in range(self.server.big // len(chunk)):
+                self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            with self.server.lock:
+                self.server.stats["aborted"] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ImageServer(http.server.ThreadingHTTPServer):
+    """
+    /img/<n>.png は delay 秒待ってから小さな画像を返す。
+    /slow.png は応答まで slow 秒待ち、/big.png は Content-Length なしで big バイト返す。
+    受け付けた接続数と、同時に処理していたリクエスト数の最大を数える。
+    """
+    daemon_threads = True
+
+    def __init__(self, delay: float, slow: float, big: int):
+        super().__init__(("127.0.0.1", 0), _ImageHandler)
+        self.delay = delay
+        self.slow = slow
+        self.big = big
+        self.image = b"\x89PNG\r\n\x1a\n" + bytes(2048)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {}
+        self.take_stats()
+
+    def take_stats(self) -> dict:
+        """
+        前回呼び出し以降の集計を返してリセットする。
+        """
+        with self.lock:
+            result = self.stats
+            self.stats = {"connections": 0, "requests": 0, "max_in_flight": 0, "aborted": 0}
+        return result
+
+    def handle_error(self, request, client_address):
+        # タイムアウト・サイズ超過でクライアントが切った接続への書き込みは想定どおり
+        pass
+
+
+def _wait_until(cond, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def bench_downloader(count: int, delay_ms: float, per_host: int) -> bool:
+    """
+    ローカルの http.server から count 枚を、従来の逐次 urlretrieve と
+    download_images で取得して比べ、プールの動作を確かめる。すべて通れば True。
+    """
+    from downloader import download_images
+
+    # ローカルのサーバーには環境変数のプロキシを通さない
+    os.environ["no_proxy"] = "127.0.0.1"
+
+    server = _ImageServer(delay_ms / 1000, slow=3.0, big=64 * 1024 * 1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    urls = [f"{base}/img/{i}.png" for i in range(count)]
+
+    checks = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            t = time.perf_counter()
+            for i, url in enumerate(urls):
+                urllib.request.urlretrieve(url, os.path.join(tmp, f"{i}.png"))
+            sequential = time.perf_counter() - t
+            seq = server.take_stats()
+
+            save_dir = os.path.join(tmp, "pooled")
+            os.makedirs(save_dir)
+            t = time.perf_counter()
+            saved = download_images(urls, save_dir, max_per_host=per_host, cache=False)
+            pooled = time.perf_counter() - t
+            pool = server.take_stats()
+
+            print(f"downloader: {count} images, {delay_ms:g} ms per response, {per_host} per host")
+            print(f"  {'sequential':<12} {sequential * 1000:9.1f} ms   connections {seq['connections']:4d}")
+            print(f"  {'pooled':<12} {pooled * 1000:9.1f} ms   connections {pool['connections']:4d}"
+                  f"   max in flight {pool['max_in_flight']}")
+
+            checks.append(("all saved", len(saved) == count))
+            checks.append(("connections reused", 0 < pool["connections"] <= per_host))
+            checks.append(("per-host limit", pool["max_in_flight"] <= per_host))
+
+            # 受信タイムアウト: 応答を待ち続けずに諦める
+            t = time.perf_counter()
+            saved = download_images([f"{base}/slow.png"], save_dir, read_timeout=0.5, cache=False)
+            checks.append(("read timeout", not saved and time.perf_counter() - t < server.slow))
+
+            # サイズ上限: Content-Length が無くても上限を超えたところで接続を切る
+            saved = download_images([f"{base}/big.png"], save_dir, max_bytes=1024 * 1024,
+                                    cache=False)
+            checks.append(("max bytes", not saved and _wait_until(lambda: server.stats["aborted"])))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    for name, ok in checks:
+        print(f"  {name:<20} {'ok' if ok else 'NG'}")
+    return all(ok for _, ok in checks)
+
+
+# ============================================================
+# Outlook 風の大きな HTML 本文
+# ============================================================
+def make_outlook_html(size_mb: float, images: int = 200) -> tuple:
+    head = (
+        "<!--[if gte mso 9]><xml><o:OfficeDocumentSettings><o:AllowPNG/>"
+        "</o:OfficeDocumentSettings></xml><![endif]-->\n"
+        "<html xmlns:v=\"urn:schemas-microsoft-com:vml\" xmlns:o=\"urn:schemas-microsoft-com:office:office\">"
+        "<head><meta http-equiv=\"Content-Type\" content=\"text/html; charset=shift_jis\">"
+        "<style><!-- p.MsoNormal {margin:0mm; font-family:\"游ゴシック\",sans-serif;} --></style>"
+        "</head><body lang=\"JA\" link=\"#0563C1\"><div class=\"WordSection1\">"
+    )
+    para = (
+        "<p class=\"MsoNormal\"><span style=\"font-size:11.0pt;font-family:&quot;游ゴシック&quot;\">"
+        "お世話になっております。ご確認のほどよろしくお願いいたします。<o:p></o:p></span></p>\n"
+    )
+
+    attachments = []
+    parts = [head]
+    target = int(size_mb * 1024 * 1024)
+    size = len(head)
+    i = 0
+    while size < target:
+        if i < images:
+            name = f"image{i:03d}.png"
+            attachments.append({"filename": name})
+            img = (
+                f"<p class=\"MsoNormal\"><img width=\"200\" height=\"50\" "
+                f"src=\"cid:{name}@01DA0000.00000000\"></p>\n"
+                f"<p class=\"MsoNormal\"><img src=\"https://example.com/banner/{i}.jpg\"></p>\n"
+            )
+            parts.append(img)
+            size += len(img)
+        parts.append(para)
+        size += len(para)
+        i += 1
+
+    parts.append("</div></body></html>")
+    return "".join(parts), attachments
+
+
+# ============================================================
+# HTML 後処理：従来の多段処理 vs 1 パス
+#   legacy_* は process_html を入れる前の common の実装をそのまま残したもの（比較用）。
+#   common 側の関数は書き換わっていくので、ここから import しない。
+# ============================================================
+def legacy_ensure_meta_charset(html: str) -> str:
+    if "<meta charset" in html.lower():
+        return html
+
+    return html.replace(
+        "<head>",
+        '<head><meta charset="UTF-8">'
+    )
+
+
+def legacy_normalize_html(html: str) -> str:
+    lower = html.lower()
+
+    # MSO コメントを先頭に残す
+    prefix = ""
+    m = re.match(r'^(<!--\[if.*?endif\]-->\s*)', html, flags=re.I | re.S)
+    if m:
+        prefix = m.group(1)
+        html = html[len(prefix):]
+        lower = html.lower()
+
+    # <html> が無ければ追加
+    if "<html" not in lower:
+        html = "<html>" + html + "</html>"
+        lower = html.lower()
+
+    # <head> が無ければ追加
+    if "<head" not in lower:
+        html = html.replace("<html>", "<html><head></head>")
+        lower = html.lower()
+
+    # <body> が無ければ追加
+    if "<body" not in lower:
+        html = html.replace("</head>", "</head><body>")
+        if "</body>" not in lower:
+            html += "</body>"
+
+    return prefix + html
+
+
+def legacy_replace_cid_images(html: str, attachments: list, subfolder: str) -> str:
+    for att in attachments:
+        fname = att["filename"]
+        base, ext = os.path.splitext(fname)
+
+        # cid:image001.png または cid:image001.png@xxxx
+        pattern = rf'cid:{re.escape(base)}[^"\']*'
+
+        local_path = f"{subfolder}/{fname}"
+
+        html = re.sub(pattern, local_path, html, flags=re.I)
+
+    return html
+
+
+def legacy_replace_urls(html: str, mapping: dict) -> str:
+    if not mapping:
+        return html
+
+    pattern = "|".join(re.escape(u) for u in sorted(mapping, key=len, reverse=True))
+    return re.sub(pattern, lambda m: mapping[m.group(0)], html)
+
+
+def bench_postprocess(size_mb: float, repeat: int):
+    html, attachments = make_outlook_html(size_mb)
+
+    def fake_download(urls):
+        return {u: "x_files/" + u.rsplit("/", 1)[-1] for u in urls}
+
+    def chain(replace_cid):
+        def run():
+            h = legacy_normalize_html(html)
+            h = legacy_ensure_meta_charset(h)
+            h = replace_cid(h, attachments, "x_files")
+            urls = [
+                src for src in re.findall(r'<img[^>]+src=["\']([^"\']+)["\']', h)
+                if src.startswith("http://") or src.startswith("https://")
+            ]
+            return legacy_replace_urls(h, fake_download(urls))
+        return run
+
+    def single_pass():
+        return process_html(html, attachments, "x_files", fake_download)
+
+    # legacy は添付 1 つごとに本文全体を置換するので、5 MB で 10 秒以上かかる（1 回だけ測る）
+    print_table(
+        f"postprocess ({len(html) / 1024 / 1024:.1f} MB, {len(attachments)} cid images)",
+        {"legacy": measure(chain(legacy_replace_cid_images), 1),
+         "cid-index": measure(chain(replace_cid_images), repeat),
+         "single-pass": measure(single_pass, repeat)},
+    )
+
+
+# ============================================================
+# 文字コード判定：従来の総当たり vs サンプル判定
+# ============================================================
+JAPANESE_LINES = (
+    "いつもお世話になっております。株式会社サンプルの山田です。",
+    "先日ご依頼いただいた見積書を添付いたしますので、ご確認ください。",
+    "会議は来週月曜日の午後三時から第二会議室で行います。",
+    "ご不明な点がございましたら、お気軽にお問い合わせください。",
+    "本メールは送信専用アドレスから配信しています。",
+    "Order No. 12345 / 合計金額：１２，３４０円（税込）",
+    "ｶﾀｶﾅの半角表記が混ざることもあります。",
+)
+CP932_ONLY_LINES = ("①②③ ㈱ ㍉ ≒ ∵ 髙﨑",)
+
+
+def legacy_decode(data: bytes, charset: str | None) -> str:
+    """
+    検出段階を入れる前の decode_bytes（比較用）。
+    """
+    if charset:
+        try:
+            return data.decode(charset, errors="replace")
+        except Exception:
+            pass
+
+    for enc in FALLBACK_ENCODINGS:
+        try:
+            return data.decode(enc)
+        except Exception:
+            continue
+
+    return data.decode("utf-8", errors="replace")
+
+
+def make_charset_corpus(count: int, seed: int = 0) -> list:
+    """
+    (文字コード, 元テキスト, charset ヘッダー無しのバイト列) のリスト。
+    UTF-8 / cp932 / EUC-JP / ISO-2022-JP / ASCII を混ぜ、大きい本文も含める。
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        enc = rng.choice(("utf-8", "cp932", "euc-jp", "iso-2022-jp", "ascii"))
+        lines = rng.randint(5, 40) if i % 10 else rng.randint(20000, 60000)
+
+        if enc == "ascii" or i % 7 == 0:
+            # ログ出力などほぼ ASCII の本文（日本語は末尾の署名だけ）
+            text = "\n".join(f"Line {n}: status OK, see https://example.com/{n}" for n in range(lines))
+            if enc != "ascii":
+                text += "\n" + JAPANESE_LINES[0]
+        else:
+            pool = JAPANESE_LINES + (CP932_ONLY_LINES if enc == "cp932" else ())
+            if enc == "iso-2022-jp":
+                # 半角カナは ISO-2022-JP（RFC 1468）では表せない
+                pool = tuple(p for p in pool if "ｶ" not in p)
+            text = "\n".join(rng.choice(pool) for _ in range(lines))
+
+        corpus.append((enc, text, text.encode(enc)))
+    return corpus
+
+
+def bench_charset(count: int, seed: int, repeat: int):
+    corpus = make_charset_corpus(count, seed)
+    total = sum(len(data) for _, _, data in corpus)
+
+    def run(decode, items):
+        return lambda: [decode(data, None) for _, _, data in items]
+
+    rows = {"legacy": measure(run(legacy_decode, corpus), repeat),
+            "detect": measure(run(decode_bytes, corpus), repeat)}
+    print_table(f"charset ({len(corpus)} bodies, {total / 1024 / 1024:.1f} MB)", rows)
+
+    # 文字コードごとの時間と正答率（元テキストに戻せた割合）
+    for enc in sorted({e for e, _, _ in corpus}):
+        items = [c for c in corpus if c[0] == enc]
+        line = f"  {enc:<12}"
+        for name, decode in (("legacy", legacy_decode), ("detect", decode_bytes)):
+            ok = sum(decode(data, None) == text for _, text, data in items) / len(items)
+            sec = measure(run(decode, items), repeat)["seconds"]
+            line += f" {name} {sec * 1000:7.1f} ms {ok:6.1%}  "
+        print(line)
+
+
+# ============================================================
+# 合成コーパスの生成（seed が同じなら毎回同じ内容）
+# ============================================================
+CORPUS_KINDS = ("iso2022_text", "outlook_html", "msg_inline", "large_attachment")
+CORPUS_INDEX = "corpus.json"
+MSG_FIXTURE_EXT = ".msgdata"    # write_output に渡す msg_data を pickle したもの
+
+
+def fake_image(rng: random.Random, size: int) -> bytes:
+    return b"\x89PNG\r\n\x1a\n" + rng.randbytes(size)
+
+
+def write_iso2022_text(path: str, rng: random.Random, lines: int):
+    pool = tuple(p for p in JAPANESE_LINES if "ｶ" not in p)
+    msg = EmailMessage()
+    msg["Subject"] = "お見積りの件"
+    msg["From"] = "sender@example.com"
+    msg["To"] = "receiver@example.com"
+    msg.set_content("\n".join(rng.choice(pool) for _ in range(lines)) + "\n",
+                    charset="iso-2022-jp")
+    with open(path, "wb") as f:
+        f.write(msg.as_bytes())
+
+
+def write_outlook_html(path: str, rng: random.Random, size_mb: float, images: int):
+    html, attachments = make_outlook_html(size_mb, images)
+    msg = EmailMessage()
+    msg["Subject"] = "定例会議の資料"
+    msg["From"] = "sender@example.com"
+    msg["To"] = "receiver@example.com"
+    msg.set_content("HTML 形式のメールです。\n", charset="iso-2022-jp")
+    msg.add_alternative(html, subtype="html", charset="shift_jis", cte="quoted-printable")
+
+    related = msg.get_payload()[1]
+    for att in attachments:
+        related.add_related(fake_image(rng, rng.randint(2000, 8000)), "image", "png",
+                            cid=f"<{att['filename']}@01DA0000.00000000>",
+                            filename=att["filename"])
+
+    # email パッケージの boundary は乱数なので、再現できるよう固定する
+    for n, part in enumerate(p for p in msg.walk() if p.is_multipart()):
+        part.set_boundary(f"==bench-boundary-{n}==")
+
+    with open(path, "wb") as f:
+        f.write(msg.as_bytes())
+
+
+def write_msg_fixture(path: str, rng: random.Random, size_mb: float, images: int):
+    """
+    インライン画像の多い MSG 相当の msg_data（parse_msg_via_library の戻り値と同じ形）。
+    MSG ファイル自体は extract_msg で書けないため、解析後の段階から計測する。
+    """
+    html, attachments = make_outlook_html(size_mb, images)
+    for att in attachments:
+        att["content_id"] = f"{att['filename']}@01DA0000.00000000"
+        att["data"] = fake_image(rng, rng.randint(2000, 8000))
+
+    msg_data = {"subject": "画像の多いメール", "body_html": html, "body_text": "",
+                "attachments": attachments}
+    with open(path, "wb") as f:
+        pickle.dump(msg_data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def write_large_attachment(path: str, rng: random.Random, size_mb: float):
+    """
+    巨大な添付付きの EML。メモリに載せず base64 をチャンク単位で書き出す。
+    """
+    boundary = "==bench-boundary=="
+    with open(path, "wb") as f:
+        f.write(
+            "Subject: =?utf-8?b?5aSn5a656YeP44Gu5re75LuY?=\n"
+            "From: sender@example.com\n"
+            "To: receiver@example.com\n"
+            "MIME-Version: 1.0\n"
+            f"Content-Type: multipart/mixed; boundary=\"{boundary}\"\n\n"
+            f"--{boundary}\n"
+            "Content-Type: text/plain; charset=\"utf-8\"\n"
+            "Content-Transfer-Encoding: 8bit\n\n".encode("ascii")
+        )
+        f.write((JAPANESE_LINES[1] + "\n").encode("utf-8"))
+        f.write(
+            f"--{boundary}\n"
+            "Content-Type: application/octet-stream\n"
+            "Content-Transfer-Encoding: base64\n"
+            "Content-Disposition: attachment; filename=\"archive.bin\"\n\n".encode("ascii")
+        )
+
+        # 57 バイトの倍数ごとに encodebytes すると 76 文字の行がきれいに並ぶ
+        remaining = int(size_mb * 1024 * 1024)
+        while remaining > 0:
+            n = min(remaining, 57 * 16384)
+            f.write(base64.encodebytes(rng.randbytes(n)))
+            remaining -= n
+
+        f.write(f"--{boundary}--\n".encode("ascii"))
+
+
+def generate_corpus(out_dir: str, count: int = 20, seed: int = 0,
+                    html_mb: float = 2, images: int = 150, attachment_mb: float = 256,
+                    large_count: int = 1) -> dict:
+    """
+    out_dir/<種類>/ に合成メールを書き出し、内容を corpus.json に記録する。
+    """
+    rng = random.Random(seed)
+    params = {"count": count, "seed": seed, "html_mb": html_mb, "images": images,
+              "attachment_mb": attachment_mb, "large_count": large_count}
+    kinds = {}
+
+    for kind in CORPUS_KINDS:
+        folder = os.path.join(out_dir, kind)
+        os.makedirs(folder, exist_ok=True)
+        n = large_count if kind == "large_attachment" else count
+        ext = MSG_FIXTURE_EXT if kind == "msg_inline" else ".eml"
+
+        for i in range(n):
+            path = os.path.join(folder, f"{kind}_{i:04d}{ext}")
+            if kind == "iso2022_text":
+                write_iso2022_text(path, rng, rng.randint(20, 400))
+            elif kind == "outlook_html":
+                write_outlook_html(path, rng, html_mb, rng.randint(1, 20))
+            elif kind == "msg_inline":
+                write_msg_fixture(path, rng, html_mb / 4, images)
+            else:
+                write_large_attachment(path, rng, attachment_mb)
+        kinds[kind] = n
+
+    index = {"params": params, "kinds": kinds}
+    with open(os.path.join(out_dir, CORPUS_INDEX), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    return index
+
+
+# ============================================================
+# 段階ごとの計測
+# ============================================================
+class StageTimer:
+    """
+    timer(func, *args) のように変換を 1 通分呼ぶと、その間の metrics の記録
+    （metrics.take()）から段階名ごとの経過時間を積算する。
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    def __call__(self, func, *args):
+        metrics.begin(True)
+        try:
+            result = func(*args)
+        finally:
+            report = metrics.take()
+        for stage, rec in report["stages"].items():
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + rec["seconds"]
+        return result
+
+
+def run_eml(timer: StageTimer, path: str, out_dir: str):
+    """
+    eml_to_html をそのまま呼ぶ（段階の内訳は metrics から取る）。
+    """
+    from eml_converter import eml_to_html
+
+    timer(eml_to_html, path, out_dir)
+
+
+def run_msg(timer: StageTimer, path: str, out_dir: str):
+    """
+    msg_to_html をそのまま呼ぶ。
+    .msgdata（合成 fixture）は解析済みの msg_data を読み込み、write_output から計測する。
+    """
+    if path.endswith(MSG_FIXTURE_EXT):
+        with open(path, "rb") as f:
+            msg_data = pickle.load(f)
+        name_attachments(msg_data["attachments"])
+        base = os.path.splitext(os.path.basename(path))[0]
+        timer(write_output, msg_data, out_dir, base, False)
+    else:
+        from msg_converter import msg_to_html
+        timer(msg_to_html, path, out_dir, False)
+
+
+def _peak_rss_bytes() -> int | None:
+    try:
+        import resource
+    except ImportError:
+        # Windows には resource モジュールが無い
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def bench_files(paths: list, work_dir: str, memory_samples: int = 2) -> dict:
+    """
+    paths を 1 通ずつ変換し、段階ごとの時間・スループット・メモリのピークを返す。
+    出力は 1 通ごとに消すので、巨大な添付でもディスクは 1 通分しか使わない。
+    メモリは tracemalloc を有効にした別パスで先頭 memory_samples 通だけ測る
+    （tracemalloc は遅く、時間の計測を歪めるため）。
+    """
+    timer = StageTimer()
+    total_bytes = 0
+    elapsed = 0.0
+
+    def convert(path):
+        out_dir = os.path.join(work_dir, "out")
+        os.makedirs(out_dir, exist_ok=True)
+        try:
+            if path.lower().endswith(".eml"):
+                run_eml(timer, path, out_dir)
+            else:
+                run_msg(timer, path, out_dir)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    for path in paths:
+        total_bytes += os.path.getsize(path)
+        t = time.perf_counter()
+        convert(path)
+        elapsed += time.perf_counter() - t
+
+    # 時間の計測結果を残したまま、メモリ計測用にもう一度流す
+    stages = dict(timer.seconds)
+    peak = 0
+    for path in paths[:memory_samples]:
+        tracemalloc.start()
+        try:
+            convert(path)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+    mb = total_bytes / 1024 / 1024
+    return {
+        "messages": len(paths),
+        "bytes": total_bytes,
+        "seconds": elapsed,
+        "messages_per_s": len(paths) / elapsed if elapsed else None,
+        "mb_per_s": mb / elapsed if elapsed else None,
+        "stages": stages,
+        "peak_traced_bytes": peak,
+    }
+
+
+def bench_corpus(corpus_dir: str, msg_dir: str | None, kinds: list | None,
+                 memory_samples: int, json_path: str | None) -> dict:
+    from manifest import CONVERTER_VERSION
+
+    with open(os.path.join(corpus_dir, CORPUS_INDEX), encoding="utf-8") as f:
+        index = json.load(f)
+
+    groups = {}
+    for kind in index["kinds"]:
+        if kinds and kind not in kinds:
+            continue
+        folder = os.path.join(corpus_dir, kind)
+        groups[kind] = sorted(os.path.join(folder, n) for n in os.listdir(folder))
+
+    # 実際の MSG は extract_msg が入っている環境でのみ計測できる
+    if msg_dir:
+        groups["msg_files"] = sorted(
+            os.path.join(msg_dir, n) for n in os.listdir(msg_dir) if n.lower().endswith(".msg")
+        )
+
+    work_dir = os.path.join(corpus_dir, "_work")
+    results = {}
+    try:
+        for kind, paths in groups.items():
+            if not paths:
+                continue
+            r = bench_files(paths, work_dir, memory_samples)
+            results[kind] = r
+
+            stages = "  ".join(f"{k} {v * 1000:.0f}" for k, v in r["stages"].items())
+            print(f"{kind:<18} {r['messages']:5d} msgs {r['bytes'] / 1024 / 1024:9.1f} MB"
+                  f" {r['messages_per_s']:9.1f} msg/s {r['mb_per_s']:8.1f} MB/s"
+                  f"   peak {r['peak_traced_bytes'] / 1024 / 1024:7.1f} MB")
+            print(f"{'':<18} stages (ms): {stages}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "converter_version": CONVERTER_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": index["params"],
+        "kinds": results,
+        "max_rss_bytes": _peak_rss_bytes(),
+    }
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    return report
+
+
+def compare_reports(old_path: str, new_path: str):
+    """
+    2 つの JSON レポートの種類ごとのスループット比（new / old）を表示する。
+    """
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"{old['converter_version']} -> {new['converter_version']}")
+    for kind, n in new["kinds"].items():
+        o = old["kinds"].get(kind)
+        if not o or not o["messages_per_s"] or not n["messages_per_s"]:
+            continue
+        speed = n["messages_per_s"] / o["messages_per_s"]
+        memory = n["peak_traced_bytes"] / o["peak_traced_bytes"] if o["peak_traced_bytes"] else 0
+        print(f"  {kind:<18} throughput x{speed:5.2f}   peak memory x{memory:5.2f}")
+
+
+# ============================================================
+# エントリーポイント
+# ============================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="email2html benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("downloader", help="pooled image downloads against a local http.server")
+    p.add_argument("--count", type=int, default=40)
+    p.add_argument("--delay-ms", type=float, default=20)
+    p.add_argument("--per-host", type=int, default=4)
+
+    p = sub.add_parser("postprocess", help="HTML post-processing on a large Outlook body")
+    p.add_argument("--size-mb", type=float, default=5)
+    p.add_argument("--repeat", type=int, default=3)
+
+    p = sub.add_parser("charset", help="charset detection on a mixed-encoding corpus")
+    p.add_argument("--count", type=int, default=200)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--repeat", type=int, default=3)
+
+    p = sub.add_parser("corpus", help="generate a reproducible synthetic corpus")
+    p.add_argument("out_dir")
+    p.add_argument("--count", type=int, default=20, help="messages per kind")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--html-mb", type=float, default=2, help="size of each Outlook HTML body")
+    p.add_argument("--images", type=int, default=150, help="inline images per MSG fixture")
+    p.add_argument("--attachment-mb", type=float, default=256)
+    p.add_argument("--large-count", type=int, default=1, help="messages with a huge attachment")
+
+    p = sub.add_parser("run", help="convert a corpus and time each stage")
+    p.add_argument("corpus_dir")
+    p.add_argument("--kind", action="append", choices=CORPUS_KINDS, help="only these kinds")
+    p.add_argument("--msg-dir", help="folder of real .msg files (needs extract_msg)")
+    p.add_argument("--memory-samples", type=int, default=2)
+    p.add_argument("--json", help="write the report to this file")
+
+    p = sub.add_parser("compare", help="compare two JSON reports")
+    p.add_argument("old")
+    p.add_argument("new")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "downloader":
+        return 0 if bench_downloader(args.count, args.delay_ms, args.per_host) else 1
+    elif args.command == "postprocess":
+        bench_postprocess(args.size_mb, args.repeat)
+    elif args.command == "charset":
+        bench_charset(args.count, args.seed, args.repeat)
+    elif args.command == "corpus":
+        index = generate_corpus(args.out_dir, args.count, args.seed, args.html_mb, args.images,
+                                args.attachment_mb, args.large_count)
+        print(json.dumps(index["kinds"]))
+    elif args.command == "run":
+        bench_corpus(args.corpus_dir, args.msg_dir, args.kind, args.memory_samples, args.json)
+    elif args.command == "compare":
+        compare_reports(args.old, args.new)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,315 @@
+import os
+import sys
+import time
+import argparse
+
+from sources import expand_targets, is_supported
+
+
+# ============================================================
+# コマンドライン版（tkinter は読み込まない）
+#   python -m email2html [オプション] 入力...
+# ============================================================
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="email2html",
+        description="Convert EML / MSG files, mbox files, Maildir trees and folders to HTML.",
+    )
+    parser.add_argument("inputs", nargs="*", metavar="INPUT",
+                        help=".eml / .msg / mbox file, Maildir or folder")
+    parser.add_argument("-o", "--output-dir",
+                        help="write all HTML here (default: next to each input)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes (default: number of CPUs)")
+    parser.add_argument("--images", action="store_true",
+                        help="download external http/https images")
+    parser.add_argument("--layout", choices=("files", "single", "mhtml"), default="files",
+                        help="files: .html + _files folder (default), "
+                             "single: one .html with embedded images and attachments, "
+                             "mhtml: one .mht file")
+    parser.add_argument("--archive", metavar="FILE",
+                        help="write all output into one .zip / .tar / .tar.gz file")
+    parser.add_argument("--dedup", action="store_true",
+                        help="store identical attachments once per output folder and "
+                             "hard-link them into each message's _files folder")
+    parser.add_argument("--slim", action="store_true",
+                        help="shrink HTML bodies: drop Outlook-only markup, share repeated "
+                             "inline styles and collapse whitespace")
+    parser.add_argument("--transcode-images", metavar="FORMAT",
+                        choices=("auto", "png", "webp", "jpeg"),
+                        help="re-encode bulky images shown in the message body (BMP, TIFF, "
+                             "large screenshots) as auto / png / webp / jpeg; needs Pillow")
+    parser.add_argument("--max-image-size", type=int, metavar="PX",
+                        help="with --transcode-images, also shrink body images to at most "
+                             "PX pixels wide and high")
+    parser.add_argument("--keep-original-images", action="store_true",
+                        help="with --transcode-images, keep the original image files in "
+                             "the _files folder")
+    parser.add_argument("--scan", metavar="FILE",
+                        help="do not convert; read headers only and write subject / from / date / "
+                             "size / attachment count of every message to a .csv or .jsonl "
+                             "file ('-' for CSV on stdout)")
+    parser.add_argument("--index", metavar="FILE",
+                        help="while converting, add subject / from / to / body text / attachment "
+                             "names to a full-text search index (SQLite) in FILE")
+    parser.add_argument("--search", metavar="QUERY",
+                        help="do not convert; print the outputs in the --index FILE that contain "
+                             "every word of QUERY (from:, to:, subject:, attachment: limit a word "
+                             "to one field)")
+    parser.add_argument("--max-results", type=int, default=50, metavar="N",
+                        help="with --search, print at most N outputs (default: 50)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip messages unchanged since the last run")
+    parser.add_argument("--manifest", help="manifest file for --incremental")
+    parser.add_argument("--report", help="write a per-file JSONL report with stage timings")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every file")
+    parser.add_argument("-q", "--quiet", action="store_true", help="print errors only")
+
+    server = parser.add_argument_group("resident server")
+    server.add_argument("--serve", action="store_true",
+                        help="run a server that keeps worker processes warm")
+    server.add_argument("--stop-server", action="store_true", help="stop the running server")
+    server.add_argument("--no-server", action="store_true",
+                        help="convert in this process even if a server is running")
+    return parser
+
+
+def forward_to_server(args):
+    """
+    常駐サーバーが動いていれば変換を任せ、結果のイテレータを返す（動いていなければ None）。
+    最初の結果より前にサーバーが失敗したときも None（このプロセスで変換し直す）。
+    """
+    import server
+
+    if server.read_state() is None:
+        return None
+
+    results = server.submit(args.inputs, args.output_dir, args.images, args.incremental,
+                            args.manifest, args.report,
+                            layout=args.layout, archive_path=args.archive,
+                            dedup_attachments=args.dedup, slim=args.slim,
+                            transcode=args.transcode, index_path=args.index)
+    try:
+        first = next(results)
+    except (server.ServerUnavailable, server.ServerError, EOFError, OSError):
+        return None
+    except StopIteration:
+        return iter(())
+    return _server_results(first, results)
+
+
+def _server_results(first: dict, results):
+    """
+    途中でサーバーが失敗・停止したら、それを 1 件の失敗として返して終わる
+    （変換済みの分はそのまま。残りは変換されていない）。
+    """
+    import server
+
+    yield first
+    try:
+        yield from results
+    except (server.ServerError, EOFError, OSError) as e:
+        yield {"path": "server", "output": None, "error": str(e) or type(e).__name__}
+
+
+def run_search(args) -> int:
+    """
+    --search：索引から検索し、一致した出力のパスを関連の高い順に 1 行ずつ書く。
+    -v なら日付・件名も書く。1 件も無ければ終了コード 1。
+    """
+    import sqlite3
+    import search_index
+
+    started = time.perf_counter()
+    try:
+        hits = search_index.search(args.index, args.search, args.max_results)
+    except (FileNotFoundError, sqlite3.Error) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+    for hit in hits:
+        if args.verbose:
+            print(f"{hit['date'] or '-'}\t{hit['subject'] or ''}\t{hit['output']}")
+        else:
+            print(hit["output"])
+
+    if not args.quiet:
+        elapsed = time.perf_counter() - started
+        print(f"{len(hits)} found in {elapsed * 1000:.0f} ms", file=sys.stderr)
+    return 0 if hits else 1
+
+
+def run_scan(args) -> int:
+    """
+    --scan：変換せずにヘッダーだけを読み、一覧を CSV / JSONL に書く。
+    """
+    from inventory import InventoryWriter, iter_scan
+
+    failed = 0
+    started = time.perf_counter()
+    targets = expand_targets(args.inputs, args.output_dir)
+    # 一覧を標準出力に書くときは混ざらないよう、進捗は標準エラーへ
+    out = sys.stderr if args.scan == "-" else sys.stdout
+
+    try:
+        with InventoryWriter(args.scan) as writer:
+            for row in iter_scan(targets):
+                writer.add(row)
+                if row["error"]:
+                    failed += 1
+                    print(f"error: {row['path']}: {row['error']}", file=sys.stderr)
+                elif args.verbose:
+                    print(f"scan   {row['path']}", file=out)
+    except KeyboardInterrupt:
+        print("interrupted", file=sys.stderr)
+        return 130
+
+    if not args.quiet:
+        elapsed = time.perf_counter() - started
+        rate = writer.count / elapsed if elapsed > 0 else 0.0
+        print(f"{writer.count} scanned, {failed} failed in {elapsed:.2f}s ({rate:.1f} files/s)",
+              file=out)
+        if args.scan != "-":
+            print(f"inventory: {args.scan}", file=out)
+
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    """
+    終了コード：0 = すべて成功、1 = 変換できなかったメールがある、2 = 引数の誤り。
+    --search は 1 件も見つからなければ 1。
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        from server import serve
+        return serve(args.workers)
+
+    if args.stop_server:
+        from server import stop
+        if not stop():
+            print("email2html server is not running", file=sys.stderr)
+            return 1
+        return 0
+
+    if args.search is not None:
+        if not args.index:
+            parser.error("--search needs --index FILE")
+        if args.max_results < 1:
+            parser.error("--max-results must be 1 or more")
+        return run_search(args)
+
+    if not args.inputs:
+        parser.error("no input files")
+
+    for p in args.inputs:
+        if not os.path.exists(p):
+            parser.error(f"no such file or directory: {p}")
+        if not is_supported(p):
+            parser.error(f"not an EML / MSG / mbox file: {p}")
+
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be 1 or more")
+
+    if args.scan:
+        if args.scan != "-" and not args.scan.lower().endswith((".csv", ".jsonl")):
+            parser.error("--scan must end with .csv or .jsonl (or be '-')")
+        return run_scan(args)
+
+    if args.archive:
+        if not args.archive.lower().endswith((".zip", ".tar", ".tar.gz", ".tgz")):
+            parser.error("--archive must end with .zip, .tar, .tar.gz or .tgz")
+        if args.incremental:
+            parser.error("--archive cannot be combined with --incremental")
+        if args.output_dir:
+            parser.error("--archive cannot be combined with --output-dir")
+
+    if args.dedup and (args.archive or args.layout != "files"):
+        parser.error("--dedup works only with --layout files and without --archive")
+
+    args.transcode = None
+    if args.transcode_images:
+        import image_transcode
+        if args.archive or args.layout != "files":
+            parser.error("--transcode-images works only with --layout files and without --archive")
+        if args.max_image_size is not None and args.max_image_size < 1:
+            parser.error("--max-image-size must be 1 or more")
+        if not image_transcode.available():
+            parser.error("--transcode-images needs Pillow (pip install Pillow)")
+        args.transcode = image_transcode.make_options(args.transcode_images, args.max_image_size,
+                                                      args.keep_original_images)
+    elif args.max_image_size is not None or args.keep_original_images:
+        parser.error("--max-image-size and --keep-original-images need --transcode-images")
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    counts = {"converted": 0, "skipped": 0, "failed": 0}
+    linked = {"linked": 0, "bytes_saved": 0}
+    slimmed = {"bytes_in": 0, "bytes_out": 0}
+    transcoded = {"images": 0, "bytes_in": 0, "bytes_out": 0, "failed": 0}
+    started = time.perf_counter()
+
+    results = None if args.no_server else forward_to_server(args)
+    if results is None:
+        # 変換部分（image_cache / manifest など）はサーバーに任せない場合だけ読み込む
+        from batch import iter_convert
+
+        targets = expand_targets(args.inputs, args.output_dir)
+        results = iter_convert(targets, args.output_dir, args.images, args.workers,
+                               args.incremental, args.manifest, args.report,
+                               layout=args.layout, archive_path=args.archive,
+                               dedup_attachments=args.dedup, slim=args.slim,
+                               transcode=args.transcode, index_path=args.index)
+
+    try:
+        for r in results:
+            if r["error"]:
+                counts["failed"] += 1
+                print(f"error: {r['path']}: {r['error']}", file=sys.stderr)
+            elif r.get("skipped"):
+                counts["skipped"] += 1
+                if args.verbose:
+                    print(f"skip   {r['path']}")
+            else:
+                counts["converted"] += 1
+                for k in linked:
+                    linked[k] += (r.get("dedup") or {}).get(k, 0)
+                for k in slimmed:
+                    slimmed[k] += (r.get("slim") or {}).get(k, 0)
+                for k in transcoded:
+                    transcoded[k] += (r.get("transcode") or {}).get(k, 0)
+                if args.verbose:
+                    print(f"ok     {r['path']} -> {r['output']}")
+    except KeyboardInterrupt:
+        print("interrupted", file=sys.stderr)
+        return 130
+
+    if not args.quiet:
+        elapsed = time.perf_counter() - started
+        total = sum(counts.values())
+        rate = total / elapsed if elapsed > 0 else 0.0
+        print(f"{counts['converted']} converted, {counts['skipped']} skipped, "
+              f"{counts['failed']} failed in {elapsed:.2f}s ({rate:.1f} files/s)")
+        if args.dedup:
+            print(f"dedup: {linked['linked']} attachments linked, "
+                  f"{linked['bytes_saved'] / 1024 / 1024:.1f} MB not written")
+        if args.slim:
+            mb_in = slimmed["bytes_in"] / 1024 / 1024
+            mb_out = slimmed["bytes_out"] / 1024 / 1024
+            print(f"slim: HTML {mb_in:.1f} MB -> {mb_out:.1f} MB ({mb_in - mb_out:.1f} MB saved)")
+        if args.transcode:
+            mb_in = transcoded["bytes_in"] / 1024 / 1024
+            mb_out = transcoded["bytes_out"] / 1024 / 1024
+            print(f"images: {transcoded['images']} re-encoded, {mb_in:.1f} MB -> {mb_out:.1f} MB"
+                  + (f", {transcoded['failed']} could not be read" if transcoded["failed"] else ""))
+        if args.archive:
+            print(f"archive: {args.archive}")
+        if args.index:
+            print(f"index: {args.index}")
+        if args.report:
+            print(f"report: {args.report}")
+
+    return 1 if counts["failed"] else 0
\ No newline at end of file
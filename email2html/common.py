@@ -1,12 +1,41 @@
 import os
 import re
-import urllib.request
+import threading
 import urllib.parse
+from html import escape
+
+import dedup
+import html_slim
+import metrics
 
 
 # ============================================================
 # 文字コード処理
 # ============================================================
+FALLBACK_ENCODINGS = ("utf-8", "cp932", "shift_jis", "iso-2022-jp", "euc-jp")
+DETECT_WINDOW = 4 * 1024
+
+_BOMS = (
+    (b"\xef\xbb\xbf", "utf-8-sig"),
+    (b"\xff\xfe", "utf-16"),
+    (b"\xfe\xff", "utf-16"),
+)
+_ISO2022_ESCAPES = (b"\x1b$B", b"\x1b$@", b"\x1b(J", b"\x1b(I", b"\x1b$(D")
+# EUC-JP には出ない（SS2 / SS3 の 0x8E / 0x8F を除く）が、Shift_JIS では
+# かな・漢字の 1 バイト目や 2 バイト目によく出るバイト
+_SJIS_ONLY_RE = re.compile(rb"[\x80-\x8d\x90-\xa0]")
+
+
+def _japanese_order(data: bytes, start: int) -> tuple:
+    """
+    UTF-8 でない 8bit の本文を、どちらの文字コードから厳密にデコードしてみるか。
+    最初の UTF-8 でないバイト start から DETECT_WINDOW バイトだけを見る。
+    """
+    if _SJIS_ONLY_RE.search(data, start, start + DETECT_WINDOW):
+        return ("cp932", "euc-jp")
+    return ("euc-jp", "cp932")
+
+
 def decode_bytes(data: bytes, charset: str | None) -> str:
     if charset:
         try:
@@ -14,7 +43,33 @@ def decode_bytes(data: bytes, charset: str | None) -> str:
         except Exception:
             pass
 
-    for enc in ("utf-8", "cp932", "shift_jis", "iso-2022-jp", "euc-jp"):
+    for bom, enc in _BOMS:
+        if data.startswith(bom):
+            return data.decode(enc, errors="replace")
+
+    # ASCII / UTF-8 はこの 1 回で済む。失敗したら失敗位置から先を見て判定する
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError as e:
+        start = e.start
+    else:
+        # 7bit のみでエスケープシーケンスがあれば ISO-2022-JP
+        if "\x1b" in text and any(esc in data for esc in _ISO2022_ESCAPES):
+            try:
+                return data.decode("iso-2022-jp")
+            except UnicodeDecodeError:
+                pass
+        return text
+
+    # cp932 / EUC-JP は、それらしい方から厳密にデコードしてみる
+    for enc in _japanese_order(data, start):
+        try:
+            return data.decode(enc)
+        except UnicodeDecodeError:
+            continue
+
+    # どちらでも壊れていた場合は従来どおり順に試す
+    for enc in FALLBACK_ENCODINGS:
         try:
             return data.decode(enc)
         except Exception:
@@ -26,185 +81,599 @@ def decode_bytes(data: bytes, charset: str | None) -> str:
 # ============================================================
 # ファイル名の重複回避
 # ============================================================
-def ensure_unique(path: str) -> str:
-    if not os.path.exists(path):
-        return path
-
-    base, ext = os.path.splitext(path)
-    i = 1
-    while True:
-        new = f"{base}({i}){ext}"
-        if not os.path.exists(new):
-            return new
+def unique_name(name: str, used: set, counters: dict | None = None) -> str:
+    """
+    used（同じメール内で使用済みの名前）と重ならないよう name(1) のように連番を付ける。
+    決めた名前は used に追加する。
+    counters（名前 → 次に試す連番）を渡すと、同じ名前が続いても 1 から数え直さない。
+    """
+    key = name.lower()
+    i = counters.get(key, 0) if counters is not None else 0
+    base, ext = os.path.splitext(name)
+    new = f"{base}({i}){ext}" if i else name
+    while new.lower() in used:
         i += 1
+        new = f"{base}({i}){ext}"
+    used.add(new.lower())
+    if counters is not None:
+        counters[key] = i + 1
+    return new
+
+
+class NameAllocator:
+    """
+    1 つのフォルダに書き出すファイルの名前を、既存のファイルと重ならないよう決める。
+    フォルダは最初に 1 回だけ一覧し、以降は使用済みの名前（小文字）を set で持つので、
+    同じ名前が何百個あっても os.path.exists を繰り返さない。
+    reserve した名前は O_EXCL で空ファイルとして作るため、同じフォルダに
+    書き込む別のスレッド・プロセスとも重ならない。
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self._used = set()
+        self._listed = False
+        self._next = {}     # 名前（小文字）→ 次に試す連番
+        self._lock = threading.Lock()
+
+    def _list(self):
+        os.makedirs(self.folder, exist_ok=True)
+        self._used.update(n.lower() for n in os.listdir(self.folder))
+        self._listed = True
+
+    def claim(self, name: str):
+        """
+        name をこのフォルダで使うものとして登録する（上書きしてよい自分のファイル）。
+        フォルダの一覧は reserve が初めて呼ばれるまで取らない。
+        """
+        with self._lock:
+            self._used.add(name.lower())
+
+    def reserve(self, name: str) -> str:
+        """
+        name(1) のように連番を付けた空きの名前を空ファイルとして確保し、その名前を返す。
+        """
+        with self._lock:
+            if not self._listed:
+                self._list()
+
+            while True:
+                new = unique_name(name, self._used, self._next)
+                try:
+                    fd = os.open(os.path.join(self.folder, new), os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+                except FileExistsError:
+                    # 一覧した後に別のプロセスが作った
+                    continue
+                os.close(fd)
+                return new
+
+    def release(self, name: str):
+        """
+        reserve したが使わなかった名前のファイルを消す（名前は再利用しない）。
+        """
+        try:
+            os.remove(os.path.join(self.folder, name))
+        except OSError:
+            pass
 
 
 # ============================================================
 # URL 自動リンク
 # ============================================================
+URL_RE = re.compile(r"https?://[^\s<>]+")
+
+
 def autolink_plus(text: str) -> str:
-    url_pattern = r"(https?://[^\s<>]+)"
-    return re.sub(url_pattern, r'<a href="\1">\1</a>', text)
+    """
+    TEXT を HTML にする（&, <, > をエスケープし、URL はリンクにする）。
+    URL は元の TEXT で探すので、エスケープ後の &amp; などが URL に混ざることはない。
+    """
+    out = []
+    pos = 0
+    for m in URL_RE.finditer(text):
+        url = m.group()
+        out.append(escape(text[pos:m.start()], quote=False))
+        out.append(f'<a href="{escape(url)}">{escape(url, quote=False)}</a>')
+        pos = m.end()
+    out.append(escape(text[pos:], quote=False))
+    return "".join(out)
 
 
 # ============================================================
-# HTML の <meta charset> を保証
+# cid:画像 → 添付フォルダのパスに置換
 # ============================================================
-def ensure_meta_charset(html: str) -> str:
-    if "<meta charset" in html.lower():
-        return html
+def normalize_cid(value: str) -> str:
+    """
+    Content-ID ヘッダー（<xxx@yyy>）と HTML 側の cid:xxx%40yyy を同じ形にそろえる。
+    """
+    return urllib.parse.unquote(value.strip().strip("<>")).lower()
+
+
+def build_cid_map(attachments: list, subfolder: str, link=None) -> dict:
+    """
+    cid: の値 → 添付フォルダ内のパス の対応表を 1 回だけ作る。
+    Content-ID を優先し、無い場合に備えてファイル名（拡張子なしでも可）でも引けるようにする。
+    attachments の各要素は filename と、あれば content_id / saved_name を持つ dict。
+    link(att) を渡すとフォルダ内のパスの代わりにその戻り値を参照先にする。
+    """
+    by_cid = {}
+    by_name = {}
+    for att in attachments:
+        fname = att.get("saved_name") or att["filename"]
+        local_path = link(att) if link else f"{subfolder}/{fname}"
 
-    return html.replace(
-        "<head>",
-        '<head><meta charset="UTF-8">'
-    )
+        cid = att.get("content_id")
+        if cid:
+            by_cid.setdefault(normalize_cid(cid), local_path)
 
+        name = att["filename"].lower()
+        by_name.setdefault(name, local_path)
+        by_name.setdefault(os.path.splitext(name)[0], local_path)
 
-# ============================================================
-# Outlook HTML の補正
-# ============================================================
-def normalize_html(html: str) -> str:
-    lower = html.lower()
+    return {"cid": by_cid, "name": by_name}
 
-    # MSO コメントを先頭に残す
-    prefix = ""
-    m = re.match(r'^(<!--\[if.*?endif\]-->\s*)', html, flags=re.I | re.S)
-    if m:
-        prefix = m.group(1)
-        html = html[len(prefix):]
-        lower = html.lower()
 
-    # <html> が無ければ追加
-    if "<html" not in lower:
-        html = "<html>" + html + "</html>"
-        lower = html.lower()
+def resolve_cid(value: str, cid_map: dict) -> str | None:
+    cid = normalize_cid(value)
+    found = cid_map["cid"].get(cid)
+    if found:
+        return found
 
-    # <head> が無ければ追加
-    if "<head" not in lower:
-        html = html.replace("<html>", "<html><head></head>")
-        lower = html.lower()
+    # cid:image001.png@01D9... → image001.png → image001
+    name = cid.split("@", 1)[0]
+    by_name = cid_map["name"]
+    return by_name.get(name) or by_name.get(os.path.splitext(name)[0])
 
-    # <body> が無ければ追加
-    if "<body" not in lower:
-        html = html.replace("</head>", "</head><body>")
-        if "</body>" not in lower:
-            html += "</body>"
 
-    return prefix + html
+def replace_cid_images(html: str, attachments: list, subfolder: str) -> str:
+    if not attachments:
+        return html
+
+    cid_map = build_cid_map(attachments, subfolder)
+    return _CID_RE.sub(lambda m: resolve_cid(m.group(1), cid_map) or m.group(0), html)
 
 
 # ============================================================
-# cid:画像 → 添付フォルダのパスに置換（MSG 用）
+# HTML 後処理
+#   Outlook HTML の補正（html / head / body の補完）・<meta charset> の挿入・
+#   cid: の置換・外部画像 URL の収集 をまとめて行う。cid: を 1 回で置き換えた後は、
+#   補正や差し替えに関係するタグ（html / head / body / meta / img）とコメントだけを拾う
+#   （すべてのタグを Python で 1 つずつ見ると数 MB の本文で遅い）。
 # ============================================================
-def replace_cid_images(html: str, attachments: list, subfolder: str) -> str:
-    for att in attachments:
-        fname = att["filename"]
-        base, ext = os.path.splitext(fname)
+_TOKEN_RE = re.compile(
+    r'<(?:(!--.*?-->)'                                          # コメント（MSO 条件付きコメント含む）
+    r'|(/?)((?i:html|head|body|meta|img))(?=[\s/>])'             # タグ
+    r'((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>)',
+    re.S
+)
+# re.I を付けずに書くと、先頭の文字から候補の位置を速く探せる
+_CID_RE = re.compile(r'[cC][iI][dD]:([^"\'\s<>)]+)')
+_SRC_RE = re.compile(r'(\ssrc\s*=\s*)(["\'])(.*?)\2', re.I | re.S)
+_META_CHARSET_RE = re.compile(r'<meta\s+charset', re.I)
+_LEADING_RE = re.compile(r'(?:\s|<!--.*?-->|<!doctype[^>]*>)*', re.I | re.S)
+
+META_CHARSET = '<meta charset="UTF-8">'
+
+
+def process_html(html: str, attachments: list, subfolder: str, download=None, link=None) -> str:
+    """
+    cid 置換と、Outlook HTML の補正・<meta charset> 挿入を 1 回の走査で行う。
+    download が指定されていれば <img src="http(s)://..."> の URL リストを渡して
+    呼び出し、返ってきた {url: ローカルパス} で src を差し替える。
+    link は build_cid_map にそのまま渡す。
+    文字列の連結は最後の join 1 回だけ。
+    """
+    if attachments:
+        cid_map = build_cid_map(attachments, subfolder, link)
+        html = _CID_RE.sub(lambda m: resolve_cid(m.group(1), cid_map) or m.group(0), html)
+
+    out = []
+    slots = {}          # 後から中身を決める挿入位置 → out のインデックス
+    images = []         # (out のインデックス, url)
+    seen = set()
+    meta_charset = False
+
+    # 先頭のコメント・DOCTYPE は <html> の外に残す
+    pos = _LEADING_RE.match(html).end()
+    out.append(html[:pos])
+    slots["start"] = len(out)
+    out.append("")
+
+    for m in _TOKEN_RE.finditer(html, pos):
+        out.append(html[pos:m.start()])
+        pos = m.end()
+
+        comment, close, name, attrs = m.groups()
+        token = m.group(0)
+        if comment is not None:
+            out.append(token)
+            continue
 
-        # cid:image001.png または cid:image001.png@xxxx
-        pattern = rf'cid:{re.escape(base)}[^"\']*'
+        name = name.lower()
+        if close:
+            if name == "head" and "head_close" not in slots:
+                out.append(token)
+                slots["head_close"] = len(out)
+                out.append("")
+            elif name == "html":
+                slots["html_close"] = len(out)
+                out.append("")
+                out.append(token)
+            else:
+                seen.add("/" + name)
+                out.append(token)
+            continue
 
-        local_path = f"{subfolder}/{fname}"
+        if name in ("html", "head", "body") and name not in seen:
+            seen.add(name)
+            out.append(token)
+            slots[name] = len(out)
+            out.append("")
+            continue
 
-        html = re.sub(pattern, local_path, html, flags=re.I)
+        if name == "meta" and not meta_charset:
+            meta_charset = _META_CHARSET_RE.match(token) is not None
 
-    return html
+        if name == "img" and download is not None:
+            sm = _SRC_RE.search(token)
+            if sm and sm.group(3).startswith(("http://", "https://")):
+                out.append(token[:sm.start(3)])
+                images.append((len(out), sm.group(3)))
+                out.append(sm.group(3))
+                out.append(token[sm.end(3):])
+                continue
+
+        out.append(token)
+
+    out.append(html[pos:])
+
+    # --- 足りない要素を挿入位置に埋める ---
+    meta = "" if meta_charset else META_CHARSET
+    if "head" in seen:
+        out[slots["head"]] = meta
+        head = ""
+    else:
+        head = "<head>" + meta + "</head>"
+
+    if "html" in seen:
+        out[slots["html"]] = head
+    else:
+        out[slots["start"]] = "<html>" + head
+        out.append("</html>")
+
+    if "body" not in seen:
+        if "head_close" in slots:
+            body_open = "head_close"
+        elif "head" in seen:
+            body_open = "head"
+        elif "html" in seen:
+            body_open = "html"
+        else:
+            body_open = "start"
+        out[slots[body_open]] += "<body>"
+        if "/body" not in seen:
+            if "html_close" in slots:
+                out[slots["html_close"]] = "</body>"
+            else:
+                out.insert(len(out) - (0 if "html" in seen else 1), "</body>")
+
+    # --- 外部画像 ---
+    if images:
+        saved = download([url for _, url in images])
+        for i, url in images:
+            if url in saved:
+                out[i] = saved[url]
+
+    return "".join(out)
 
 
 # ============================================================
-# 外部画像ダウンロード（日本語ファイル名対応）
+# TEXT 本文 → HTML（<pre> で改行保持）
+#   数 MB のログなどを貼り付けたメールでも本文の複製を作らないよう、
+#   TEXT_CHUNK 文字ずつ変換してそのまま書き出せるようにする。
 # ============================================================
-def download_external_images(html: str, folder: str, subfolder: str):
-    save_dir = folder
-    os.makedirs(save_dir, exist_ok=True)
+TEXT_CHUNK = 64 * 1024
+_SPACE_RE = re.compile(r"\s")
 
-    urls = re.findall(r'<img[^>]+src=["\']([^"\']+)["\']', html)
 
-    for src in urls:
-        if not (src.startswith("http://") or src.startswith("https://")):
-            continue
+def iter_text_html(text: str, chunk_size: int = TEXT_CHUNK):
+    """
+    TEXT 本文の HTML を少しずつ返す（つなげると render_text_html と同じ）。
+    URL は空白を含まないので、chunk_size 文字を超えた最初の空白の直後で区切れば
+    URL を途中で分けずに済む。
+    """
+    yield "<html><head>" + META_CHARSET + "</head><body><pre>"
 
-        parsed = urllib.parse.urlparse(src)
-        filename = urllib.parse.unquote(os.path.basename(parsed.path))
+    pos = 0
+    while pos < len(text):
+        m = _SPACE_RE.search(text, pos + chunk_size)
+        end = m.end() if m else len(text)
+        yield autolink_plus(text[pos:end])
+        pos = end
 
-        if not filename:
-            continue
+    yield "</pre></body></html>"
 
-        save_path = ensure_unique(os.path.join(save_dir, filename))
 
-        try:
-            urllib.request.urlretrieve(src, save_path)
-        except Exception:
-            continue
+def render_text_html(text: str) -> str:
+    return "".join(iter_text_html(text))
 
-        # HTML から見た相対パス
-        local_ref = f"{subfolder}/{filename}"
-        html = html.replace(src, local_ref)
 
-    return html
+def write_text_html(f, text: str):
+    """
+    TEXT 本文の HTML をテキストモードの f に少しずつ書く。
+    """
+    for chunk in iter_text_html(text):
+        f.write(chunk)
+
+
+def has_html_body(msg_data: dict) -> bool:
+    """
+    render_html が HTML 本文を使うか（False なら TEXT 本文を <pre> にする）。
+    """
+    return bool((msg_data.get("body_html") or "").strip())
 
 
 # ============================================================
-# MSG/EML 共通の HTML 組み立て（v2.0）
+# MSG/EML 共通の HTML 組み立て（ディスクには触れない）
 # ============================================================
-def build_html_from_msg(msg_data: dict,
-                        save_external_images: bool,
-                        attach_folder: str,
-                        base_name: str) -> str:
-
+def render_html(msg_data: dict, subfolder: str, download=None, link=None,
+                slim: bool = False) -> str:
+    """
+    msg_data（body_html / body_text / attachments）から最終的な HTML を作る。
+    添付・インライン画像は subfolder/<saved_name> を参照する
+    （link(att) を渡すとその戻り値を参照する。writers の 1 ファイル出力用。
+    このときは本文の NUL を除く）。
+    download(urls) -> {url: 参照パス} を渡すと外部画像の参照も書き換える。
+    slim=True なら HTML 本文を html_slim で軽量化する（TEXT 本文はそのまま）。
+    """
     html = msg_data.get("body_html") or ""
 
     if isinstance(html, bytes):
         html = decode_bytes(html, None)
 
+    if link is not None:
+        # writers の目印は NUL で囲むので、本文の NUL（ブラウザでも表示されない）は除いておく
+        html = html.replace("\x00", "")
+
     html = html.strip()
 
     if not html:
         text = msg_data.get("body_text", "") or ""
-        html = f"<html><body><pre>{autolink_plus(text)}</pre></body></html>"
-    else:
-        html = normalize_html(html)
+        if link is not None:
+            text = text.replace("\x00", "")
+        with metrics.stage("html", len(text)) as s:
+            html = render_text_html(text)
+            s["bytes_out"] = len(html)
+        return html
 
-    html = ensure_meta_charset(html)
+    # 補正・meta 挿入・cid 置換・外部画像を 1 パスで
+    # （html の時間には images のダウンロード時間も含まれる）
+    with metrics.stage("html", len(html)) as s:
+        html = process_html(html, msg_data.get("attachments", []), subfolder, download, link)
+        s["bytes_out"] = len(html)
 
-    # ★ attach_folder は呼び出し側で必ず決定済み
-    os.makedirs(attach_folder, exist_ok=True)
+    if slim:
+        with metrics.stage("slim", len(html)) as s:
+            html = html_slim.slim_html(html)
+            s["bytes_out"] = len(html)
+    return html
+
+
+def image_downloader(attach_folder: str, names: NameAllocator | None = None):
+    """
+    外部画像を attach_folder に保存し、HTML からの参照パスを返す download 関数。
+    names は attach_folder の NameAllocator（添付と名前が重ならないよう共有する）。
+    """
+    subfolder = os.path.basename(attach_folder)
+
+    def download(urls):
+        from downloader import download_images
+        metrics.count("image_urls", len(urls))
+        with metrics.stage("images"):
+            saved = download_images(urls, attach_folder, names=names)
+        metrics.count("images", len(saved))
+        return {url: f"{subfolder}/{name}" for url, name in saved.items()}
+
+    return download
+
+
+def build_html_from_msg(msg_data: dict,
+                        save_external_images: bool,
+                        attach_folder: str,
+                        base_name: str,
+                        names: NameAllocator | None = None) -> str:
+    """
+    render_html のディスク版。外部画像を保存するときだけ attach_folder を使う
+    （1 枚も保存しなかったら、作ったフォルダは消す）。
+    """
     subfolder = os.path.basename(attach_folder)
 
-    # cid 置換（MSG のみ）
-    html = replace_cid_images(html, msg_data.get("attachments", []), subfolder)
+    if not save_external_images:
+        return render_html(msg_data, subfolder)
 
-    # 外部画像保存（常に attach_folder に保存）
-    if save_external_images:
-        html = download_external_images(html, attach_folder, subfolder)
+    os.makedirs(attach_folder, exist_ok=True)
+    html = render_html(msg_data, subfolder, image_downloader(attach_folder, names))
 
     try:
-        if os.path.isdir(attach_folder) and not os.listdir(attach_folder):
+        if not os.listdir(attach_folder):
             os.rmdir(attach_folder)
-    except Exception:
+    except OSError:
         pass
 
     return html
 
 
+# ============================================================
+# 添付ファイルの名前付け・保存
+# ============================================================
+def name_attachments(attachments: list) -> list:
+    """
+    saved_name の無い添付に、同じメール内で重ならない名前を付ける。
+    """
+    used = {att["saved_name"].lower() for att in attachments if att.get("saved_name")}
+    counters = {}
+    for att in attachments:
+        if not att.get("saved_name"):
+            att["saved_name"] = unique_name(att["filename"], used, counters)
+    return attachments
+
+
+def save_attachments(attachments: list, attach_folder: str, names: NameAllocator | None = None,
+                     store: dedup.AttachmentStore | None = None):
+    """
+    data を持つ添付を attach_folder/<saved_name> に書き出す（0 件ならフォルダを作らない）。
+    "read" を持つ添付（msg_converter.open_msg）は 1 件ずつ読んで書き、中身は保持しない。
+    ストリーミング解析で書き出し済みのもの（data も read も無い）はそのまま。
+    names を渡すと添付の名前を登録し、後から保存する外部画像と重ならないようにする。
+    store を渡すと同じ内容の添付はハードリンクにして書き込みを省く。
+    """
+    pending = [att for att in attachments if att.get("data") is not None or "read" in att]
+    metrics.count("attachments", len(attachments))
+    if names is not None:
+        for att in attachments:
+            names.claim(att["saved_name"])
+    if not pending:
+        return
+
+    os.makedirs(attach_folder, exist_ok=True)
+    # 以前ストアを使って変換したフォルダでは、既存の添付を書き換えずに作り直す
+    relink = store is None and dedup.has_store(os.path.dirname(attach_folder))
+    with metrics.stage("attachments") as s:
+        for att in pending:
+            data = att["data"] if att.get("data") is not None else att["read"]()
+            path = os.path.join(attach_folder, att["saved_name"])
+            if store is not None:
+                s["bytes_out"] += len(data) - store.save(data, path)
+                continue
+            with (dedup.open_new(path) if relink else open(path, "wb")) as f:
+                f.write(data)
+            s["bytes_out"] += len(data)
+
+
+# ============================================================
+# 変換結果をディスクへ（EML / MSG・ファイル版 / バイト列版で共通）
+# ============================================================
+def write_message(msg_data: dict, folder: str, base: str, save_external_images: bool,
+                  dedup_attachments: bool = False, slim: bool = False,
+                  transcode: dict | None = None) -> str:
+    """
+    添付を folder/base_files/ に、HTML を folder/base.html に書き出してそのパスを返す。
+    dedup_attachments=True なら folder のストア（dedup.AttachmentStore）で添付の重複を省く。
+    slim=True なら HTML 本文を html_slim で軽量化しながら書く（TEXT 本文はそのまま）。
+    transcode（image_transcode.make_options の dict）を渡すと、本文から参照される
+    大きな画像を書き出した後に作り直し、HTML はそちらを参照する。
+    """
+    os.makedirs(folder, exist_ok=True)
+    html_out = os.path.join(folder, base + ".html")
+    attach_folder = os.path.join(folder, base + "_files")
+    attachments = msg_data.get("attachments", [])
+    names = NameAllocator(attach_folder)
+
+    if attachments:
+        store = dedup.AttachmentStore(folder) if dedup_attachments else None
+        save_attachments(attachments, attach_folder, names, store)
+        if transcode and has_html_body(msg_data):
+            # Pillow は重いので、画像を変換するときだけ読み込む
+            import image_transcode
+            image_transcode.transcode_attachments(msg_data, attach_folder, names, transcode)
+    elif os.path.isdir(attach_folder):
+        # 前回の変換で残った空のフォルダ
+        try:
+            os.rmdir(attach_folder)
+        except OSError:
+            pass
+
+    if not has_html_body(msg_data):
+        # TEXT 本文は HTML の文字列を作らず、変換しながらファイルに書く
+        text = msg_data.get("body_text", "") or ""
+        with metrics.stage("write", len(text)) as s, \
+                open(html_out, "w", encoding="utf-8", newline="\n") as f:
+            write_text_html(f, text)
+            s["bytes_out"] = f.tell()
+        return html_out
+
+    html = build_html_from_msg(msg_data, save_external_images, attach_folder, base, names)
+
+    with metrics.stage("write", len(html)) as s, \
+            open(html_out, "w", encoding="utf-8", newline="\n") as f:
+        if slim:
+            for chunk in html_slim.iter_slim(html):
+                f.write(chunk)
+        else:
+            f.write(html)
+        s["bytes_out"] = f.tell()
+
+    return html_out
+
+
+# ============================================================
+# メモリ上での変換（EML / MSG のバイト列 → HTML・添付・メタデータ）
+# ============================================================
+OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"     # MSG（OLE 複合ファイル）の先頭
+
+
+def convert_bytes(raw: bytes, base_name: str = "message", download=None, slim: bool = False) -> dict:
+    """
+    EML / MSG のバイト列を、ファイルを一切作らずに変換する。
+    戻り値は dict：
+      html        : HTML 文字列（添付は <base_name>_files/<saved_name> を参照）
+      subfolder   : 上記の <base_name>_files
+      attachments : [{"filename", "saved_name", "content_id", "content_type", "data"}]
+      metadata    : {"subject", "from", "to", "cc", "date", "message_id"}
+    download(urls) -> {url: 参照パス} を渡すと外部画像の参照も書き換える。
+    slim=True なら Outlook だけが使うタグ・style を除いて HTML を小さくする（html_slim）。
+    """
+    if raw[:8] == OLE_MAGIC:
+        from msg_converter import parse_msg_via_library
+        msg_data = parse_msg_via_library(raw)
+    else:
+        from eml_converter import parse_eml_bytes
+        msg_data = parse_eml_bytes(raw)
+        # MSG と同じく、戻り値の添付は中身（data）を持つ形にそろえる
+        for att in msg_data["attachments"]:
+            att["data"] = att.pop("read")()
+
+    subfolder = base_name + "_files"
+    return {
+        "html": render_html(msg_data, subfolder, download, slim=slim),
+        "subfolder": subfolder,
+        "attachments": msg_data["attachments"],
+        "metadata": msg_data["metadata"],
+    }
+
+
+# ============================================================
+# 出力先
+# ============================================================
+def output_dir_for(path: str, output_dir: str | None) -> str:
+    # "a.eml" のような相対パスでも dirname が空にならないよう、絶対パスにしてから取る
+    return output_dir if output_dir else os.path.dirname(os.path.abspath(path))
+
+
+def output_html_path(path: str, output_dir: str | None, ext: str = ".html") -> str:
+    base = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output_dir_for(path, output_dir), base + ext)
+
+
 # ============================================================
 # EML / MSG 自動判別
 # ============================================================
-def convert_any_email(path: str, output_dir: str | None, save_external_images: bool):
+def convert_any_email(path: str, output_dir: str | None, save_external_images: bool,
+                      layout: str = "files", dedup_attachments: bool = False, slim: bool = False,
+                      transcode: dict | None = None):
     ext = os.path.splitext(path)[1].lower()
 
-    if output_dir:
-        out_dir = output_dir
-    else:
-        out_dir = os.path.dirname(path)
+    out_dir = output_dir_for(path, output_dir)
 
     if ext == ".eml":
         from eml_converter import eml_to_html
-        return eml_to_html(path, out_dir, save_external_images)
+        return eml_to_html(path, out_dir, save_external_images, layout=layout,
+                           dedup_attachments=dedup_attachments, slim=slim, transcode=transcode)
 
     elif ext == ".msg":
         from msg_converter import msg_to_html
-        return msg_to_html(path, out_dir, save_external_images)
+        return msg_to_html(path, out_dir, save_external_images, layout, dedup_attachments, slim,
+                           transcode)
 
     else:
         raise ValueError("EML または MSG ファイルではありません。")
\ No newline at end of file
@@ -0,0 +1,169 @@
+import os
+import hashlib
+import threading
+
+from hashing import HashingWriter
+
+
+# ============================================================
+# 既定値
+# ============================================================
+STORE_DIR = ".email2html_store"    # 出力フォルダ直下に作る添付のストア
+
+
+def store_dir_for(folder: str) -> str:
+    return os.path.join(folder, STORE_DIR)
+
+
+def has_store(folder: str) -> bool:
+    return os.path.isdir(store_dir_for(folder))
+
+
+def open_new(path: str):
+    """
+    既存のファイルを消してから作り直す。
+    ストアとハードリンクでつながった添付を "wb" で開くと、同じ中身を持つ
+    他のメールの添付まで書き換わってしまうため。
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    return open(path, "wb")
+
+
+def _temp_name(path: str) -> str:
+    return f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+
+# ============================================================
+# 重複排除の効果（プロセス単位で集計）
+# ============================================================
+_stats_lock = threading.Lock()
+_stats = {"files": 0, "linked": 0, "bytes_saved": 0}
+
+
+def count(key: str, n: int = 1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def take_stats() -> dict:
+    """
+    前回呼び出し以降の集計を返してリセットする。
+    """
+    with _stats_lock:
+        result = dict(_stats)
+        for k in _stats:
+            _stats[k] = 0
+    return result
+
+
+# ============================================================
+# 内容アドレス方式の添付ストア
+# ============================================================
+class AttachmentStore:
+    """
+    出力フォルダの添付を SHA-256 で 1 つだけ持ち、各メールの <名前>_files/ には
+    同じ実体へのハードリンクを置く。本体は <folder>/.email2html_store/<sha の先頭 2 文字>/<sha>。
+    同じフォルダに書き込む複数のワーカープロセスで共有できる（登録は os.link で排他）。
+    ハードリンクが作れないファイルシステムでは、普通に書き出すだけになる。
+    """
+
+    def __init__(self, folder: str):
+        self.root = store_dir_for(folder)
+        self.enabled = True
+        self._pending = []
+
+    def object_path(self, sha: str) -> str:
+        return os.path.join(self.root, sha[:2], sha)
+
+    def _link(self, obj: str, dest: str):
+        # 既存の dest を書き換えず、リンクを作ってから差し替える
+        tmp = _temp_name(dest)
+        os.link(obj, tmp)
+        os.replace(tmp, dest)
+
+    def _register(self, path: str, sha: str) -> bool:
+        """
+        path を sha の本体として登録する。既に同じ内容があれば False。
+        """
+        obj = self.object_path(sha)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        try:
+            os.link(path, obj)
+            return True
+        except FileExistsError:
+            return False
+        except OSError:
+            # FAT・一部のネットワークドライブなどハードリンク非対応
+            self.enabled = False
+            return True
+
+    # --------------------------------------------------------
+    # メモリ上の添付
+    # --------------------------------------------------------
+    def save(self, data: bytes, dest: str) -> int:
+        """
+        data を dest に置き、書き込みを省いたバイト数を返す。
+        同じ内容が既にあればハードリンクを張るだけで、data は書かない。
+        """
+        count("files")
+        if self.enabled:
+            sha = hashlib.sha256(data).hexdigest()
+            obj = self.object_path(sha)
+            if os.path.exists(obj):
+                try:
+                    self._link(obj, dest)
+                    return self._saved(len(data))
+                except OSError:
+                    self.enabled = False
+
+        if not self.enabled:
+            with open_new(dest) as f:
+                f.write(data)
+            return 0
+
+        tmp = _temp_name(dest)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        self._register(tmp, sha)
+        os.replace(tmp, dest)
+        return 0
+
+    # --------------------------------------------------------
+    # ストリーミング解析で書き出す添付（書きながらハッシュを取る）
+    # --------------------------------------------------------
+    def open(self, path: str):
+        """
+        mime_stream.scan_eml の opener。書き終わったら flush() でまとめて登録する。
+        """
+        writer = HashingWriter(open_new(path))
+        self._pending.append((path, writer))
+        return writer
+
+    def flush(self) -> int:
+        """
+        open() で書き出した添付を登録し、既にあった内容はハードリンクに置き換える。
+        書き込み自体は済んでいるので、減るのはディスク使用量だけ。
+        """
+        saved = 0
+        pending, self._pending = self._pending, []
+        for path, writer in pending:
+            count("files")
+            if not self.enabled:
+                continue
+            sha = writer.sha.hexdigest()
+            if self._register(path, sha):
+                continue
+            try:
+                self._link(self.object_path(sha), path)
+                saved += self._saved(writer.size)
+            except OSError:
+                self.enabled = False
+        return saved
+
+    def _saved(self, size: int) -> int:
+        count("linked")
+        count("bytes_saved", size)
+        return size
\ No newline at end of file
@@ -0,0 +1,338 @@
+import os
+import threading
+import http.client
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import image_cache
+from common import NameAllocator
+from hashing import HashingWriter
+
+
+# ============================================================
+# 既定値
+# ============================================================
+MAX_WORKERS = 8                     # 同時ダウンロード数（全体）
+MAX_PER_HOST = 4                    # 同時ダウンロード数（ホスト単位）
+CONNECT_TIMEOUT = 10.0              # 接続タイムアウト（秒）
+READ_TIMEOUT = 30.0                 # 受信タイムアウト（秒）
+MAX_BYTES = 20 * 1024 * 1024        # 1 画像あたりの上限サイズ
+MAX_REDIRECTS = 5
+CHUNK_SIZE = 64 * 1024
+
+USER_AGENT = "email2html"
+
+
+class DownloadError(Exception):
+    pass
+
+
+# ============================================================
+# ホスト単位のコネクションプール
+# ============================================================
+class HostPool:
+    """
+    (scheme, host, port) ごとに keep-alive 接続を使い回す。
+    同時接続数は per_host で制限する。
+    """
+
+    def __init__(self, per_host: int, connect_timeout: float, read_timeout: float):
+        self.per_host = per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self._lock = threading.Lock()
+        self._idle = {}     # key -> [HTTPConnection, ...]
+        self._slots = {}    # key -> BoundedSemaphore
+
+    def slot(self, key) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = self._slots.get(key)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self.per_host)
+                self._slots[key] = sem
+            return sem
+
+    def acquire(self, key):
+        """
+        空き接続があれば (conn, True) を、無ければ新規接続で (conn, False) を返す。
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+
+        return self._connect(key), False
+
+    def release(self, key, conn):
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def close(self):
+        with self._lock:
+            conns = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def proxy_for(self, key):
+        """
+        環境変数のプロキシ設定（urllib と同じもの）を返す。使わない場合は None。
+        """
+        scheme, host, port = key
+        if urllib.request.proxy_bypass(host):
+            return None
+
+        proxy = urllib.request.getproxies().get(scheme)
+        if not proxy:
+            return None
+
+        p = urllib.parse.urlparse(proxy if "://" in proxy else "http://" + proxy)
+        return p.hostname, p.port or 80
+
+    def _connect(self, key):
+        scheme, host, port = key
+        proxy = self.proxy_for(key)
+
+        if proxy and scheme == "https":
+            conn = http.client.HTTPSConnection(*proxy, timeout=self.connect_timeout)
+            conn.set_tunnel(host, port)
+        elif proxy:
+            conn = http.client.HTTPConnection(*proxy, timeout=self.connect_timeout)
+        elif scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+
+        # 接続後は受信タイムアウトに切り替える
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+
+# ============================================================
+# 1 URL の取得
+# ============================================================
+def _split_url(url: str):
+    parsed = urllib.parse.urlsplit(url)
+    scheme = parsed.scheme.lower()
+    if scheme not in ("http", "https") or not parsed.hostname:
+        raise DownloadError(f"unsupported url: {url}")
+
+    port = parsed.port or (443 if scheme == "https" else 80)
+
+    # 日本語などを含むパスはパーセントエンコードして送る
+    path = urllib.parse.quote(parsed.path or "/", safe="/%:@!$&'()*+,;=-._~")
+    if parsed.query:
+        path += "?" + urllib.parse.quote(parsed.query, safe="=&%/:+,;@!$'()*?-._~")
+
+    return (scheme, parsed.hostname, port), path
+
+
+def _request(pool: HostPool, url: str, out, max_bytes: int, headers: dict):
+    """
+    url を取得して out に書き込む。
+    リダイレクトなら (リダイレクト先 URL, None)、それ以外は (None, 応答情報) を返す。
+    """
+    key, path = _split_url(url)
+
+    # http のプロキシ経由では絶対 URI でリクエストする
+    if key[0] == "http" and pool.proxy_for(key):
+        path = url
+
+    with pool.slot(key):
+        # 使い回した接続がサーバー側で切れていた場合は 1 回だけ張り直す
+        for attempt in range(2):
+            conn, reused = pool.acquire(key)
+            try:
+                conn.request("GET", path, headers={
+                    "User-Agent": USER_AGENT,
+                    "Accept": "image/*,*/*;q=0.8",
+                    **headers,
+                })
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError, http.client.BadStatusLine):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            break
+
+        try:
+            if resp.status in (301, 302, 303, 307, 308):
+                location = resp.getheader("Location")
+                resp.read()
+                if not location:
+                    raise DownloadError(f"redirect without location: {url}")
+                return urllib.parse.urljoin(url, location), None
+
+            # キャッシュの再検証で変更なし
+            if resp.status == 304:
+                resp.read()
+
+            elif resp.status != 200:
+                resp.read()
+                raise DownloadError(f"HTTP {resp.status}: {url}")
+
+            else:
+                length = resp.getheader("Content-Length")
+                if length and length.isdigit() and int(length) > max_bytes:
+                    raise DownloadError(f"too large ({length} bytes): {url}")
+
+                size = 0
+                while True:
+                    chunk = resp.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise DownloadError(f"too large (>{max_bytes} bytes): {url}")
+                    out.write(chunk)
+        except Exception:
+            conn.close()
+            raise
+
+        if resp.will_close:
+            conn.close()
+        else:
+            pool.release(key, conn)
+
+    return None, {
+        "status": resp.status,
+        "etag": resp.getheader("ETag"),
+        "last_modified": resp.getheader("Last-Modified"),
+    }
+
+
+def fetch(pool: HostPool, url: str, out, max_bytes: int = MAX_BYTES,
+          headers: dict | None = None) -> dict:
+    """
+    リダイレクトをたどって url を取得する。戻り値は最終応答の情報
+    （status / etag / last_modified）。status が 304 のときは何も書き込まない。
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        url, info = _request(pool, url, out, max_bytes, headers or {})
+        if url is None:
+            return info
+    raise DownloadError(f"too many redirects: {url}")
+
+
+# ============================================================
+# 保存先ファイル名の決定
+# ============================================================
+def url_to_filename(url: str) -> str:
+    parsed = urllib.parse.urlparse(url)
+    return urllib.parse.unquote(os.path.basename(parsed.path))
+
+
+# ============================================================
+# キャッシュを使った 1 画像の取得
+# ============================================================
+def _fetch_cached(pool: HostPool, cache, url: str, save_path: str, max_bytes: int):
+    # HTML 上の &amp; は実際の URL では & になる
+    real_url = url.replace("&amp;", "&")
+
+    entry = cache.lookup(real_url)
+    if entry and cache.is_fresh(entry):
+        cache.materialize(entry, save_path)
+        cache.touch(real_url)
+        image_cache.count("hits")
+        image_cache.count("bytes_saved", entry["size"])
+        return
+
+    tmp_path, f = cache.temp_file()
+    try:
+        with f:
+            out = HashingWriter(f)
+            info = fetch(pool, real_url, out, max_bytes, cache.conditional_headers(entry))
+
+        if info["status"] == 304 and entry:
+            os.remove(tmp_path)
+            cache.materialize(entry, save_path)
+            cache.touch(real_url, validated=True)
+            image_cache.count("revalidated")
+            image_cache.count("bytes_saved", entry["size"])
+            return
+
+        entry = cache.store(real_url, tmp_path, out.sha.hexdigest(), out.size,
+                            info["etag"], info["last_modified"])
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    cache.materialize(entry, save_path)
+    image_cache.count("misses")
+
+
+# ============================================================
+# 複数画像の並列ダウンロード
+# ============================================================
+def download_images(urls, save_dir: str,
+                    max_workers: int = MAX_WORKERS,
+                    max_per_host: int = MAX_PER_HOST,
+                    connect_timeout: float = CONNECT_TIMEOUT,
+                    read_timeout: float = READ_TIMEOUT,
+                    max_bytes: int = MAX_BYTES,
+                    cache=True,
+                    names: NameAllocator | None = None) -> dict:
+    """
+    urls を並列に取得して save_dir に保存する。
+    戻り値は {url: 保存したファイル名}（失敗した URL は含まない）。
+    cache=True ならプロセス既定の ImageCache を使い、False / None なら使わない。
+    ImageCache のインスタンスを直接渡すこともできる。
+    names は save_dir 用の NameAllocator（添付と同じものを渡せば名前が重ならない）。
+    """
+    # 同じ URL は 1 回だけ取得する
+    targets = {}
+    for url in urls:
+        if url in targets:
+            continue
+        filename = url_to_filename(url)
+        if filename:
+            targets[url] = filename
+
+    if not targets:
+        return {}
+
+    if cache is True:
+        cache = image_cache.default_cache()
+
+    if names is None:
+        names = NameAllocator(save_dir)
+
+    pool = HostPool(max_per_host, connect_timeout, read_timeout)
+
+    def job(url, filename):
+        name = names.reserve(filename)
+        save_path = os.path.join(save_dir, name)
+        try:
+            if cache:
+                _fetch_cached(pool, cache, url, save_path, max_bytes)
+            else:
+                with open(save_path, "wb") as f:
+                    # HTML 上の &amp; は実際の URL では & になる
+                    fetch(pool, url.replace("&amp;", "&"), f, max_bytes)
+        except Exception:
+            names.release(name)
+            return url, None
+        return url, name
+
+    saved = {}
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(targets))) as ex:
+            for url, name in ex.map(lambda t: job(*t), targets.items()):
+                if name:
+                    saved[url] = name
+    finally:
+        pool.close()
+
+    return saved
\ No newline at end of file
@@ -1,13 +1,30 @@
 import os
+import tempfile
+import functools
 from email import policy
 from email.parser import BytesParser
 
+import dedup
+import metrics
 from common import (
     decode_bytes,
-    autolink_plus,
-    normalize_html,
-    ensure_meta_charset,
-    build_html_from_msg,
+    output_dir_for,
+    unique_name,
+)
+from mime_stream import part_filename, scan_eml
+from writers import write_output
+
+
+# このサイズ以上の EML は自動でストリーミング解析に切り替える
+STREAMING_THRESHOLD = 32 * 1024 * 1024
+
+METADATA_HEADERS = (
+    ("subject", "Subject"),
+    ("from", "From"),
+    ("to", "To"),
+    ("cc", "Cc"),
+    ("date", "Date"),
+    ("message_id", "Message-ID"),
 )
 
 
@@ -15,119 +32,204 @@ from common import (
 # EML 読み込み
 # ============================================================
 def read_eml(path: str) -> bytes:
-    with open(path, "rb") as f:
-        return f.read()
+    with metrics.stage("read") as s, open(path, "rb") as f:
+        data = f.read()
+        s["bytes_out"] = len(data)
+    return data
 
 
 # ============================================================
-# 添付ファイル抽出（0 件ならフォルダを作らない）
+# パートの索引（メモリ上のメールを 1 回だけたどる）
+#   たどり方は mime_stream.StreamingParser と同じ：multipart は子パートへ、
+#   添付ではない message/rfc822（転送メールなど）は中身へ、それ以外は葉のパート。
+#   添付の中身はここではデコードせず、書き出すときに "read" で 1 回だけ取り出す。
 # ============================================================
-def extract_attachments(msg, base_folder: str):
-    attachments = []
-
-    for part in msg.walk():
+def _part_data(part) -> bytes:
+    if part.get_content_type() == "message/rfc822" and part.is_multipart():
+        # 添付されたメールはデコードするものが無いので、メールとしてそのまま書く
+        return part.get_payload(0).as_bytes()
+    return part.get_payload(decode=True) or b""
+
+
+def index_parts(msg) -> dict:
+    """
+    {"html": 最初の text/html, "text": 最初の text/plain, "attachments": [...]} を返す。
+    本文の候補は添付（Content-Disposition: attachment）を除いたもの。
+    転送されたメール（message/rfc822）の中の本文は、外側のメールに本文が無いときだけ使う。
+    添付ファイルと multipart/related のインライン画像（Content-ID 付き）は
+    {"filename", "saved_name", "content_id", "content_type", "read"} のリストで、
+    同じメール内で名前が重なったものは name(1) のように連番を付ける。
+    """
+    index = {"html": None, "text": None, "attachments": []}
+    depths = {}         # 本文の候補を見つけた message/rfc822 の深さ
+    used = set()
+    counters = {}
+
+    def visit(part, depth):
         disp = (part.get_content_disposition() or "").lower()
-        if disp != "attachment":
-            continue
+        ctype = part.get_content_type()
 
-        filename = part.get_filename()
-        if not filename:
-            continue
+        if part.get_content_maintype() == "multipart" and part.is_multipart():
+            for sub in part.get_payload():
+                visit(sub, depth)
+            return
+
+        if ctype == "message/rfc822" and disp != "attachment" and part.is_multipart():
+            visit(part.get_payload(0), depth + 1)
+            return
+
+        filename = part_filename(part)
+        if filename:
+            index["attachments"].append({
+                "filename": filename,
+                "saved_name": unique_name(filename, used, counters),
+                "content_id": part.get("Content-ID"),
+                "content_type": ctype,
+                "read": functools.partial(_part_data, part),
+            })
+        elif disp != "attachment" and ctype in ("text/html", "text/plain"):
+            key = "html" if ctype == "text/html" else "text"
+            if key not in depths or depth < depths[key]:
+                index[key] = part
+                depths[key] = depth
+
+    visit(msg, 0)
+    return index
+
+
+def body_of(part):
+    """
+    本文パートを body_to_msg_data に渡す (content_type, payload, charset) にする。
+    """
+    if part is None:
+        return None
+    return part.get_content_type(), part.get_payload(decode=True) or b"", part.get_content_charset()
 
-        payload = part.get_payload(decode=True) or b""
-        attachments.append((filename, payload))
 
-    # 添付が 0 件ならフォルダを作らない
-    if not attachments:
-        return 0
+# ============================================================
+# 本文パート → build_html_from_msg に渡す本文
+# ============================================================
+def body_to_msg_data(body) -> dict:
+    """
+    body は (content_type, payload, charset) か None。
+    HTML の補正や <pre> 化は build_html_from_msg 側でまとめて行う。
+    """
+    if body is None:
+        return {"body_html": "", "body_text": "本文が見つかりませんでした。"}
+
+    ctype, payload, charset = body
+    with metrics.stage("decode", len(payload)) as s:
+        text = decode_bytes(payload, charset)
+        s["bytes_out"] = len(text)
 
-    os.makedirs(base_folder, exist_ok=True)
+    if ctype == "text/html":
+        return {"body_html": text, "body_text": ""}
 
-    for filename, payload in attachments:
-        out_path = os.path.join(base_folder, filename)
-        with open(out_path, "wb") as f:
-            f.write(payload)
+    return {"body_html": "", "body_text": text}
 
-    return len(attachments)
+
+def message_metadata(msg) -> dict:
+    metadata = {}
+    for key, name in METADATA_HEADERS:
+        try:
+            value = msg.get(name)
+        except Exception:
+            # 壊れたヘッダーはメタデータに入れないだけにする
+            value = None
+        metadata[key] = str(value) if value is not None else None
+    return metadata
 
 
 # ============================================================
-# 最適な本文パートを選択
+# EML（バイト列）→ msg_data（ディスクには触れない）
 # ============================================================
-def pick_best_part(msg):
-    html_part = None
-    text_part = None
+def parse_eml_bytes(raw: bytes) -> dict:
+    """
+    本文・添付（中身は "read" で取り出す）・メタデータを msg_data の形で返す。
+    """
+    with metrics.stage("mime_parse", len(raw)):
+        msg = BytesParser(policy=policy.default).parsebytes(raw)
+        parts = index_parts(msg)
 
-    for part in msg.walk():
-        ctype = part.get_content_type()
+        # 本文は HTML を優先し、使うパートだけをデコードする
+        body = body_of(parts["html"] or parts["text"])
 
-        if ctype == "text/html":
-            html_part = part
-        elif ctype == "text/plain":
-            text_part = part
+    msg_data = body_to_msg_data(body)
+    msg_data["attachments"] = parts["attachments"]  # cid: を保存したパートに置換するため
+    msg_data["metadata"] = message_metadata(msg)
+    msg_data["subject"] = msg_data["metadata"]["subject"] or ""
+    return msg_data
 
-    return html_part or text_part
+
+# ============================================================
+# EML（バイト列）→ HTML
+# ============================================================
+def eml_bytes_to_html(raw: bytes, base: str, folder: str, save_external_images: bool = False,
+                      layout: str = "files", dedup_attachments: bool = False, slim: bool = False,
+                      transcode: dict | None = None):
+    """
+    mbox の 1 通など、ファイルになっていない EML を folder/base.html に変換する。
+    layout は writers.LAYOUTS のどれか（single / mhtml なら 1 ファイルにまとめる）。
+    dedup_attachments=True なら同じ内容の添付を folder のストアへのハードリンクにする。
+    slim=True なら HTML 本文を html_slim で軽量化する。
+    transcode を渡すと本文から参照される大きな画像を作り直す（image_transcode）。
+    """
+    return write_output(parse_eml_bytes(raw), folder, base, save_external_images, layout,
+                        dedup_attachments, slim, transcode)
 
 
 # ============================================================
 # EML → HTML（v2.0 完全版）
 # ============================================================
-def eml_to_html(eml_path: str, output_dir: str | None = None, save_external_images: bool = False):
-    raw = read_eml(eml_path)
-    msg = BytesParser(policy=policy.default).parsebytes(raw)
-
+def eml_to_html(eml_path: str, output_dir: str | None = None, save_external_images: bool = False,
+                streaming: bool | None = None, base: str | None = None, layout: str = "files",
+                dedup_attachments: bool = False, slim: bool = False,
+                transcode: dict | None = None):
+    """
+    streaming=True なら添付をメモリに載せずディスクへ直接書き出す（mime_stream）。
+    None のときはファイルサイズが STREAMING_THRESHOLD 以上なら自動で切り替える。
+    base を指定すると出力名をファイル名ではなくそれにする（Maildir など）。
+    layout は writers.LAYOUTS のどれか（既定は <base>.html + <base>_files/）。
+    dedup_attachments・slim・transcode は eml_bytes_to_html と同じ。
+    """
     # 出力先フォルダ
-    folder = output_dir if output_dir else os.path.dirname(eml_path)
-    base = os.path.splitext(os.path.basename(eml_path))[0]
-
-    html_out = os.path.join(folder, base + ".html")
-    attach_folder = os.path.join(folder, base + "_files")
-
-    # 添付ファイル保存（0 件ならフォルダを作らない）
-    attach_count = extract_attachments(msg, attach_folder)
-
-    # 添付が 0 件ならフォルダ削除（存在していれば）
-    if attach_count == 0 and os.path.exists(attach_folder):
-        try:
-            os.rmdir(attach_folder)
-        except OSError:
-            pass
-
-    # 本文抽出
-    part = pick_best_part(msg)
-    if part is None:
-        body_html = "<html><body><pre>本文が見つかりませんでした。</pre></body></html>"
-    else:
-        payload = part.get_payload(decode=True) or b""
-        charset = part.get_content_charset()
-        text = decode_bytes(payload, charset)
-
-        if part.get_content_type() == "text/html":
-            # HTML パート
-            body_html = normalize_html(text)
-            body_html = ensure_meta_charset(body_html)
+    folder = output_dir_for(eml_path, output_dir)
+    if base is None:
+        base = os.path.splitext(os.path.basename(eml_path))[0]
+
+    if streaming is None:
+        streaming = os.path.getsize(eml_path) >= STREAMING_THRESHOLD
+
+    if not streaming:
+        return eml_bytes_to_html(read_eml(eml_path), base, folder, save_external_images, layout,
+                                 dedup_attachments, slim, transcode)
+
+    # 添付保存と本文抽出を 1 回の読み込みで行う（添付は書き出し済みで data を持たない）
+    # 1 ファイルにまとめる形式では、添付は一時フォルダに書き出してから埋め込む
+    with tempfile.TemporaryDirectory() as tmp:
+        opener = None
+        store = None
+        if layout != "files":
+            attach_folder = tmp
         else:
-            # TEXT パート → <pre> で改行保持
-            body_html = (
-                "<html><head><meta charset=\"UTF-8\"></head>"
-                "<body><pre>" + autolink_plus(text) + "</pre></body></html>"
-            )
-
-    # ★ 外部画像保存のために attach_folder を必ず渡す
-    #    （添付が無くてもフォルダは build_html_from_msg 内で作られる）
-    final_html = build_html_from_msg(
-        {
-            "body_html": body_html,
-            "body_text": "",
-            "attachments": [],  # EML の添付は cid 参照しないので空でOK
-        },
-        save_external_images,
-        attach_folder,   # ← None にしない
-        base
-    )
-
-    # HTML 保存
-    with open(html_out, "w", encoding="utf-8", newline="\n") as f:
-        f.write(final_html)
-
-    return html_out
\ No newline at end of file
+            attach_folder = os.path.join(folder, base + "_files")
+            if dedup_attachments:
+                store = dedup.AttachmentStore(folder)
+                opener = store.open
+            elif dedup.has_store(folder):
+                opener = dedup.open_new
+
+        with metrics.stage("mime_scan", os.path.getsize(eml_path)):
+            attachments, body, headers = scan_eml(eml_path, attach_folder, opener)
+        if store is not None:
+            # 書きながら取ったハッシュで、既にある内容をハードリンクに置き換える
+            store.flush()
+        for att in attachments:
+            att["path"] = os.path.join(attach_folder, att["saved_name"])
+
+        msg_data = body_to_msg_data(body)
+        msg_data["attachments"] = attachments
+        msg_data["metadata"] = message_metadata(headers)
+        msg_data["subject"] = msg_data["metadata"]["subject"] or ""
+        return write_output(msg_data, folder, base, save_external_images, layout, slim=slim,
+                            transcode=transcode)
\ No newline at end of file
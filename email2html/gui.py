@@ -1,9 +1,341 @@
 import os
 import sys
+import time
+import queue
+import threading
+import multiprocessing
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 
-from common import convert_any_email
+from batch import convert_many, summarize
+from metrics import new_report_path
+from sources import expand_targets, is_supported
+
+
+# ------------------------------
+# バックグラウンド変換（Tk のメインループを止めない）
+# ------------------------------
+class BackgroundConversion:
+    """
+    convert_many を別スレッドで動かし、進捗はキュー経由で Tk 側に渡す。
+    on_progress(job) / on_done(job) は Tk のメインスレッドから呼ばれるので、
+    ウィジェットはそこでだけ触る。
+    """
+
+    POLL_MS = 100
+
+    def __init__(self, widget, targets, on_progress, on_done, **options):
+        self.widget = widget
+        self.on_progress = on_progress
+        self.on_done = on_done
+
+        self.total = len(targets) if isinstance(targets, list) else None
+        self.done = 0
+        self.failures = []      # (パス, エラー)
+        self.results = []
+        self.error = None       # バッチ自体が止まったときの例外
+        self.finished = False
+        self.started = time.monotonic()
+        self.options = options
+
+        self._queue = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._work, args=(targets, options), daemon=True)
+        self._thread.start()
+        widget.after(self.POLL_MS, self._poll)
+
+    def _work(self, targets, options):
+        try:
+            results = convert_many(
+                targets,
+                progress=lambda done, total, result: self._queue.put(("result", result)),
+                cancel=self._cancel,
+                **options
+            )
+            self._queue.put(("done", results))
+        except Exception as e:
+            self._queue.put(("failed", f"{type(e).__name__}: {e}"))
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def status_text(self) -> str:
+        """
+        「12.3 件/秒・残り 約 1分05秒」のような表示（件数不明なら残り時間は出さない）。
+        """
+        rate = self.rate()
+        text = f"{self.done} 件 ・ {rate:.1f} 件/秒"
+        if self.total and rate > 0:
+            remaining = int((self.total - self.done) / rate)
+            text += f" ・ 残り 約 {remaining // 60}分{remaining % 60:02d}秒"
+        if self.failures:
+            text += f" ・ エラー {len(self.failures)} 件"
+        return text
+
+    def _poll(self):
+        finished = False
+        changed = False
+
+        # 溜まった分をまとめて処理し、画面の更新は 1 回にする
+        while True:
+            try:
+                kind, value = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "result":
+                self.done += 1
+                if value["error"]:
+                    self.failures.append((value["path"], value["error"]))
+                changed = True
+            elif kind == "done":
+                self.results = value
+                finished = True
+            else:
+                self.error = value
+                finished = True
+
+        if changed:
+            self.on_progress(self)
+
+        if finished:
+            self.finished = True
+            self.on_done(self)
+        else:
+            self.widget.after(self.POLL_MS, self._poll)
+
+
+def show_error_summary(parent, failures, report_path):
+    """
+    変換できなかったメールの一覧（変換の途中では出さず、最後にまとめて表示）。
+    """
+    win = tk.Toplevel(parent)
+    win.title(f"変換できなかったメール（{len(failures)} 件）")
+    win.geometry("640x320")
+    win.configure(bg="white")
+
+    frame = tk.Frame(win, bg="white")
+    frame.pack(fill="both", expand=True, padx=15, pady=(15, 5))
+
+    scrollbar = tk.Scrollbar(frame)
+    scrollbar.pack(side="right", fill="y")
+
+    listbox = tk.Listbox(
+        frame,
+        yscrollcommand=scrollbar.set,
+        relief="flat",
+        highlightthickness=1,
+        highlightcolor="#DDD",
+        highlightbackground="#DDD",
+        font=("Meiryo", 9)
+    )
+    listbox.pack(side="left", fill="both", expand=True)
+    scrollbar.config(command=listbox.yview)
+
+    for path, error in failures:
+        listbox.insert(tk.END, f"{os.path.basename(path)}：{error}")
+
+    tk.Label(
+        win,
+        text=f"詳細：{report_path}",
+        font=("Meiryo", 9),
+        bg="white",
+        anchor="w",
+        wraplength=600
+    ).pack(fill="x", padx=15)
+
+    ttk.Button(win, text="閉じる", width=12, command=win.destroy).pack(pady=10)
+    return win
+
+
+# ------------------------------
+# 変換前の一覧（ヘッダーだけを読む）
+# ------------------------------
+class InventoryWindow:
+    """
+    選んだメールの件名・差出人・日付・サイズ・添付数を表で表示する。
+    読み込み（inventory.iter_scan）は別スレッドで行い、読めた分から表に足していく。
+    見出しをクリックするとその列で並べ替え、CSV / JSONL に保存できる。
+    """
+
+    POLL_MS = 100
+    COLUMNS = (
+        ("subject", "件名", 230),
+        ("from", "差出人", 150),
+        ("date", "日付", 120),
+        ("size", "サイズ", 70),
+        ("attachments", "添付", 45),
+    )
+
+    def __init__(self, parent, files, output_dir=None):
+        from inventory import iter_scan
+
+        self.rows = []
+        self.finished = False
+        self._sort = None
+
+        self.win = tk.Toplevel(parent)
+        self.win.title("メールの一覧")
+        self.win.geometry("680x420")
+        self.win.configure(bg="white")
+        self.win.protocol("WM_DELETE_WINDOW", self.close)
+
+        frame = tk.Frame(self.win, bg="white")
+        frame.pack(fill="both", expand=True, padx=15, pady=(15, 5))
+
+        scrollbar = tk.Scrollbar(frame)
+        scrollbar.pack(side="right", fill="y")
+
+        self.tree = ttk.Treeview(
+            frame,
+            columns=[key for key, _, _ in self.COLUMNS],
+            show="headings",
+            yscrollcommand=scrollbar.set
+        )
+        for key, title, width in self.COLUMNS:
+            anchor = "e" if key in ("size", "attachments") else "w"
+            self.tree.heading(key, text=title, command=lambda k=key: self.sort_by(k))
+            self.tree.column(key, width=width, anchor=anchor, stretch=(key == "subject"))
+        self.tree.tag_configure("error", foreground="#C00")
+        self.tree.pack(side="left", fill="both", expand=True)
+        scrollbar.config(command=self.tree.yview)
+
+        bottom = tk.Frame(self.win, bg="white")
+        bottom.pack(fill="x", padx=15, pady=10)
+
+        self.status = tk.Label(bottom, text="読み込み中…", font=("Meiryo", 9), fg="#666", bg="white")
+        self.status.pack(side="left")
+
+        ttk.Button(bottom, text="閉じる", width=12, command=self.close).pack(side="right")
+        ttk.Button(bottom, text="CSV に保存", width=14, command=self.save).pack(side="right", padx=10)
+
+        self._queue = queue.Queue()
+        self._cancel = threading.Event()
+        targets = expand_targets(files, output_dir)
+
+        def work():
+            try:
+                for row in iter_scan(targets, self._cancel):
+                    self._queue.put(row)
+            finally:
+                self._queue.put(None)
+
+        threading.Thread(target=work, daemon=True).start()
+        self.win.after(self.POLL_MS, self._poll)
+
+    @staticmethod
+    def _values(row) -> tuple:
+        if row["error"]:
+            return (f"（読み込めませんでした）{os.path.basename(row['path'])}", row["error"], "", "", "")
+        date = (row["date"] or "")[:16].replace("T", " ")
+        size = f"{(row['size'] or 0) / 1024:,.0f} KB"
+        return (row["subject"] or "（件名なし）", row["from"] or "", date, size, row["attachments"])
+
+    def _insert(self, row):
+        self.tree.insert("", tk.END, values=self._values(row), tags=("error",) if row["error"] else ())
+
+    def _poll(self):
+        if not self.win.winfo_exists():
+            return
+
+        while True:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is None:
+                self.finished = True
+                break
+            self.rows.append(row)
+            self._insert(row)
+
+        errors = sum(1 for r in self.rows if r["error"])
+        text = f"{len(self.rows)} 件"
+        if errors:
+            text += f" ・ 読み込めなかったメール {errors} 件"
+        if not self.finished:
+            text += " ・ 読み込み中…"
+        self.status.config(text=text)
+
+        if not self.finished:
+            self.win.after(self.POLL_MS, self._poll)
+
+    def sort_by(self, key):
+        # 同じ列をもう一度クリックしたら逆順
+        reverse = self._sort == key
+        self._sort = None if reverse else key
+        self.rows.sort(key=lambda r: (r[key] is None, r[key] if r[key] is not None else ""),
+                       reverse=reverse)
+        self.tree.delete(*self.tree.get_children())
+        for row in self.rows:
+            self._insert(row)
+
+    def save(self):
+        from inventory import InventoryWriter
+
+        path = filedialog.asksaveasfilename(
+            parent=self.win,
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl")]
+        )
+        if not path:
+            return
+        with InventoryWriter(path) as writer:
+            for row in self.rows:
+                writer.add(row)
+        messagebox.showinfo("保存しました", f"{writer.count} 件を保存しました。\n{path}", parent=self.win)
+
+    def close(self):
+        self._cancel.set()
+        self.win.destroy()
+
+
+# ------------------------------
+# D&D を常駐サーバーに任せる
+# ------------------------------
+def forward_drop(paths) -> bool:
+    """
+    常駐サーバーが動いていれば変換を依頼して True を返す。
+    進捗ウィンドウは出さず、変換できなかったメールがあったときだけ一覧を表示する。
+    """
+    import server
+
+    if server.read_state() is None:
+        return False
+
+    report_path = new_report_path()
+    results = []
+    stopped = None
+    try:
+        for r in server.submit(paths, report_path=report_path):
+            results.append(r)
+    except (server.ServerUnavailable, server.ServerError, EOFError, OSError) as e:
+        if not results:
+            # 起動していない・変換を始められなかった → このプロセスで変換し直す
+            return False
+        stopped = str(e) or type(e).__name__
+
+    failures = [(r["path"], r["error"]) for r in results if r["error"]]
+    if stopped:
+        # 途中で止まった → 変換済みの分はそのまま、止まったことも一覧に出す
+        failures.append(("サーバー", stopped))
+    if failures:
+        root = tk.Tk()
+        root.withdraw()
+        win = show_error_summary(root, failures, report_path)
+        win.bind("<Destroy>", lambda e: root.destroy() if e.widget is win else None)
+        root.mainloop()
+
+    return True
+
 
 class ProgressDialog:
     def __init__(self, files):
@@ -12,12 +344,13 @@ class ProgressDialog:
         # --- ウィンドウ ---
         self.win = tk.Tk()
         self.win.title("変換中…")
-        self.win.geometry("420x180")
+        self.win.geometry("420x200")
         self.win.configure(bg="white")
         self.win.resizable(False, False)
 
-        # 閉じるボタン無効（処理中に閉じられないように）
-        self.win.protocol("WM_DELETE_WINDOW", lambda: None)
+        # 処理中に閉じたときはキャンセル扱い
+        self.job = None
+        self.win.protocol("WM_DELETE_WINDOW", self.cancel)
 
         # --- Apple風スタイル ---
         style = ttk.Style()
@@ -49,12 +382,13 @@ class ProgressDialog:
         )
 
         # --- ラベル ---
-        tk.Label(
+        self.label = tk.Label(
             self.win,
             text="メールを変換しています…",
             font=("Meiryo", 12),
             bg="white"
-        ).pack(pady=(20, 10))
+        )
+        self.label.pack(pady=(20, 10))
 
         # --- 進捗バー ---
         self.progress = ttk.Progressbar(
@@ -63,17 +397,27 @@ class ProgressDialog:
             mode="determinate",
             style="Apple.Horizontal.TProgressbar"
         )
-        self.progress.pack(fill="x", padx=40, pady=(0, 20))
+        self.progress.pack(fill="x", padx=40, pady=(0, 6))
 
         self.progress["value"] = 0
         self.progress["maximum"] = 100
 
-        # --- ボタン（最初は処理中で押せない） ---
+        # --- 処理速度・残り時間 ---
+        self.status = tk.Label(
+            self.win,
+            text="",
+            font=("Meiryo", 9),
+            fg="#666",
+            bg="white"
+        )
+        self.status.pack(pady=(0, 10))
+
+        # --- ボタン（処理中はキャンセル） ---
         self.button = ttk.Button(
             self.win,
-            text="処理中…",
+            text="キャンセル",
             width=10,
-            state="disabled"
+            command=self.cancel
         )
         self.button.pack()
 
@@ -85,29 +429,64 @@ class ProgressDialog:
     # 変換処理（D&D専用）
     # ----------------------------------------
     def run_conversion(self):
-        total = len(self.files)
+        # 出力先は各ファイルと同じフォルダ（output_dir=None）
+        targets = expand_targets(self.files, None)
+
         self.progress["value"] = 0
-        self.progress["maximum"] = total
+        if not isinstance(targets, list):
+            # フォルダ・mbox は件数が分からないので流れるバーにする
+            self.progress.config(mode="indeterminate")
+        else:
+            self.progress["maximum"] = len(targets)
 
-        for index, p in enumerate(self.files, start=1):
-            try:
-                out_dir = os.path.dirname(p)
-                convert_any_email(
-                    p,
-                    output_dir=out_dir,
-                    save_external_images=False
-                )
-            except Exception as e:
-                # D&D時は messagebox を出さずログだけ
-                print(f"Error converting {p}: {e}")
-
-            # 進捗更新
-            self.progress["value"] = index
-            self.win.update_idletasks()
+        # D&D時は messagebox を出さず、失敗はレポート（JSONL）に残す
+        self.report_path = new_report_path()
+
+        self.job = BackgroundConversion(
+            self.win,
+            targets,
+            self.on_progress,
+            self.on_done,
+            output_dir=None,
+            save_external_images=False,
+            report_path=self.report_path
+        )
+
+    def on_progress(self, job):
+        if job.total is None:
+            self.progress.step()
+        else:
+            self.progress["value"] = job.done
+        self.status.config(text=job.status_text())
+
+    def cancel(self):
+        if self.job is None or self.job.finished:
+            self.win.destroy()
+            return
+        self.job.cancel()
+        self.button.config(text="中止中…", state="disabled")
+        self.label.config(text="実行中のメールが終わりしだい中止します…")
+
+    def on_done(self, job):
+        if job.error:
+            self.label.config(text=f"変換を続けられませんでした：{job.error}",
+                              font=("Meiryo", 9), wraplength=380)
+        elif job.failures:
+            self.label.config(
+                text=f"{len(job.failures)} 件のメールを変換できませんでした。",
+                font=("Meiryo", 10)
+            )
+        elif job.cancelled:
+            self.label.config(text=f"中止しました（{job.done} 件変換済み）。")
+        else:
+            self.label.config(text="変換が完了しました。")
 
         # 完了時に満タンにする
-        self.progress["value"] = total
-        self.win.update_idletasks()
+        self.progress.config(mode="determinate")
+        if not job.cancelled:
+            self.progress["maximum"] = max(job.total or job.done, 1)
+            self.progress["value"] = self.progress["maximum"]
+        self.status.config(text=job.status_text())
 
         # 完了ボタンに切り替え
         self.button.config(
@@ -117,15 +496,20 @@ class ProgressDialog:
             command=self.win.destroy
         )
 
+        if job.failures:
+            show_error_summary(self.win, job.failures, self.report_path)
+
+
 class EmlConverterGUI:
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("EML / MSG → HTML 変換ツール")
-        self.root.geometry("620x650")
+        self.root.geometry("620x690")
         self.root.configure(bg="white")
 
         self.selected_files = []
         self.output_dir = None
+        self.job = None
 
         # ------------------------------
         # スタイル設定
@@ -204,6 +588,14 @@ class EmlConverterGUI:
             variable=self.save_images_var
         ).pack(pady=(0, 10))
 
+        # 差分変換チェック（デフォルト OFF）
+        self.incremental_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            section_top,
+            text="前回から変更のないメールはスキップする",
+            variable=self.incremental_var
+        ).pack(pady=(0, 10))
+
         # ------------------------------
         # リストセクション
         # ------------------------------
@@ -244,7 +636,14 @@ class EmlConverterGUI:
             width=12,
             command=self.toggle_select_all
         )
-        self.select_toggle_btn.pack(padx=5)
+        self.select_toggle_btn.pack(side="left", padx=5)
+
+        ttk.Button(
+            select_toggle_frame,
+            text="内容を一覧",
+            width=12,
+            command=self.show_inventory
+        ).pack(side="left", padx=5)
 
         # ------------------------------
         # 操作セクション
@@ -277,13 +676,14 @@ class EmlConverterGUI:
         center_frame = tk.Frame(bottom_frame, bg="#F7F7F7")
         center_frame.pack(side="left", expand=True)
 
-        ttk.Button(
+        self.convert_btn = ttk.Button(
             center_frame,
             text="変換する",
             width=18,
             style="ApplePrimary.TButton",
             command=self.convert_files
-        ).pack(pady=5)
+        )
+        self.convert_btn.pack(pady=5)
 
         # 右
         ttk.Button(
@@ -297,7 +697,7 @@ class EmlConverterGUI:
         # 細い進捗バー
         # ------------------------------
         progress_frame = tk.Frame(self.root, bg="white")
-        progress_frame.pack(fill="x", pady=(0, 25))
+        progress_frame.pack(fill="x", pady=(0, 10))
 
         self.progress = ttk.Progressbar(
             progress_frame,
@@ -311,6 +711,16 @@ class EmlConverterGUI:
         self.progress["value"] = 0
         self.progress["maximum"] = 100
 
+        # 処理速度・残り時間
+        self.status_label = tk.Label(
+            progress_frame,
+            text="",
+            font=("Meiryo", 9),
+            fg="#666",
+            bg="white"
+        )
+        self.status_label.pack(pady=(4, 0))
+
     # ------------------------------
     # GUI メソッド
     # ------------------------------
@@ -327,9 +737,10 @@ class EmlConverterGUI:
     def select_files(self):
         paths = filedialog.askopenfilenames(
             filetypes=[
-                ("Email files", "*.eml *.msg"),
+                ("Email files", "*.eml *.msg *.mbox"),
                 ("EML files", "*.eml"),
                 ("MSG files", "*.msg"),
+                ("mbox files", "*.mbox *.mbx"),
                 ("All files", "*.*")
             ]
         )
@@ -375,7 +786,20 @@ class EmlConverterGUI:
         else:
             self.select_toggle_btn.config(text="選択解除")
 
+    def show_inventory(self):
+        # 選択中の項目があればそれだけ、無ければリストのすべて
+        selection = self.listbox.curselection()
+        files = [self.selected_files[i] for i in selection] or list(self.selected_files)
+        if not files:
+            messagebox.showwarning("警告", "ファイルが選択されていません。")
+            return
+        InventoryWindow(self.root, files, self.output_dir)
+
     def on_close(self):
+        if self.job is not None and not self.job.finished:
+            if not messagebox.askyesno("確認", "変換中です。中止して閉じますか？"):
+                return
+            self.job.cancel()
         self.root.destroy()
 
     # ------------------------------
@@ -386,58 +810,122 @@ class EmlConverterGUI:
             messagebox.showwarning("警告", "ファイルが選択されていません。")
             return
 
+        incremental = self.incremental_var.get()
+        if incremental:
+            note = "前回から変更のないメールはスキップします。\n"
+        else:
+            note = "既存の HTML がある場合は上書きされます。\n"
+
         overwrite = messagebox.askyesno(
             "確認",
             f"{len(self.selected_files)} 件のファイルを変換します。\n"
-            "既存の HTML がある場合は上書きされます。\n\n続行しますか？"
+            f"{note}\n続行しますか？"
         )
         if not overwrite:
             return
 
-        total = len(self.selected_files)
+        targets = expand_targets(self.selected_files, self.output_dir)
+        self.progress.config(mode="determinate")
         self.progress["value"] = 0
-        self.progress["maximum"] = total
-        self.root.update_idletasks()
+        if isinstance(targets, list):
+            self.progress["maximum"] = len(targets)
+        else:
+            self.progress.config(mode="indeterminate")
+
+        # 変換中は「変換する」ボタンをキャンセルボタンにする
+        self.convert_btn.config(text="キャンセル", command=self.cancel_conversion)
+        self.status_label.config(text="")
+
+        self.report_path = new_report_path()
+        self.job = BackgroundConversion(
+            self.root,
+            targets,
+            self.on_progress,
+            self.on_done,
+            output_dir=self.output_dir,
+            save_external_images=self.save_images_var.get(),
+            incremental=incremental,
+            report_path=self.report_path
+        )
 
-        for index, p in enumerate(self.selected_files, start=1):
-            try:
-                convert_any_email(
-                    p,
-                    output_dir=self.output_dir,
-                    save_external_images=self.save_images_var.get()
-                )
-            except Exception as e:
-                messagebox.showerror(
-                    "エラー",
-                    f"{os.path.basename(p)} の変換中にエラーが発生しました:\n{e}"
-                )
-
-            self.progress["value"] = index
-            self.root.update_idletasks()
-
-        messagebox.showinfo("完了", f"{total} 件のメールを変換しました。")
+    def cancel_conversion(self):
+        if self.job is None or self.job.finished:
+            return
+        self.job.cancel()
+        self.convert_btn.config(text="中止中…", state="disabled")
+
+    def on_progress(self, job):
+        if job.total is None:
+            self.progress.step()
+        else:
+            self.progress["value"] = job.done
+        self.status_label.config(text=job.status_text())
+
+    def on_done(self, job):
+        self.convert_btn.config(text="変換する", state="normal", command=self.convert_files)
+        self.progress.config(mode="determinate")
+        self.progress["maximum"] = max(job.total or job.done, 1)
+        self.progress["value"] = job.done
+        self.status_label.config(text=job.status_text())
+
+        if job.error:
+            messagebox.showerror("エラー", f"変換を続けられませんでした：\n{job.error}")
+            return
+
+        results = job.results
+        summary = summarize(results)
+
+        if job.cancelled:
+            message = f"中止しました。{len(results)} 件のメールを変換しました。"
+        else:
+            message = f"{len(results)} 件のメールを変換しました。"
+        if job.options["incremental"]:
+            message += f"（うち変更なしでスキップ {summary['skipped']} 件）"
+        if summary["failed"]:
+            message += f"\n変換できなかったメール：{summary['failed']} 件"
+        if job.options["save_external_images"]:
+            cache = summary["image_cache"]
+            hits = cache.get("hits", 0) + cache.get("revalidated", 0)
+            message += f"\n外部画像キャッシュ：ヒット {hits} 件 / 取得 {cache.get('misses', 0)} 件"
+        message += f"\n\n処理時間の内訳：{self.report_path}"
+
+        messagebox.showinfo("完了", message)
+
+        # エラーは途中では出さず、最後に一覧で表示する
+        if job.failures:
+            show_error_summary(self.root, job.failures, self.report_path)
 
     def run(self):
         self.root.mainloop()
 
-# ------------------------------
-# D&D 実行時の処理
-# ------------------------------
-if len(sys.argv) > 1:
-    targets = [
-        p for p in sys.argv[1:]
-        if os.path.isfile(p) and (p.lower().endswith(".eml") or p.lower().endswith(".msg"))
-    ]
 
-    if targets:
-        ProgressDialog(targets)
+if __name__ == "__main__":
+    # 変換はプロセスプールで行うため、ワーカー起動時（spawn / exe 化時）に
+    # D&D・GUI の起動処理が再実行されないよう __main__ の中に置く
+    multiprocessing.freeze_support()
 
-    sys.exit(0)
+    # ------------------------------
+    # 常駐サーバーとして起動（email2html.exe --serve）
+    # ------------------------------
+    if sys.argv[1:2] == ["--serve"]:
+        from server import serve
+        sys.exit(serve())
 
+    # ------------------------------
+    # D&D 実行時の処理
+    # ------------------------------
+    if len(sys.argv) > 1:
+        # EML / MSG に加えて mbox・フォルダ（Maildir・サブフォルダも）を受け付ける
+        targets = [p for p in sys.argv[1:] if is_supported(p)]
 
-# ------------------------------
-# 通常起動（GUI）
-# ------------------------------
-if __name__ == "__main__":
+        # 常駐サーバーが動いていれば任せる（動いていなければこのプロセスで変換）
+        if targets and not forward_drop(targets):
+            ProgressDialog(targets)
+
+        sys.exit(0)
+
+    # ------------------------------
+    # 通常起動（GUI）
+    # ------------------------------
     gui = EmlConverterGUI()
     gui.run()
\ No newline at end of file
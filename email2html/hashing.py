@@ -0,0 +1,21 @@
+import hashlib
+
+
+# ============================================================
+# 書き込みながら SHA-256 を計算する
+#   画像キャッシュ（downloader）と添付の重複排除（dedup）で使う。
+#   sources → dedup 経由で起動時に読み込まれるので、重いモジュールは import しない
+# ============================================================
+class HashingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.sha.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def close(self):
+        self.f.close()
\ No newline at end of file
@@ -0,0 +1,338 @@
+import re
+import threading
+from html import escape, unescape
+
+
+# ============================================================
+# Outlook HTML の軽量化（任意の段階。process_html の後に通す）
+#   - コメント（MSO 条件付きコメント・<![if ...]> を含む）を消す
+#     （<!--[if !mso]><!--> ... <!--<![endif]--> の中身は残す）
+#   - o:p / v:shape / w:... など名前空間付きのタグ（中身は残す）と <xml> を消す
+#   - Word が付ける <link rel=File-List> / <meta name=Generator> などを消す
+#   - インラインの style から mso- で始まる宣言を消し、同じ style が何度も出てくるものは
+#     共通の <style> のクラスにまとめる
+#   - <pre> の外の空白の連続を 1 文字にする
+# ============================================================
+CLASS_PREFIX = "e2h-s"
+MIN_STYLE_USES = 2          # この回数以上出てくる style をクラスにまとめる
+OUT_CHUNK = 64 * 1024       # iter_slim が一度に返す大きさの目安
+
+_TOKEN_RE = re.compile(
+    r'(<!--.*?-->|<!\[(?:end)?if[^>]*>)'                         # コメント・Word の <![if ...]>
+    r'|<(/?)([a-zA-Z][\w:.-]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>',   # タグ
+    re.S | re.I
+)
+_ATTR_RE = re.compile(r'([^\s=/>"\']+)(?:\s*=\s*("[^"]*"|\'[^\']*\'|[^\s>]+))?')
+_DECL_RE = re.compile(r'(?:[^;"\'(]|"[^"]*"|\'[^\']*\'|\([^)]*\))+')
+_SPACE_RE = re.compile(r'[ \t\r\n\f]+')
+_PRE_SPACE_RE = re.compile(r'white-space\s*:\s*pre', re.I)
+
+_RAW_END_RE = {name: re.compile(f"</{name}", re.I) for name in ("style", "script", "textarea")}
+_XML_END_RE = re.compile(r"</xml\s*>", re.I)
+
+_CSS_COMMENT_RE = re.compile(r'/\*.*?\*/|<!--|-->', re.S)
+_CSS_MSO_RE = re.compile(r'(?<=[{;\s])mso-[\w-]+\s*:[^;}]*;?', re.I)
+_CSS_EMPTY_RULE_RE = re.compile(r'[^{}]+\{\s*\}')
+
+_OFFICE_LINK_RELS = ("file-list", "edit-time-data", "themedata", "colorschememapping",
+                     "original-file", "preview")
+_OFFICE_META_NAMES = ("generator", "progid", "originator")
+
+
+# ============================================================
+# 軽量化の効果（プロセス単位で集計）
+# ============================================================
+_stats_lock = threading.Lock()
+_stats = {"files": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def count(key: str, n: int = 1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def take_stats() -> dict:
+    """
+    前回呼び出し以降の集計を返してリセットする。
+    """
+    with _stats_lock:
+        result = dict(_stats)
+        for k in _stats:
+            _stats[k] = 0
+    return result
+
+
+# ============================================================
+# 字句の切り出し
+# ============================================================
+def _tokens(html: str):
+    """
+    (種類, 文字列, 閉じタグか, タグ名（小文字）, 属性) を順に返す。種類は
+    "text" / "comment" / "tag" / "raw"（<style> <script> <textarea> の中身）。
+    """
+    pos = 0
+    while True:
+        m = _TOKEN_RE.search(html, pos)
+        if not m:
+            if pos < len(html):
+                yield "text", html[pos:], None, None, None
+            return
+        if m.start() > pos:
+            yield "text", html[pos:m.start()], None, None, None
+        pos = m.end()
+
+        comment, close, name, attrs = m.groups()
+        if comment is not None:
+            yield "comment", comment, None, None, None
+            continue
+
+        name = name.lower()
+        yield "tag", m.group(0), bool(close), name, attrs
+
+        if not close and name in _RAW_END_RE:
+            end = _RAW_END_RE[name].search(html, pos)
+            end = end.start() if end else len(html)
+            if end > pos:
+                yield "raw", html[pos:end], None, name, None
+            pos = end
+
+
+def _attr(attrs: str, name: str) -> str | None:
+    for m in _ATTR_RE.finditer(attrs):
+        if m.group(1).lower() == name:
+            value = m.group(2) or ""
+            if value[:1] in ("'", '"'):
+                value = value[1:-1]
+            return unescape(value)
+    return None
+
+
+def _is_office_only(name: str, attrs: str) -> bool:
+    if name == "link":
+        return (_attr(attrs, "rel") or "").lower() in _OFFICE_LINK_RELS
+    if name == "meta":
+        return (_attr(attrs, "name") or "").lower() in _OFFICE_META_NAMES
+    return False
+
+
+def _is_style_anchor(kind: str, close: bool, name: str) -> bool:
+    """
+    共通の <style> を置く位置（元の <style> / <link> より前、無ければ </head> か <body> の前）。
+    """
+    if kind != "tag":
+        return False
+    return (not close and name in ("style", "link", "body")) or (close and name == "head")
+
+
+# ============================================================
+# style の整理
+# ============================================================
+def clean_style(value: str) -> str:
+    """
+    style 属性の値（エスケープを戻したもの）から mso- の宣言と余分な空白を除く。
+    """
+    decls = []
+    for m in _DECL_RE.finditer(value):
+        decl = _SPACE_RE.sub(" ", m.group()).strip()
+        if decl and not decl.lower().startswith("mso-"):
+            decls.append(decl)
+    return ";".join(decls)
+
+
+def clean_css(css: str) -> str:
+    """
+    <style> の中身からコメント・mso- の宣言・空になったルール・余分な空白を除く。
+    """
+    css = _CSS_COMMENT_RE.sub("", css)
+    css = _CSS_MSO_RE.sub("", css)
+    css = _CSS_EMPTY_RULE_RE.sub("", css)
+    return _SPACE_RE.sub(" ", css).strip()
+
+
+def _can_share(style: str) -> bool:
+    # !important はクラスに移すと優先順位が変わる。< は </style> を作りかねないので避ける
+    return bool(style) and "!important" not in style.lower() and "<" not in style
+
+
+def _worth_sharing(style: str, uses: int) -> bool:
+    # style='…' をやめる分と、class 属性・ルールが増える分を比べる
+    return uses >= MIN_STYLE_USES and (uses - 1) * len(style) > uses * 16 + 30
+
+
+def _shared_rule(cls: str, style: str) -> str:
+    """
+    インライン style と同じ優先順位になるよう、詳細度 0 の :where() に !important を付ける
+    （作者の通常のルールには勝ち、!important のルールには負ける）。
+    """
+    decls = ";".join(d.group().strip() + "!important" for d in _DECL_RE.finditer(style))
+    return f":where(.{cls}){{{decls}}}"
+
+
+def _attr_value(value: str) -> str:
+    # Outlook の style は "Calibri" のような二重引用符を含むので、なるべく '…' で囲む
+    if '"' in value and "'" not in value:
+        return "'" + escape(value, quote=False) + "'"
+    return '"' + escape(value) + '"'
+
+
+def _rewrite_tag(name: str, attrs: str, classes: dict) -> str:
+    """
+    style 属性を整理したタグを返す（まとめる style ならクラスに置き換える）。
+    """
+    kept = []
+    style = None
+    cls = None
+    for m in _ATTR_RE.finditer(attrs):
+        key = m.group(1).lower()
+        if key in ("style", "class"):
+            # 同じ属性が 2 つあればブラウザと同じく最初のものを使う
+            value = m.group(2) or ""
+            if value[:1] in ("'", '"'):
+                value = value[1:-1]
+            if key == "style" and style is None:
+                style = clean_style(unescape(value))
+            elif key == "class" and cls is None:
+                cls = unescape(value)
+            continue
+        kept.append(m.group())
+
+    shared = classes.get(style)
+    if shared:
+        cls = f"{cls} {shared}" if cls else shared
+        style = None
+
+    if cls is not None:
+        kept.append("class=" + _attr_value(cls))
+    if style:
+        kept.append("style=" + _attr_value(style))
+
+    tail = " /" if attrs.rstrip().endswith("/") else ""
+    return "<" + name + "".join(" " + a for a in kept) + tail + ">"
+
+
+# ============================================================
+# 1 回目：まとめる style を決める
+# ============================================================
+def _survey(html: str) -> tuple:
+    """
+    ({整理後の style: クラス名}, 共通の <style> 要素) を返す。
+    """
+    uses = {}
+    order = []
+    anchor = False
+    for kind, token, close, name, attrs in _tokens(html):
+        if _is_style_anchor(kind, close, name):
+            anchor = True
+        if kind != "tag" or close or ":" in name or "style" not in attrs.lower():
+            continue
+        style = _attr(attrs, "style")
+        if style is None:
+            continue
+        style = clean_style(style)
+        if not _can_share(style):
+            continue
+        if style not in uses:
+            uses[style] = 0
+            order.append(style)
+        uses[style] += 1
+
+    if not anchor:
+        return {}, ""
+
+    classes = {}
+    rules = []
+    for style in order:
+        if _worth_sharing(style, uses[style]):
+            cls = f"{CLASS_PREFIX}{len(classes) + 1}"
+            classes[style] = cls
+            rules.append(_shared_rule(cls, style))
+
+    block = "<style>" + "".join(rules) + "</style>" if rules else ""
+    return classes, block
+
+
+# ============================================================
+# 2 回目：書き出し
+# ============================================================
+def iter_slim(html: str):
+    """
+    軽量化した HTML を少しずつ返す（OUT_CHUNK 程度ずつ）。
+    減らした大きさ（UTF-8 のバイト数）は take_stats で取り出せる。
+    """
+    classes, block = _survey(html)
+    keep_space = _PRE_SPACE_RE.search(html) is not None
+
+    bytes_in = len(html.encode("utf-8"))
+    bytes_out = 0
+    out = []
+    size = 0
+    pre = 0
+    skip_xml_until = -1
+
+    def emit(s):
+        nonlocal size
+        out.append(s)
+        size += len(s)
+
+    pos = 0
+    for kind, token, close, name, attrs in _tokens(html):
+        # 字句は html を隙間なく区切ったものなので、長さを足せば位置が分かる
+        start = pos
+        pos += len(token)
+        if start < skip_xml_until:
+            continue
+
+        if block and _is_style_anchor(kind, close, name):
+            emit(block)
+            block = ""
+
+        if kind == "comment":
+            continue
+
+        if kind == "raw":
+            emit(clean_css(token) if name == "style" else token)
+
+        elif kind == "text":
+            if pre or keep_space:
+                emit(token)
+            else:
+                emit(_SPACE_RE.sub(lambda m: "\n" if "\n" in m.group() else " ", token))
+
+        elif ":" in name:
+            # o:p・v:shape など Outlook / IE だけが解釈するタグ（中身は残す）
+            continue
+
+        elif name == "xml" and not close:
+            # Office のデータ島は中身ごと読み飛ばす
+            m = _XML_END_RE.search(html, pos)
+            skip_xml_until = m.end() if m else len(html)
+
+        elif name == "xml" or _is_office_only(name, attrs):
+            continue
+
+        else:
+            if name == "pre":
+                pre = max(0, pre + (-1 if close else 1))
+            if not close and "style" in attrs.lower():
+                token = _rewrite_tag(name, attrs, classes)
+            emit(token)
+
+        if size >= OUT_CHUNK:
+            chunk = "".join(out)
+            bytes_out += len(chunk.encode("utf-8"))
+            out.clear()
+            size = 0
+            yield chunk
+
+    chunk = "".join(out)
+    bytes_out += len(chunk.encode("utf-8"))
+    if chunk:
+        yield chunk
+
+    count("files")
+    count("bytes_in", bytes_in)
+    count("bytes_out", bytes_out)
+
+
+def slim_html(html: str) -> str:
+    return "".join(iter_slim(html))
\ No newline at end of file
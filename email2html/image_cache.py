@@ -0,0 +1,270 @@
+import os
+import time
+import shutil
+import sqlite3
+import threading
+
+
+# ============================================================
+# 既定値
+# ============================================================
+MAX_CACHE_BYTES = 1024 * 1024 * 1024    # キャッシュ全体の上限（1 GB）
+FRESH_SECONDS = 7 * 24 * 60 * 60        # この期間内は再検証せずに使う
+EVICT_CHECK_BYTES = 64 * 1024 * 1024    # 新しく保存した量がこれを超えたら全体を数え直す
+
+
+def default_cache_dir() -> str:
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "email2html", "image_cache")
+
+
+# ============================================================
+# キャッシュ利用状況（プロセス単位で集計）
+# ============================================================
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "revalidated": 0, "misses": 0, "bytes_saved": 0}
+
+
+def count(key: str, n: int = 1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def take_stats() -> dict:
+    """
+    前回呼び出し以降の集計を返してリセットする。
+    """
+    with _stats_lock:
+        result = dict(_stats)
+        for k in _stats:
+            _stats[k] = 0
+    return result
+
+
+def merge_stats(total: dict, part: dict | None) -> dict:
+    for k, v in (part or {}).items():
+        total[k] = total.get(k, 0) + v
+    return total
+
+
+# ============================================================
+# URL キー + 内容ハッシュの画像キャッシュ
+# ============================================================
+class ImageCache:
+    """
+    URL → (内容の SHA-256, ETag, Last-Modified) を SQLite に、
+    画像本体は objects/<sha の先頭 2 文字>/<sha> に保存する。
+    同じ画像が別 URL で配信されていても本体は 1 つだけ持つ。
+    """
+
+    def __init__(self, cache_dir: str | None = None,
+                 max_bytes: int = MAX_CACHE_BYTES,
+                 fresh_seconds: int = FRESH_SECONDS):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.objects_dir = os.path.join(self.cache_dir, "objects")
+        self.tmp_dir = os.path.join(self.cache_dir, "tmp")
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+
+        # 全体の大きさは、最後に数えた値 + その後このプロセスで増えた分で見積もる
+        self._total = None
+        self._added = 0
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        # 複数のワーカープロセスから同時に使われるので WAL + タイムアウト
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(self.cache_dir, "index.sqlite"),
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " url TEXT PRIMARY KEY,"
+            " sha256 TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " validated REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_sha ON entries(sha256)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries(last_used)")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def object_path(self, sha: str) -> str:
+        return os.path.join(self.objects_dir, sha[:2], sha)
+
+    # --------------------------------------------------------
+    # 参照
+    # --------------------------------------------------------
+    def lookup(self, url: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256, size, etag, last_modified, validated FROM entries WHERE url = ?",
+                (url,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        entry = {
+            "url": url,
+            "sha256": row[0],
+            "size": row[1],
+            "etag": row[2],
+            "last_modified": row[3],
+            "validated": row[4],
+        }
+
+        # 本体が消されていたら無いものとして扱う
+        if not os.path.exists(self.object_path(entry["sha256"])):
+            return None
+
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["validated"] < self.fresh_seconds
+
+    def conditional_headers(self, entry: dict | None) -> dict:
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def touch(self, url: str, validated: bool = False):
+        now = time.time()
+        with self._lock:
+            if validated:
+                self._db.execute(
+                    "UPDATE entries SET last_used = ?, validated = ? WHERE url = ?",
+                    (now, now, url)
+                )
+            else:
+                self._db.execute("UPDATE entries SET last_used = ? WHERE url = ?", (now, url))
+
+    # --------------------------------------------------------
+    # 登録
+    # --------------------------------------------------------
+    def temp_file(self):
+        """
+        ダウンロード用の一時ファイル (path, file) を返す。
+        """
+        path = os.path.join(self.tmp_dir, f"{os.getpid()}-{threading.get_ident()}-{time.time_ns()}")
+        return path, open(path, "wb")
+
+    def store(self, url: str, tmp_path: str, sha: str, size: int,
+              etag: str | None, last_modified: str | None) -> dict:
+        """
+        ダウンロード済みの一時ファイルを本体として登録する（同じ内容があれば捨てる）。
+        """
+        obj = self.object_path(sha)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+
+        if os.path.exists(obj):
+            os.remove(tmp_path)
+            added = 0
+        else:
+            os.replace(tmp_path, obj)
+            added = size
+
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries"
+                " (url, sha256, size, etag, last_modified, validated, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, sha, size, etag, last_modified, now, now)
+            )
+            self._added += added
+
+        # 今登録したものは直後に配置するので消さない
+        self.evict(keep=url)
+        return {"url": url, "sha256": sha, "size": size}
+
+    # --------------------------------------------------------
+    # 出力フォルダへの配置（ハードリンク、できなければコピー）
+    # --------------------------------------------------------
+    def materialize(self, entry: dict, dest: str):
+        src = self.object_path(entry["sha256"])
+        tmp = f"{dest}.{threading.get_ident()}.tmp"
+
+        try:
+            os.link(src, tmp)
+        except OSError:
+            # 別ドライブ・ハードリンク非対応のファイルシステム
+            shutil.copyfile(src, tmp)
+
+        os.replace(tmp, dest)
+
+    # --------------------------------------------------------
+    # LRU で容量を超えた分を削除
+    # --------------------------------------------------------
+    def evict(self, keep: str | None = None):
+        """
+        全体の大きさは毎回は数えない。見積もりが上限を超えたときと、
+        このプロセスで EVICT_CHECK_BYTES 以上増えたとき（他のワーカーも同じキャッシュに
+        書くので、見積もりは少なめにずれる）だけ数え直す。
+        """
+        with self._lock:
+            if (self._total is not None and self._added < EVICT_CHECK_BYTES
+                    and self._total + self._added <= self.max_bytes):
+                return
+
+            total = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM"
+                " (SELECT sha256, MAX(size) AS size FROM entries GROUP BY sha256)"
+            ).fetchone()[0]
+            self._total = total
+            self._added = 0
+            if total <= self.max_bytes:
+                return
+
+            removed = []
+            rows = self._db.execute(
+                "SELECT url, sha256, size FROM entries ORDER BY last_used"
+            ).fetchall()
+            for url, sha, size in rows:
+                if total <= self.max_bytes:
+                    break
+                if url == keep:
+                    continue
+                self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                still_used = self._db.execute(
+                    "SELECT 1 FROM entries WHERE sha256 = ? LIMIT 1", (sha,)
+                ).fetchone()
+                if not still_used:
+                    removed.append(sha)
+                    total -= size
+            self._total = total
+
+        for sha in removed:
+            try:
+                os.remove(self.object_path(sha))
+            except OSError:
+                pass
+
+
+# ============================================================
+# プロセス単位の既定キャッシュ
+# ============================================================
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def default_cache() -> ImageCache:
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ImageCache()
+        return _default_cache
\ No newline at end of file
@@ -0,0 +1,258 @@
+import io
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from common import NameAllocator, build_cid_map, resolve_cid
+
+
+# ============================================================
+# 本文から参照される画像の作り直し（任意の段階。Pillow が必要）
+#   Outlook の MSG には BMP / TIFF のインライン画像や無圧縮のスクリーンショットが
+#   そのまま入っていることが多い。添付を _files/ に書き出した後、本文の cid: から
+#   参照される大きな画像だけを PNG / WebP / JPEG に変換し（必要なら縮小し）、
+#   HTML の参照先を作り直したファイルに差し替える。
+# ============================================================
+FORMATS = ("auto", "png", "webp", "jpeg")
+MIN_BYTES = 256 * 1024          # これより小さい画像は（縮小が要らなければ）そのまま
+MAX_WORKERS = 4                 # 1 通の中で同時に変換する画像の数
+JPEG_QUALITY = 85
+WEBP_QUALITY = 85
+PHOTO_RATIO = 0.5               # auto で PNG より JPEG がこの割合以下なら写真とみなす
+
+# ブラウザで表示できないので、大きさに関係なく変換する形式（EMF / WMF は Windows のみ）
+_NOT_FOR_BROWSER = (".tif", ".tiff", ".emf", ".wmf")
+_RASTER_EXTS = (".bmp", ".dib", ".png", ".jpg", ".jpeg", ".jfif", ".webp") + _NOT_FOR_BROWSER
+_JPEG_EXTS = (".jpg", ".jpeg", ".jfif")
+_FORMAT_EXTS = {"png": ".png", "webp": ".webp", "jpeg": ".jpg"}
+
+_CID_RE = re.compile(r'cid:([^"\'\s<>)]+)', re.I)
+
+
+def make_options(fmt: str = "auto", max_size: int | None = None,
+                 keep_original: bool = False) -> dict:
+    """
+    変換の設定。プロセス間・マニフェストでそのまま受け渡せるよう dict にする。
+    fmt は FORMATS のどれか（auto はスクリーンショットを PNG、写真を JPEG にする）、
+    max_size は縦横の上限（ピクセル。None なら縮小しない）、
+    keep_original=True なら元の画像も _files/ に残す（本文からは参照しない）。
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"画像の形式は {', '.join(FORMATS)} のどれかです: {fmt}")
+    return {"format": fmt, "max_size": max_size, "keep_original": bool(keep_original)}
+
+
+def available() -> bool:
+    """
+    Pillow が使えるか（画像の変換は Pillow が入っているときだけ）。
+    """
+    import importlib.util
+    return importlib.util.find_spec("PIL") is not None
+
+
+# ============================================================
+# 変換の効果（プロセス単位で集計）
+# ============================================================
+_stats_lock = threading.Lock()
+_stats = {"images": 0, "bytes_in": 0, "bytes_out": 0, "failed": 0}
+
+
+def count(key: str, n: int = 1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def take_stats() -> dict:
+    """
+    前回呼び出し以降の集計を返してリセットする。
+    """
+    with _stats_lock:
+        result = dict(_stats)
+        for k in _stats:
+            _stats[k] = 0
+    return result
+
+
+# ============================================================
+# 対象の画像
+# ============================================================
+def referenced_images(html, attachments: list) -> list:
+    """
+    本文（body_html）の cid: から参照される添付を、出てきた順に重複なく返す。
+    """
+    if not html or not attachments:
+        return []
+    if isinstance(html, bytes):
+        # cid: の値は ASCII なので、探すだけなら文字コードを判定しなくてよい
+        html = html.decode("latin-1")
+
+    # 参照先として添付の dict そのものを引けるようにする
+    cid_map = build_cid_map(attachments, "", link=lambda att: att)
+    found = []
+    seen = set()
+    for m in _CID_RE.finditer(html):
+        att = resolve_cid(m.group(1), cid_map)
+        if att is not None and id(att) not in seen:
+            seen.add(id(att))
+            found.append(att)
+    return found
+
+
+def _is_candidate(path: str, options: dict) -> bool:
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in _RASTER_EXTS:
+        # GIF はアニメーションを壊さないよう対象外
+        return False
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    return size >= MIN_BYTES or ext in _NOT_FOR_BROWSER or bool(options.get("max_size"))
+
+
+# ============================================================
+# 1 枚分の変換
+# ============================================================
+def _flatten(img, Image):
+    """
+    JPEG は透過を持てないので、透明な部分を白にする。
+    """
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img if img.mode in ("RGB", "L") else img.convert("RGB")
+
+
+def _has_alpha(img) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+
+
+def _encode(img, fmt: str, Image) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "jpeg":
+        _flatten(img, Image).save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True,
+                                  progressive=True)
+    elif fmt == "webp":
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if _has_alpha(img) else "RGB")
+        img.save(buf, "WEBP", quality=WEBP_QUALITY, method=4)
+    else:
+        if img.mode == "CMYK":
+            img = img.convert("RGB")
+        # optimize=True は数 MB のスクリーンショットで数秒かかる割に数 % しか縮まない
+        img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def transcode_image(path: str, options: dict) -> tuple | None:
+    """
+    path の画像を options に従って作り直し、(拡張子, バイト列) を返す。
+    作り直す必要が無い・小さくならないときは None。
+    """
+    from PIL import Image
+
+    ext = os.path.splitext(path)[1].lower()
+    size = os.path.getsize(path)
+    max_size = options.get("max_size")
+    fmt = options.get("format", "auto")
+
+    with Image.open(path) as img:
+        too_large = bool(max_size) and max(img.size) > max_size
+        if size < MIN_BYTES and ext not in _NOT_FOR_BROWSER and not too_large:
+            return None
+
+        if too_large and img.format == "JPEG":
+            # JPEG は縮小してデコードできる（大きな写真で速い）
+            img.draft("RGB", (max_size, max_size))
+        img.load()
+        work = img
+        if too_large:
+            # パレットのまま縮小すると最近傍になるので、色を展開してから縮小する
+            if img.mode == "P":
+                work = img.convert("RGBA" if _has_alpha(img) else "RGB")
+            else:
+                work = img.copy()
+            work.thumbnail((max_size, max_size), Image.LANCZOS)
+
+        if fmt == "auto":
+            if ext in _JPEG_EXTS:
+                fmt = "jpeg"
+            else:
+                # スクリーンショットは PNG がよく縮む。写真は JPEG の方がずっと小さい
+                data = _encode(work, "png", Image)
+                if len(data) >= MIN_BYTES and not _has_alpha(work):
+                    photo = _encode(work, "jpeg", Image)
+                    if len(photo) <= len(data) * PHOTO_RATIO:
+                        return ".jpg", photo
+                if len(data) < size or ext in _NOT_FOR_BROWSER:
+                    return ".png", data
+                return None
+
+        data = _encode(work, fmt, Image)
+
+    if len(data) >= size and ext not in _NOT_FOR_BROWSER:
+        return None
+    return _FORMAT_EXTS[fmt], data
+
+
+# ============================================================
+# 1 通分（write_message から、添付を書き出した後に呼ぶ）
+# ============================================================
+def transcode_attachments(msg_data: dict, attach_folder: str, names: NameAllocator,
+                          options: dict) -> int:
+    """
+    本文から参照される大きな画像を attach_folder に作り直し、添付の saved_name
+    （ストリーミング解析のものは path も）を新しいファイルに差し替える。
+    HTML は後から saved_name で組み立てるので、cid: の参照先も新しいファイルになる。
+    keep_original=False なら元のファイルは消す。作り直した枚数を返す。
+    """
+    targets = [att for att in referenced_images(msg_data.get("body_html"),
+                                                msg_data.get("attachments") or [])
+               if _is_candidate(os.path.join(attach_folder, att["saved_name"]), options)]
+    if not targets:
+        return 0
+
+    keep_original = options.get("keep_original", False)
+
+    def job(att):
+        src = os.path.join(attach_folder, att["saved_name"])
+        size = os.path.getsize(src)
+        try:
+            converted = transcode_image(src, options)
+        except Exception:
+            # 壊れた画像・Pillow が読めない形式（Windows 以外の EMF など）はそのまま
+            count("failed")
+            return 0, 0
+        if converted is None:
+            return 0, 0
+
+        ext, data = converted
+        name = names.reserve(os.path.splitext(att["filename"])[0] + ext)
+        dst = os.path.join(attach_folder, name)
+        with open(dst, "wb") as f:
+            f.write(data)
+        if not keep_original:
+            os.remove(src)
+
+        att["saved_name"] = name
+        if "path" in att:
+            att["path"] = dst
+        count("images")
+        count("bytes_in", size)
+        count("bytes_out", len(data))
+        return size, len(data)
+
+    done = 0
+    with metrics.stage("transcode") as s:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(targets))) as ex:
+            for size_in, size_out in ex.map(job, targets):
+                if size_out:
+                    done += 1
+                    s["bytes_in"] += size_in
+                    s["bytes_out"] += size_out
+    metrics.count("transcoded", done)
+    return done
\ No newline at end of file
@@ -0,0 +1,135 @@
+import io
+import os
+import csv
+import sys
+import json
+from email.utils import parsedate_to_datetime
+
+from sources import item_label
+
+
+# ============================================================
+# 一覧の列
+#   変換の前に件名・差出人・日付・サイズ・添付数だけを並べて確認するためのもの。
+#   EML はヘッダーとパートのヘッダーだけ、MSG はプロパティのストリームだけを読み、
+#   本文・添付はデコードしない。
+# ============================================================
+FIELDS = ("path", "format", "subject", "from", "to", "cc", "date", "message_id",
+          "size", "attachments", "error")
+
+INVENTORY_EXTS = (".csv", ".jsonl")
+
+
+def iso_date(value: str | None) -> str | None:
+    """
+    Date ヘッダーを並べ替えやすい ISO 8601 にする（読めなければそのまま）。
+    """
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).isoformat()
+    except (TypeError, ValueError, IndexError):
+        return value
+
+
+# ============================================================
+# 1 通分
+# ============================================================
+def _scan_eml(f) -> dict:
+    from eml_converter import message_metadata
+    from mime_stream import scan_headers
+
+    headers, attachments = scan_headers(f)
+    row = message_metadata(headers)
+    row["date"] = iso_date(row["date"])
+    row["attachments"] = attachments
+    return row
+
+
+def scan_item(item) -> dict:
+    """
+    item（.eml / .msg のパスか sources の dict）の一覧の 1 行を返す。
+    読めなかったものは error に理由を入れる（例外は投げない）。
+    """
+    row = dict.fromkeys(FIELDS)
+    row["path"] = item_label(item)
+    try:
+        if isinstance(item, dict) and "data" in item:
+            row["format"] = "eml"
+            row["size"] = len(item["data"])
+            row.update(_scan_eml(io.BytesIO(item["data"])))
+            return row
+
+        path = item if isinstance(item, str) else item["path"]
+        row["size"] = os.path.getsize(path)
+        if isinstance(item, str) and os.path.splitext(path)[1].lower() == ".msg":
+            from msg_converter import read_msg_summary
+            row["format"] = "msg"
+            row.update(read_msg_summary(path))
+        else:
+            row["format"] = "eml"
+            with open(path, "rb") as f:
+                row.update(_scan_eml(f))
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def iter_scan(items, cancel=None):
+    """
+    items（sources.expand_targets の戻り値など）を先頭から順に読み、1 行ずつ yield する。
+    ヘッダーを読むだけなので、プロセスプールは使わずこのプロセスで処理する。
+    """
+    for item in items:
+        if cancel is not None and cancel.is_set():
+            return
+        yield scan_item(item)
+
+
+# ============================================================
+# CSV / JSONL への書き出し（1 行ずつ。10 万件でも溜め込まない）
+# ============================================================
+class InventoryWriter:
+    """
+    path の拡張子が .jsonl なら 1 行 1 件の JSON、それ以外は CSV で書く。
+    CSV は Excel でそのまま開けるよう BOM 付き UTF-8。path が "-" なら標準出力に CSV。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self.jsonl = path.lower().endswith(".jsonl")
+
+        if path == "-":
+            self._f = sys.stdout
+            self._close = False
+        else:
+            folder = os.path.dirname(os.path.abspath(path))
+            os.makedirs(folder, exist_ok=True)
+            encoding = "utf-8" if self.jsonl else "utf-8-sig"
+            self._f = open(path, "w", encoding=encoding, newline="" if not self.jsonl else "\n")
+            self._close = True
+
+        self._csv = None
+        if not self.jsonl:
+            self._csv = csv.DictWriter(self._f, fieldnames=FIELDS, extrasaction="ignore")
+            self._csv.writeheader()
+
+    def add(self, row: dict):
+        if self.jsonl:
+            self._f.write(json.dumps({k: row.get(k) for k in FIELDS}, ensure_ascii=False) + "\n")
+        else:
+            self._csv.writerow(row)
+        self.count += 1
+
+    def close(self):
+        if self._close:
+            self._f.close()
+        else:
+            self._f.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
\ No newline at end of file
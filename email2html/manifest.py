@@ -0,0 +1,142 @@
+import os
+import json
+import sqlite3
+import hashlib
+
+
+# ============================================================
+# 既定値
+# ============================================================
+# 変換結果が変わる修正をしたら上げる（上がると全件再変換になる）
+CONVERTER_VERSION = "2.4"
+
+HASH_CHUNK = 1024 * 1024
+
+
+def default_manifest_path() -> str:
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "email2html", "manifest.sqlite")
+
+
+# ============================================================
+# 元ファイルの情報
+# ============================================================
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def source_info(path: str) -> dict:
+    """
+    変換に使った元ファイルのサイズ・更新日時・内容ハッシュ。
+    ワーカー側で変換の直前に取る。
+    """
+    st = os.stat(path)
+    return {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha256": file_sha256(path),
+    }
+
+
+def options_key(options: dict) -> str:
+    return json.dumps(options, sort_keys=True, ensure_ascii=False)
+
+
+# ============================================================
+# 差分変換用のマニフェスト
+# ============================================================
+class Manifest:
+    """
+    (元ファイルの絶対パス, 出力 HTML の絶対パス) ごとに、変換したときの
+    サイズ・更新日時・SHA-256・変換器のバージョン・オプションを記録する。
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or default_manifest_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        # 1 件ごとにすぐコミットする（書き込みロックを握り続けず、他のプロセスの
+        # 変換を待たせない。途中で止まってもそこまでの記録が残る）。
+        # WAL + synchronous=NORMAL なので、コミットのたびに fsync はしない
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outputs ("
+            " source TEXT NOT NULL,"
+            " output TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " sha256 TEXT NOT NULL,"
+            " version TEXT NOT NULL,"
+            " options TEXT NOT NULL,"
+            " PRIMARY KEY (source, output))"
+        )
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _get(self, source: str, output: str):
+        return self._db.execute(
+            "SELECT size, mtime_ns, sha256, version, options FROM outputs"
+            " WHERE source = ? AND output = ?",
+            (os.path.abspath(source), os.path.abspath(output))
+        ).fetchone()
+
+    def is_up_to_date(self, source: str, output: str, options: dict) -> bool:
+        """
+        前回と同じ元ファイル・同じ変換器・同じオプションで、出力も残っていれば True。
+        サイズと更新日時が一致すれば内容は読まない（1 件あたり stat 2 回 + 索引 1 回）。
+        """
+        row = self._get(source, output)
+        if row is None:
+            return False
+
+        size, mtime_ns, sha, version, opts = row
+        if version != CONVERTER_VERSION or opts != options_key(options):
+            return False
+
+        try:
+            st = os.stat(source)
+        except OSError:
+            return False
+
+        if not os.path.exists(output):
+            return False
+
+        if st.st_size != size:
+            return False
+
+        if st.st_mtime_ns == mtime_ns:
+            return True
+
+        # 更新日時だけ変わった（コピーし直した等）なら内容で判定し、記録も更新
+        if file_sha256(source) != sha:
+            return False
+
+        self.record(source, output, {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha},
+                    options)
+        return True
+
+    def record(self, source: str, output: str, info: dict, options: dict):
+        self._db.execute(
+            "INSERT OR REPLACE INTO outputs"
+            " (source, output, size, mtime_ns, sha256, version, options)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(source), os.path.abspath(output),
+             info["size"], info["mtime_ns"], info["sha256"],
+             CONVERTER_VERSION, options_key(options))
+        )
\ No newline at end of file
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+# ============================================================
+# 既定値
+# ============================================================
+PERCENTILES = (50, 90, 99)
+
+
+def default_report_dir() -> str:
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "email2html", "reports")
+
+
+def new_report_path() -> str:
+    """
+    既定のフォルダに日時入りのレポートファイル名を作る（フォルダも作成）。
+    """
+    folder = default_report_dir()
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, time.strftime("convert-%Y%m%d-%H%M%S.jsonl"))
+
+
+# ============================================================
+# 1 通分の計測（プロセス単位。無効のときは何も記録しない）
+#   段階ごとの所要時間・入出力バイト数と、添付・画像などの件数を集める。
+#   文字列を扱う段階（decode の出力・html）は文字数を bytes_* に入れる。
+# ============================================================
+_lock = threading.Lock()
+_enabled = False
+_started = None
+_stages = {}
+_counts = {}
+
+
+def begin(enabled: bool = True):
+    """
+    1 通の変換を始める前に呼ぶ。前回の記録は捨てる。
+    """
+    global _enabled, _started
+    with _lock:
+        _enabled = enabled
+        _started = time.perf_counter()
+        _stages.clear()
+        _counts.clear()
+
+
+def take() -> dict | None:
+    """
+    begin 以降の記録を返してリセットする。計測が無効なら None。
+    """
+    global _enabled
+    with _lock:
+        if not _enabled:
+            return None
+        result = {
+            "seconds": time.perf_counter() - _started,
+            "stages": {k: dict(v) for k, v in _stages.items()},
+            "counts": dict(_counts),
+        }
+        _enabled = False
+        _stages.clear()
+        _counts.clear()
+    return result
+
+
+@contextmanager
+def stage(name: str, bytes_in: int = 0):
+    """
+    with stage("mime_parse", len(raw)) as s: ... のように処理を囲む。
+    出力の大きさが分かれば s["bytes_out"] に入れる。
+    """
+    rec = {"bytes_in": bytes_in, "bytes_out": 0}
+    if not _enabled:
+        yield rec
+        return
+
+    t = time.perf_counter()
+    try:
+        yield rec
+    finally:
+        elapsed = time.perf_counter() - t
+        with _lock:
+            s = _stages.setdefault(name, {"seconds": 0.0, "bytes_in": 0, "bytes_out": 0})
+            s["seconds"] += elapsed
+            s["bytes_in"] += rec["bytes_in"]
+            s["bytes_out"] += rec["bytes_out"]
+
+
+def count(key: str, n: int = 1):
+    if not _enabled:
+        return
+    with _lock:
+        _counts[key] = _counts.get(key, 0) + n
+
+
+# ============================================================
+# バッチ全体の集計
+# ============================================================
+def percentile(values: list, p: float) -> float | None:
+    """
+    ソート済みの values の p パーセンタイル（線形補間）。
+    """
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def _distribution(values: list) -> dict:
+    values = sorted(values)
+    d = {"count": len(values), "total": sum(values)}
+    for p in PERCENTILES:
+        d[f"p{p}"] = percentile(values, p)
+    d["max"] = values[-1] if values else None
+    return d
+
+
+class Summary:
+    """
+    結果 dict を 1 件ずつ受け取り、ファイル単位・段階単位の所要時間の分布を出す。
+    数値だけを持つので、2 万件でも結果そのものは溜め込まない。
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.failed = 0
+        self.skipped = 0
+        self.seconds = []
+        self.stages = {}
+        self.counts = {}
+        self.dedup = {}
+        self.slim = {}
+        self.transcode = {}
+
+    def add(self, result: dict):
+        self.files += 1
+        if result.get("error"):
+            self.failed += 1
+        elif result.get("skipped"):
+            self.skipped += 1
+
+        for k, v in (result.get("dedup") or {}).items():
+            self.dedup[k] = self.dedup.get(k, 0) + v
+        for k, v in (result.get("slim") or {}).items():
+            self.slim[k] = self.slim.get(k, 0) + v
+        for k, v in (result.get("transcode") or {}).items():
+            self.transcode[k] = self.transcode.get(k, 0) + v
+
+        m = result.get("metrics")
+        if not m:
+            return
+
+        self.seconds.append(m["seconds"])
+        for name, s in m["stages"].items():
+            agg = self.stages.setdefault(name, {"seconds": [], "bytes_in": 0, "bytes_out": 0})
+            agg["seconds"].append(s["seconds"])
+            agg["bytes_in"] += s["bytes_in"]
+            agg["bytes_out"] += s["bytes_out"]
+        for k, v in m["counts"].items():
+            self.counts[k] = self.counts.get(k, 0) + v
+
+    def result(self) -> dict:
+        stages = {}
+        for name, agg in self.stages.items():
+            d = _distribution(agg["seconds"])
+            d["bytes_in"] = agg["bytes_in"]
+            d["bytes_out"] = agg["bytes_out"]
+            stages[name] = d
+
+        return {
+            "files": self.files,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "seconds": _distribution(self.seconds),
+            "stages": stages,
+            "counts": dict(self.counts),
+            "dedup": dict(self.dedup),
+            "slim": dict(self.slim),
+            "transcode": dict(self.transcode),
+        }
+
+
+# ============================================================
+# ファイル単位の JSONL レポート + バッチの集計
+# ============================================================
+class Report:
+    """
+    結果を 1 件 1 行の JSON で path に書き、閉じるときに集計を
+    <path の拡張子を除いたもの>.summary.json に書く。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.summary_path = os.path.splitext(path)[0] + ".summary.json"
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self._f = open(path, "w", encoding="utf-8", newline="\n")
+        self._summary = Summary()
+
+    def add(self, result: dict):
+        self._summary.add(result)
+
+        line = {
+            "path": result["path"],
+            "output": result.get("output"),
+            "error": result.get("error"),
+            "skipped": bool(result.get("skipped")),
+        }
+        m = result.get("metrics")
+        if m:
+            line.update(m)
+        if result.get("image_cache"):
+            line["image_cache"] = result["image_cache"]
+        if result.get("dedup"):
+            line["dedup"] = result["dedup"]
+        if result.get("slim"):
+            line["slim"] = result["slim"]
+        if result.get("transcode"):
+            line["transcode"] = result["transcode"]
+
+        self._f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    def summary(self) -> dict:
+        return self._summary.result()
+
+    def close(self):
+        self._f.close()
+        with open(self.summary_path, "w", encoding="utf-8", newline="\n") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
\ No newline at end of file
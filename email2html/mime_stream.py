@@ -0,0 +1,394 @@
+import io
+import os
+import re
+import binascii
+import mimetypes
+from email import policy
+from email.parser import BytesHeaderParser
+
+from common import normalize_cid, unique_name
+
+
+# ============================================================
+# 既定値
+# ============================================================
+LINE_LIMIT = 64 * 1024      # 改行の無い巨大な行も、この長さごとに区切って読む
+SKIP_CHUNK_MIN = 8 * 1024   # 読み捨てるパートは、この大きさから倍々に（最大 SKIP_CHUNK）
+SKIP_CHUNK = 1024 * 1024    # 読み込んで区切り行の候補を探す
+WHITESPACE = b" \t\r\n"
+
+
+# ============================================================
+# 保存対象のパートとファイル名
+# ============================================================
+def part_filename(part) -> str | None:
+    """
+    ディスクに保存するパートならファイル名を、そうでなければ None を返す。
+      - Content-Disposition: attachment でファイル名があるもの
+      - Content-ID を持つインライン画像など（multipart/related の中身）
+    """
+    disp = (part.get_content_disposition() or "").lower()
+    filename = part.get_filename()
+
+    if disp == "attachment":
+        return filename or None
+
+    cid = part.get("Content-ID")
+    if not cid or part.get_content_maintype() in ("multipart", "text", "message"):
+        return None
+
+    if filename:
+        return filename
+
+    # ファイル名が無ければ Content-ID の @ より前 + 拡張子
+    name = re.sub(r'[\\/:*?"<>|\s]', "_", normalize_cid(cid).split("@", 1)[0]) or "inline"
+    ext = mimetypes.guess_extension(part.get_content_type()) or ""
+    if ext and not name.lower().endswith(ext):
+        name += ext
+    return name
+
+
+# ============================================================
+# 行単位の読み込み（境界判定のため行頭かどうかも返す）
+# ============================================================
+class _LineReader:
+    def __init__(self, f):
+        self.f = f
+        self.at_line_start = True
+        self.seekable = f.seekable()
+
+    def next(self):
+        """
+        (line, 行頭から始まっているか) を返す。EOF なら (b"", ...)。
+        """
+        start = self.at_line_start
+        line = self.f.readline(LINE_LIMIT)
+        self.at_line_start = line.endswith(b"\n")
+        return line, start
+
+    def skip_to_dash_line(self):
+        """
+        次の "--" で始まる行（区切り行の候補）の手前まで、行に分けずにまとめて読み飛ばす。
+        base64 の本文には "-" が現れないので、添付 1 つ分をほぼ一度に飛ばせる。
+        seek できないファイルでは何もしない（1 行ずつ読むのと同じ結果になる）。
+        """
+        if not self.seekable:
+            return
+
+        f = self.f
+        size = SKIP_CHUNK_MIN
+        while True:
+            pos = f.tell()
+            chunk = f.read(size)
+            size = min(size * 2, SKIP_CHUNK)
+            if len(chunk) < 3:
+                f.seek(pos)
+                return
+            if self.at_line_start and chunk.startswith(b"--"):
+                f.seek(pos)
+                return
+            i = chunk.find(b"\n--")
+            if i >= 0:
+                f.seek(pos + i + 1)
+                self.at_line_start = True
+                return
+            # チャンクの境目にかかる "\n--" を見逃さないよう、末尾 2 バイトは次で読み直す
+            f.seek(pos + len(chunk) - 2)
+            self.at_line_start = chunk[-3:-2] == b"\n"
+
+
+def _match_boundary(line: bytes, start: bool, boundaries: list):
+    """
+    line が boundaries のどれかの区切り行なら (boundary, 終端か) を返す。
+    内側の boundary から順に調べる。
+    """
+    if not start or not line.startswith(b"--"):
+        return None
+
+    s = line.rstrip(WHITESPACE)
+    for b in reversed(boundaries):
+        if s == b"--" + b:
+            return b, False
+        if s == b"--" + b + b"--":
+            return b, True
+
+    return None
+
+
+def _strip_newline(line: bytes) -> bytes:
+    if line.endswith(b"\r\n"):
+        return line[:-2]
+    if line.endswith(b"\n"):
+        return line[:-1]
+    return line
+
+
+# ============================================================
+# Content-Transfer-Encoding の逐次デコーダ
+# ============================================================
+class _Base64Decoder:
+    def __init__(self, out):
+        self.out = out
+        self.buf = b""
+
+    def feed(self, data: bytes):
+        self.buf += data.translate(None, WHITESPACE)
+        n = len(self.buf) // 4 * 4
+        if n:
+            self._write(self.buf[:n])
+            self.buf = self.buf[n:]
+
+    def finish(self):
+        if self.buf:
+            # 末尾のパディング不足を補う
+            self._write(self.buf + b"=" * (-len(self.buf) % 4))
+            self.buf = b""
+
+    def _write(self, data: bytes):
+        try:
+            self.out.write(binascii.a2b_base64(data))
+        except binascii.Error:
+            pass
+
+
+class _QuotedPrintableDecoder:
+    def __init__(self, out):
+        self.out = out
+        self.buf = b""
+
+    def feed(self, data: bytes):
+        # "=XX" が途中で切れないよう、行の終わりまで溜めてからデコード
+        self.buf += data
+        pos = self.buf.rfind(b"\n")
+        if pos >= 0:
+            self.out.write(binascii.a2b_qp(self.buf[:pos + 1]))
+            self.buf = self.buf[pos + 1:]
+
+    def finish(self):
+        if self.buf:
+            self.out.write(binascii.a2b_qp(self.buf))
+            self.buf = b""
+
+
+class _RawDecoder:
+    def __init__(self, out):
+        self.out = out
+
+    def feed(self, data: bytes):
+        self.out.write(data)
+
+    def finish(self):
+        pass
+
+
+def _make_decoder(cte: str, out):
+    cte = (cte or "").strip().lower()
+    if cte == "base64":
+        return _Base64Decoder(out)
+    if cte == "quoted-printable":
+        return _QuotedPrintableDecoder(out)
+    return _RawDecoder(out)
+
+
+# ============================================================
+# ストリーミング MIME 解析
+# ============================================================
+class StreamingParser:
+    """
+    EML をツリーに展開せず先頭から 1 回だけ読み、葉パートごとに
+    on_part(headers) を呼ぶ。on_part が返したファイルオブジェクトに
+    デコード済みの本文をチャンク単位で書き込む（None ならデコードせずに読み飛ばす）。
+    headers は本文を持たない email.message.EmailMessage。
+    on_part の中では、self.depth がそのパートを囲む message/rfc822 の数（外側のメールは 0）。
+    parse の後、メール全体のヘッダーは self.headers に入っている。
+    """
+
+    def __init__(self, on_part, on_part_end=None):
+        self.on_part = on_part
+        self.on_part_end = on_part_end
+        self._header_parser = BytesHeaderParser(policy=policy.default)
+
+    def parse(self, f):
+        self.headers = None
+        self.depth = 0
+        self._entity(_LineReader(f), [])
+
+    def _read_headers(self, reader, boundaries):
+        lines = []
+        while True:
+            line, start = reader.next()
+            if not line:
+                return b"".join(lines), None
+            hit = _match_boundary(line, start, boundaries)
+            if hit:
+                return b"".join(lines), hit
+            if start and line.strip(WHITESPACE) == b"":
+                return b"".join(lines), None
+            lines.append(line)
+
+    def _skip(self, reader, boundaries):
+        if not boundaries:
+            # 一番外側のパートの後ろには何も無いので、読まずに終える
+            return None
+        while True:
+            reader.skip_to_dash_line()
+            line, start = reader.next()
+            if not line:
+                return None
+            hit = _match_boundary(line, start, boundaries)
+            if hit:
+                return hit
+
+    def _entity(self, reader, boundaries):
+        """
+        ヘッダーと本文を 1 つ読み、終わりを示した区切り行 (boundary, 終端か) を返す。
+        """
+        raw_headers, hit = self._read_headers(reader, boundaries)
+        headers = self._header_parser.parsebytes(raw_headers)
+        if self.headers is None:
+            # メール全体のヘッダー（parse の後で参照できる）
+            self.headers = headers
+        if hit:
+            # ヘッダーの途中で区切りが来た（壊れたメール）
+            return hit
+
+        disp = (headers.get_content_disposition() or "").lower()
+        boundary = headers.get_boundary() if headers.get_content_maintype() == "multipart" else None
+
+        if boundary:
+            b = boundary.encode("ascii", "replace")
+            inner = boundaries + [b]
+
+            # プリアンブルを読み飛ばし、子パートを順に処理
+            hit = self._skip(reader, inner)
+            while hit and hit[0] == b and not hit[1]:
+                hit = self._entity(reader, inner)
+
+            # 終端区切りの後のエピローグは外側の区切りまで読み飛ばす
+            if hit and hit[0] == b:
+                hit = self._skip(reader, boundaries)
+            return hit
+
+        if headers.get_content_type() == "message/rfc822" and disp != "attachment":
+            # 転送メールなどは中身を続けて解析する
+            self.depth += 1
+            try:
+                return self._entity(reader, boundaries)
+            finally:
+                self.depth -= 1
+
+        out = self.on_part(headers)
+        if out is None:
+            # 読み捨てるパートはデコードせず、区切り行まで飛ばす
+            hit = self._skip(reader, boundaries)
+            if self.on_part_end:
+                self.on_part_end(headers, None)
+            return hit
+
+        decoder = _make_decoder(headers.get("Content-Transfer-Encoding"), out)
+
+        # 区切り行の直前の改行は区切りの一部なので、1 行遅れで書き込む
+        prev = None
+        hit = None
+        try:
+            while True:
+                line, start = reader.next()
+                if not line:
+                    break
+                hit = _match_boundary(line, start, boundaries)
+                if hit:
+                    break
+                if prev is not None:
+                    decoder.feed(prev)
+                prev = line
+
+            if prev is not None:
+                decoder.feed(_strip_newline(prev) if hit else prev)
+            decoder.finish()
+        except BaseException:
+            out.close()
+            raise
+
+        if self.on_part_end:
+            self.on_part_end(headers, out)
+
+        return hit
+
+
+# ============================================================
+# EML をストリーミングで処理（添付はディスクへ直接書き出す）
+# ============================================================
+def scan_eml(path: str, attach_folder: str, opener=None):
+    """
+    添付ファイル・インライン画像を attach_folder にチャンク単位で書き出し、
+    (保存したパートのリスト, 本文, メール全体のヘッダー) を返す。
+    リストの要素は {"filename", "saved_name", "content_id", "content_type"}、
+    本文は (content_type, payload, charset) か None。
+    本文の選び方は eml_converter.index_parts と同じく
+    最初の text/html、無ければ最初の text/plain（添付は除く。転送されたメールの中の本文は
+    外側に無いときだけ使う）。
+    opener(path) を渡すと、添付の書き出し先をそれで開く（既定は open(path, "wb")）。
+    """
+    state = {"saved": [], "used": set(), "counters": {}, "html": None, "text": None}
+    depths = {}
+
+    def on_part(headers):
+        filename = part_filename(headers)
+
+        if filename:
+            # 添付が 0 件ならフォルダを作らない
+            os.makedirs(attach_folder, exist_ok=True)
+            saved_name = unique_name(filename, state["used"], state["counters"])
+            state["saved"].append({
+                "filename": filename,
+                "saved_name": saved_name,
+                "content_id": headers.get("Content-ID"),
+                "content_type": headers.get_content_type(),
+            })
+            out_path = os.path.join(attach_folder, saved_name)
+            return opener(out_path) if opener else open(out_path, "wb")
+
+        disp = (headers.get_content_disposition() or "").lower()
+        ctype = headers.get_content_type()
+        if disp != "attachment" and ctype in ("text/html", "text/plain"):
+            key = "html" if ctype == "text/html" else "text"
+            if key in depths and depths[key] <= parser.depth:
+                # もう本文が決まっているパートはデコードせずに読み飛ばす
+                return None
+            depths[key] = parser.depth
+            return io.BytesIO()
+
+        return None
+
+    def on_part_end(headers, out):
+        if isinstance(out, io.BytesIO):
+            body = (headers.get_content_type(), out.getvalue(), headers.get_content_charset())
+            state["html" if body[0] == "text/html" else "text"] = body
+        elif out is not None:
+            out.close()
+
+    parser = StreamingParser(on_part, on_part_end)
+    with open(path, "rb") as f:
+        parser.parse(f)
+
+    return state["saved"], state["html"] or state["text"], parser.headers
+
+
+# ============================================================
+# ヘッダーだけを読む（一覧表示用。本文・添付はデコードしない）
+# ============================================================
+def scan_headers(f):
+    """
+    (メール全体のヘッダー, 添付・インライン画像の数) を返す。
+    数え方は scan_eml で保存されるパートと同じ（part_filename を参照）。
+    """
+    state = {"attachments": 0}
+
+    def on_part(headers):
+        if part_filename(headers):
+            state["attachments"] += 1
+        return None
+
+    parser = StreamingParser(on_part)
+    parser.parse(f)
+    return parser.headers, state["attachments"]
\ No newline at end of file
@@ -1,102 +1,153 @@
 import os
-import extract_msg
+import functools
+import mimetypes
+from contextlib import contextmanager
 
+import metrics
 from common import (
     decode_bytes,
-    build_html_from_msg,
+    name_attachments,
 )
+from writers import write_output
 
 
 # ============================================================
-# MSG を解析（extract_msg 版）
+# MSG を開く（extract_msg 版）
+#   添付の中身は一度に読み込まず、書き出すときに 1 件ずつ読む。
+#   extract_msg の Attachment は作った時点で中身を読み込むので、
+#   添付は OLE のストリームを直接たどる（MS-OXMSG のプロパティ名）。
 # ============================================================
-def parse_msg_via_library(msg_path: str) -> dict:
-    """
-    extract_msg を使って MSG を解析し、
-    HTML 本文・TEXT 本文・添付ファイル（OLE画像含む）を取得する。
-    """
-    msg = extract_msg.Message(msg_path)
+ATTACH_PREFIX = "__attach"
+PROP_ATTACH_DATA = "__substg1.0_37010102"      # PR_ATTACH_DATA_BIN（添付の中身）
+PROP_LONG_FILENAME = "__substg1.0_3707"        # PR_ATTACH_LONG_FILENAME
+PROP_SHORT_FILENAME = "__substg1.0_3704"       # PR_ATTACH_FILENAME
+PROP_DISPLAY_NAME = "__substg1.0_3001"         # PR_DISPLAY_NAME
+PROP_CONTENT_ID = "__substg1.0_3712"           # PR_ATTACH_CONTENT_ID
+PROP_MIME_TYPE = "__substg1.0_370E"            # PR_ATTACH_MIME_TAG
+
 
-    subject = msg.subject or ""
-    body_html = msg.htmlBody or ""
-    body_text = msg.body or ""
+def _attachment_dirs(msg) -> list:
+    dirs = []
+    for entry in msg.listDir(False, True, False):
+        if entry[0].startswith(ATTACH_PREFIX) and entry[0] not in dirs:
+            dirs.append(entry[0])
+    return dirs
 
+
+def _lazy_attachments(msg) -> list:
+    """
+    添付の名前・Content-ID・MIME タイプだけを読み、中身は "read"（呼ぶと bytes を返す）にする。
+    中身のストリームが無いもの（埋め込みメッセージなど）は含めない。
+    """
     attachments = []
-    for att in msg.attachments:
-        filename = att.longFilename or att.shortFilename or att.filename
-        if not filename:
+    for d in _attachment_dirs(msg):
+        data_stream = f"{d}/{PROP_ATTACH_DATA}"
+        if not msg.exists(data_stream):
             continue
 
-        data = att.data
-        if not data:
+        filename = (msg.getStringStream(f"{d}/{PROP_LONG_FILENAME}")
+                    or msg.getStringStream(f"{d}/{PROP_SHORT_FILENAME}")
+                    or msg.getStringStream(f"{d}/{PROP_DISPLAY_NAME}"))
+        if not filename:
             continue
 
+        content_type = (msg.getStringStream(f"{d}/{PROP_MIME_TYPE}")
+                        or mimetypes.guess_type(filename)[0])
+
         attachments.append({
             "filename": filename,
-            "data": data
+            "content_id": msg.getStringStream(f"{d}/{PROP_CONTENT_ID}"),
+            "content_type": content_type,
+            "read": functools.partial(msg.getStream, data_stream),
         })
 
-    return {
-        "subject": subject,
-        "body_html": body_html,
-        "body_text": body_text,
-        "attachments": attachments,
-    }
-
-
-# ============================================================
-# MSG 添付ファイル保存（OLE画像含む）
-# ============================================================
-def save_msg_attachments(msg_data: dict, attach_folder: str):
-    os.makedirs(attach_folder, exist_ok=True)
+    return attachments
 
-    for att in msg_data.get("attachments", []):
-        filename = att["filename"]
-        data = att["data"]
 
-        out_path = os.path.join(attach_folder, filename)
+@contextmanager
+def open_msg(source):
+    """
+    MSG を開いて msg_data を返し、with を抜けるときにファイルを閉じる。
+    添付は "data" の代わりに "read" を持つので、with の中で書き出すこと。
+    source は MSG のパスか、MSG ファイルの中身（バイト列）。
+    """
+    # extract_msg は読み込みが重いので、MSG を変換するときだけ import する
+    import extract_msg
+
+    size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+    with metrics.stage("msg_parse", size):
+        msg = extract_msg.Message(source, delayAttachments=True)
+
+    with msg:
+        with metrics.stage("msg_parse"):
+            subject = msg.subject or ""
+            attachments = _lazy_attachments(msg)
+            msg_data = {
+                "subject": subject,
+                "body_html": msg.htmlBody or "",
+                "body_text": msg.body or "",
+                "attachments": attachments,
+                "metadata": {
+                    "subject": subject,
+                    "from": msg.sender,
+                    "to": msg.to,
+                    "cc": msg.cc,
+                    "date": str(msg.date) if msg.date else None,
+                    "message_id": getattr(msg, "messageId", None),
+                },
+            }
+
+        # cid 置換で参照する保存名（同じメール内で重ならないように）
+        name_attachments(attachments)
+
+        yield msg_data
+
+
+def parse_msg_via_library(source) -> dict:
+    """
+    open_msg の結果に添付の中身（"data"）を読み込んでから閉じる（メモリ上で使う場合）。
+    """
+    with open_msg(source) as msg_data:
+        for att in msg_data["attachments"]:
+            att["data"] = att.pop("read")()
+    return msg_data
 
-        # 同名ファイルがあれば連番を付ける
-        base, ext = os.path.splitext(out_path)
-        i = 1
-        while os.path.exists(out_path):
-            out_path = f"{base}({i}){ext}"
-            i += 1
 
-        with open(out_path, "wb") as f:
-            f.write(data)
+# ============================================================
+# 一覧表示用（プロパティのストリームだけを読み、本文・添付の中身は読まない）
+# ============================================================
+def read_msg_summary(source) -> dict:
+    """
+    {"subject", "from", "to", "date", "message_id", "attachments"（件数）} を返す。
+    """
+    import extract_msg
+
+    with extract_msg.Message(source, delayAttachments=True) as msg:
+        attachments = sum(1 for d in _attachment_dirs(msg)
+                          if msg.exists(f"{d}/{PROP_ATTACH_DATA}"))
+        # extract_msg のバージョンによって datetime か文字列
+        date = msg.date
+        return {
+            "subject": msg.subject or "",
+            "from": msg.sender,
+            "to": msg.to,
+            "date": date.isoformat() if hasattr(date, "isoformat") else (date or None),
+            "message_id": getattr(msg, "messageId", None),
+            "attachments": attachments,
+        }
 
 
 # ============================================================
 # MSG → HTML（v2.0 完全版）
 # ============================================================
-def msg_to_html(msg_path: str, output_dir: str, save_external_images: bool):
-    # 1. MSG を解析
-    msg_data = parse_msg_via_library(msg_path)
-
-    # 2. 出力ファイル名のベース
+def msg_to_html(msg_path: str, output_dir: str, save_external_images: bool, layout: str = "files",
+                dedup_attachments: bool = False, slim: bool = False,
+                transcode: dict | None = None):
+    # 1. 出力ファイル名のベース
     base_name = os.path.splitext(os.path.basename(msg_path))[0]
 
-    # 3. 添付フォルダ（外部画像保存のために常に作る）
-    attach_folder = os.path.join(output_dir, base_name + "_files")
-    os.makedirs(attach_folder, exist_ok=True)
-
-    # 4. 添付ファイル保存（添付がある場合のみ）
-    attachments = msg_data.get("attachments", [])
-    if len(attachments) > 0:
-        save_msg_attachments(msg_data, attach_folder)
-
-    # 5. HTML 本文を構築（cid 置換・外部画像保存などは common 側）
-    html = build_html_from_msg(
-        msg_data,
-        save_external_images,
-        attach_folder,   # ← None にしない（外部画像保存のため）
-        base_name
-    )
-
-    # 6. HTML の保存
-    html_out = os.path.join(output_dir, base_name + ".html")
-    with open(html_out, "w", encoding="utf-8", newline="\n") as f:
-        f.write(html)
-
-    return html_out
\ No newline at end of file
+    # 2. MSG を開き、添付（1 件ずつ読み込む）・HTML 本文（cid 置換・外部画像保存）を
+    #    layout の形式で書き出してから閉じる
+    with open_msg(msg_path) as msg_data:
+        return write_output(msg_data, output_dir, base_name, save_external_images, layout,
+                            dedup_attachments, slim, transcode)
\ No newline at end of file
@@ -0,0 +1,276 @@
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from html import unescape
+
+from common import decode_bytes
+from inventory import iso_date
+
+
+# ============================================================
+# 全文検索の索引（SQLite FTS5）
+#   変換中のワーカーが msg_data から件名・差出人・宛先・本文・添付名を取り出し、
+#   親プロセスがそれを索引に入れる（元のメールを読み直す 2 回目の走査はしない）。
+#   日本語は分かち書きせず、漢字・かなの連続を 2 文字ずつ（bi-gram）に切って入れる。
+# ============================================================
+MAX_BODY_CHARS = 1000000        # 本文はこの文字数までを索引に入れる
+DEFAULT_LIMIT = 50
+
+COLUMNS = ("subject", "sender", "recipients", "attachments", "body")
+
+# 検索語の "from:田中" のような列の指定
+COLUMN_ALIASES = {
+    "subject": "subject",
+    "from": "sender",
+    "to": "recipients",
+    "cc": "recipients",
+    "attachment": "attachments",
+    "body": "body",
+}
+
+# 分かち書きをしない文字（漢字・かな・ハングル）。・や記号は区切りとして扱う
+_CJK = ("\u3005\u3041-\u309f\u30a1-\u30fa\u30fc-\u30ff\u3400-\u4dbf\u4e00-\u9fff"
+        "\uf900-\ufaff\uac00-\ud7af")
+_RUN_RE = re.compile(f"([{_CJK}]+)|[^{_CJK}]+")
+_WORD_RE = re.compile(r"\w", re.U)
+
+_SKIP_RE = re.compile(r"<(head|style|script)\b.*?</\1\s*>|<!--.*?-->", re.S | re.I)
+_TAG_RE = re.compile(r"<[^>]*>")
+
+
+def _normalize(text: str) -> str:
+    # 全角英数・半角カナをそろえ、大文字小文字を区別しない
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def _run_tokens(run: str, last: bool = False) -> list:
+    """
+    漢字・かなの連続 run を bi-gram に切る。索引では末尾の 1 文字も単独で入れ、
+    1 文字の検索語（前方一致）でも見つかるようにする。
+    last=True（検索語の最後）なら末尾の 1 文字は入れない。
+    """
+    grams = [run[i:i + 2] for i in range(len(run) - 1)]
+    if not last or len(run) == 1:
+        grams.append(run[-1])
+    return grams
+
+
+def ngram_text(text: str) -> str:
+    """
+    索引に入れる形（bi-gram と英数字の語を空白で区切ったもの）にする。
+    英数字・記号は FTS5 の unicode61 がそのまま語に区切る。
+    """
+    out = []
+    for m in _RUN_RE.finditer(_normalize(text or "")):
+        out.extend(_run_tokens(m.group(1)) if m.group(1) else [m.group()])
+    return " ".join(out)
+
+
+def _phrase(term: str) -> str | None:
+    """
+    検索語 1 つを FTS5 のフレーズ（"..."、1 文字の漢字・かなで終わるなら前方一致）にする。
+    """
+    runs = list(_RUN_RE.finditer(_normalize(term)))
+    tokens = []
+    prefix = False
+    for i, m in enumerate(runs):
+        if m.group(1):
+            last = i == len(runs) - 1
+            tokens.extend(_run_tokens(m.group(1), last))
+            prefix = last and len(m.group(1)) == 1
+        else:
+            tokens.append(m.group())
+    text = " ".join(tokens)
+    if not _WORD_RE.search(text):
+        return None
+    return '"' + text.replace('"', '""') + '"' + ("*" if prefix else "")
+
+
+def query_expr(query: str) -> str:
+    """
+    空白区切りの検索語（すべてを含むものを探す）を FTS5 の MATCH 式にする。
+    "from:田中" "subject:見積" のように列を指定できる（COLUMN_ALIASES）。
+    """
+    parts = []
+    for term in query.split():
+        column = None
+        key, sep, rest = term.partition(":")
+        if sep and rest and key.lower() in COLUMN_ALIASES:
+            column = COLUMN_ALIASES[key.lower()]
+            term = rest
+        phrase = _phrase(term)
+        if phrase is None:
+            continue
+        parts.append(f"{column} : {phrase}" if column else phrase)
+    return " AND ".join(parts)
+
+
+# ============================================================
+# 索引に入れる内容（ワーカープロセス側。metrics と同じくプロセス単位で 1 通分を持つ）
+# ============================================================
+_lock = threading.Lock()
+_enabled = False
+_doc = None
+
+
+def begin(enabled: bool = True):
+    """
+    1 通の変換を始める前に呼ぶ。前回の内容は捨てる。
+    """
+    global _enabled, _doc
+    with _lock:
+        _enabled = enabled
+        _doc = None
+
+
+def take() -> dict | None:
+    """
+    begin 以降に collect した内容を返してリセットする。無効・未収集なら None。
+    """
+    global _enabled, _doc
+    with _lock:
+        doc = _doc
+        _enabled = False
+        _doc = None
+    return doc
+
+
+def html_to_text(html: str) -> str:
+    """
+    タグ・<style>・<script>・コメントを除いた本文の文字列（空白は整えない）。
+    """
+    return unescape(_TAG_RE.sub(" ", _SKIP_RE.sub(" ", html)))
+
+
+def collect(msg_data: dict):
+    """
+    writers.write_output / message_entries から呼ばれ、msg_data から索引に入れる内容を作る。
+    無効のときは何もしない。bi-gram への変換もワーカー側で済ませる。
+    """
+    global _doc
+    if not _enabled:
+        return
+
+    meta = msg_data.get("metadata") or {}
+    html = msg_data.get("body_html") or ""
+    if isinstance(html, bytes):
+        html = decode_bytes(html, None)
+    body = html_to_text(html) if html.strip() else (msg_data.get("body_text") or "")
+
+    subject = meta.get("subject") or msg_data.get("subject") or ""
+    sender = meta.get("from") or ""
+    recipients = ", ".join(v for v in (meta.get("to"), meta.get("cc")) if v)
+    attachments = "\n".join(att["filename"] for att in msg_data.get("attachments") or [])
+
+    doc = {
+        "subject": subject,
+        "from": sender,
+        "date": iso_date(meta.get("date")),
+        "attachments": attachments,
+        "tokens": {
+            "subject": ngram_text(subject),
+            "sender": ngram_text(sender),
+            "recipients": ngram_text(recipients),
+            "attachments": ngram_text(attachments),
+            "body": ngram_text(body[:MAX_BODY_CHARS]),
+        },
+    }
+    with _lock:
+        _doc = doc
+
+
+# ============================================================
+# 索引ファイル（親プロセス側）
+# ============================================================
+class SearchIndex:
+    """
+    出力（HTML / .mht / アーカイブ内の名前）ごとに 1 行。同じ出力を変換し直すと置き換える。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # 1 通ごとにコミットする（途中で止まっても入れた分は残る）。
+        # WAL + synchronous=NORMAL なので、コミットのたびに fsync はしない
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY,"
+            " output TEXT NOT NULL UNIQUE,"
+            " source TEXT,"
+            " subject TEXT,"
+            " sender TEXT,"
+            " date TEXT,"
+            " attachments TEXT)"
+        )
+        # bi-gram は ngram_text で作るので、FTS5 側は空白と記号で区切るだけ
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+            + ", ".join(COLUMNS) + ", tokenize = 'unicode61 remove_diacritics 0')"
+        )
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, output: str, source: str | None, doc: dict):
+        output = os.path.abspath(output)
+        # 置き換え（DELETE + INSERT）を 1 つのトランザクションでコミットする
+        with self._db:
+            row = self._db.execute("SELECT id FROM messages WHERE output = ?",
+                                   (output,)).fetchone()
+            if row is not None:
+                self._db.execute("DELETE FROM messages_fts WHERE rowid = ?", row)
+                self._db.execute("DELETE FROM messages WHERE id = ?", row)
+
+            cur = self._db.execute(
+                "INSERT INTO messages (output, source, subject, sender, date, attachments)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (output, source, doc["subject"], doc["from"], doc["date"], doc["attachments"])
+            )
+            tokens = doc["tokens"]
+            self._db.execute(
+                "INSERT INTO messages_fts (rowid, " + ", ".join(COLUMNS) + ")"
+                " VALUES (?" + ", ?" * len(COLUMNS) + ")",
+                (cur.lastrowid, *(tokens[c] for c in COLUMNS))
+            )
+
+    def search(self, query: str, limit: int = DEFAULT_LIMIT) -> list:
+        """
+        query（query_expr を参照）に一致するメールを関連の高い順に返す。
+        要素は {"output", "source", "subject", "from", "date"}。
+        """
+        expr = query_expr(query)
+        if not expr:
+            return []
+        rows = self._db.execute(
+            "SELECT m.output, m.source, m.subject, m.sender, m.date"
+            " FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+            " WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?",
+            (expr, limit)
+        ).fetchall()
+        return [dict(zip(("output", "source", "subject", "from", "date"), r)) for r in rows]
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+
+def search(path: str, query: str, limit: int = DEFAULT_LIMIT) -> list:
+    """
+    索引ファイル path を開いて SearchIndex.search を 1 回行う。
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"索引がありません: {path}")
+    with SearchIndex(path) as index:
+        return index.search(query, limit)
\ No newline at end of file
@@ -0,0 +1,261 @@
+import os
+import json
+import secrets
+import threading
+
+
+# ============================================================
+# 既定値
+# ============================================================
+def default_state_path() -> str:
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "email2html", "server.json")
+
+
+class ServerUnavailable(Exception):
+    pass
+
+
+class ServerError(RuntimeError):
+    """
+    サーバーが変換を続けられなかった（("error", メッセージ) の応答）。
+    """
+
+
+# ============================================================
+# 接続情報（待ち受けアドレスと認証キー）の受け渡し
+#   待ち受けは Windows では名前付きパイプ、それ以外では Unix ソケットで、
+#   同じ PC の中からしか接続できない（TCP と違い小さな応答が遅延することもない）。
+#   サーバーが起動時に書き、クライアントが読む。キーを知らない接続は拒否される。
+# ============================================================
+def write_state(path: str, address: str, authkey: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+
+    # 認証キーを含むので本人だけが読めるように作る
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"pid": os.getpid(), "address": address, "authkey": authkey.hex()}, f)
+    os.replace(tmp, path)
+
+
+def read_state(path: str | None = None) -> dict | None:
+    try:
+        with open(path or default_state_path(), encoding="utf-8") as f:
+            state = json.load(f)
+        return {"pid": state["pid"], "address": state["address"],
+                "authkey": bytes.fromhex(state["authkey"])}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def remove_state(path: str):
+    # 別のサーバーが書き直していたら消さない
+    state = read_state(path)
+    if state and state["pid"] == os.getpid():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# ============================================================
+# クライアント側
+# ============================================================
+def connect(state_path: str | None = None):
+    """
+    起動中のサーバーへの接続を返す。動いていなければ ServerUnavailable。
+    """
+    state = read_state(state_path)
+    if state is None:
+        raise ServerUnavailable("server is not running")
+
+    from multiprocessing.connection import Client, AuthenticationError
+    try:
+        return Client(state["address"], authkey=state["authkey"])
+    except (OSError, EOFError, AuthenticationError) as e:
+        # 前回のサーバーが落ちて接続情報だけ残っている場合など
+        raise ServerUnavailable(str(e)) from e
+
+
+def is_running(state_path: str | None = None) -> bool:
+    try:
+        conn = connect(state_path)
+    except ServerUnavailable:
+        return False
+    with conn:
+        conn.send({"op": "ping"})
+        return conn.recv() == ("pong", None)
+
+
+def submit(inputs, output_dir: str | None = None, save_external_images: bool = False,
+           incremental: bool = False, manifest_path: str | None = None,
+           report_path: str | None = None, state_path: str | None = None,
+           layout: str = "files", archive_path: str | None = None,
+           dedup_attachments: bool = False, slim: bool = False, transcode: dict | None = None,
+           index_path: str | None = None):
+    """
+    起動中のサーバーに変換を依頼し、結果 dict を終わったものから yield する。
+    サーバーが動いていなければ最初の next() で ServerUnavailable、
+    サーバー側で変換を続けられなくなったらその時点で ServerError。
+    サーバーは別の作業フォルダで動くので、パスはここで絶対パスにして渡す。
+    """
+    conn = connect(state_path)
+    with conn:
+        conn.send({
+            "op": "convert",
+            "inputs": [os.path.abspath(p) for p in inputs],
+            "output_dir": os.path.abspath(output_dir) if output_dir else None,
+            "save_external_images": bool(save_external_images),
+            "incremental": bool(incremental),
+            "manifest_path": os.path.abspath(manifest_path) if manifest_path else None,
+            "report_path": os.path.abspath(report_path) if report_path else None,
+            "layout": layout,
+            "archive_path": os.path.abspath(archive_path) if archive_path else None,
+            "dedup_attachments": bool(dedup_attachments),
+            "slim": bool(slim),
+            "transcode": transcode,
+            "index_path": os.path.abspath(index_path) if index_path else None,
+        })
+        while True:
+            kind, value = conn.recv()
+            if kind == "result":
+                yield value
+            elif kind == "done":
+                return
+            else:
+                raise ServerError(value)
+
+
+def stop(state_path: str | None = None) -> bool:
+    try:
+        conn = connect(state_path)
+    except ServerUnavailable:
+        return False
+    with conn:
+        conn.send({"op": "stop"})
+        conn.recv()
+    return True
+
+
+# ============================================================
+# サーバー側（ワーカープロセスを起動したまま待ち受ける）
+# ============================================================
+class ConversionServer:
+    """
+    ワーカープロセスのプールを常駐させ、接続ごとに 1 つの変換ジョブを受け付ける。
+    ジョブはスレッドで並行に処理し、同じプールを共有する。
+    """
+
+    def __init__(self, workers: int | None = None, state_path: str | None = None):
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing.connection import Listener, AuthenticationError
+        from batch import default_workers, warm_up
+
+        self.workers = workers or default_workers()
+        self.state_path = state_path or default_state_path()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+
+        # 最初のジョブでワーカー起動・import を待たないよう、先に全員起こしておく
+        # （待ち受けより先に起動し、ワーカーに待ち受けのソケットを引き継がせない）
+        for f in [self.pool.submit(warm_up) for _ in range(self.workers)]:
+            f.result()
+
+        self.authkey = secrets.token_bytes(32)
+        self.listener = Listener(authkey=self.authkey)
+        self._stopping = threading.Event()
+        self._accept_errors = (OSError, EOFError, AuthenticationError)
+
+    @property
+    def address(self) -> str:
+        return self.listener.address
+
+    def serve_forever(self):
+        write_state(self.state_path, self.address, self.authkey)
+        try:
+            while not self._stopping.is_set():
+                try:
+                    conn = self.listener.accept()
+                except self._accept_errors:
+                    # 認証に失敗した接続など。待ち受けは続ける
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            remove_state(self.state_path)
+            self.listener.close()
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def shutdown(self):
+        self._stopping.set()
+        # accept() で止まっている待ち受けを起こす
+        try:
+            from multiprocessing.connection import Client
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+
+    def _handle(self, conn):
+        with conn:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                return
+
+            op = request.get("op")
+            if op == "ping":
+                conn.send(("pong", None))
+            elif op == "stop":
+                conn.send(("done", None))
+                self.shutdown()
+            elif op == "convert":
+                self._convert(conn, request)
+            else:
+                conn.send(("error", f"unknown request: {op}"))
+
+    def _convert(self, conn, request: dict):
+        from batch import iter_convert
+        from sources import expand_targets
+
+        cancel = threading.Event()
+        try:
+            targets = expand_targets(request["inputs"], request["output_dir"])
+            for result in iter_convert(targets, request["output_dir"],
+                                       request["save_external_images"], self.workers,
+                                       request["incremental"], request["manifest_path"],
+                                       request["report_path"],
+                                       cancel=cancel, pool=self.pool,
+                                       layout=request.get("layout", "files"),
+                                       archive_path=request.get("archive_path"),
+                                       dedup_attachments=request.get("dedup_attachments", False),
+                                       slim=request.get("slim", False),
+                                       transcode=request.get("transcode"),
+                                       index_path=request.get("index_path")):
+                try:
+                    conn.send(("result", result))
+                except OSError:
+                    # クライアントが切断した（D&D のウィンドウを閉じた等）→ 残りは中止
+                    cancel.set()
+            if not cancel.is_set():
+                conn.send(("done", None))
+        except Exception as e:
+            try:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+            except OSError:
+                pass
+
+
+def serve(workers: int | None = None, state_path: str | None = None) -> int:
+    """
+    フォアグラウンドでサーバーを動かす（Ctrl+C か stop() で終了）。
+    """
+    if is_running(state_path):
+        print("email2html server is already running")
+        return 1
+
+    server = ConversionServer(workers, state_path)
+    print(f"email2html server listening on {server.address} with {server.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
\ No newline at end of file
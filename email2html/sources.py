@@ -0,0 +1,211 @@
+import os
+import re
+
+from dedup import STORE_DIR
+
+
+# ============================================================
+# 対象とする拡張子
+# ============================================================
+MESSAGE_EXTS = (".eml", ".msg")
+MBOX_EXTS = (".mbox", ".mbx")
+
+_FROM_ESCAPED_RE = re.compile(rb"^>+From ")
+
+
+# ============================================================
+# 変換対象の 1 通
+#   .eml / .msg ファイルはパス文字列のまま、
+#   mbox の中身は dict（name / data / output_dir / origin）、
+#   Maildir のファイルは dict（name / path / output_dir / origin）で表す
+# ============================================================
+def message_item(name: str, data: bytes, output_dir: str, origin: str) -> dict:
+    return {"name": name, "data": data, "output_dir": output_dir, "origin": origin}
+
+
+def file_item(name: str, path: str, output_dir: str) -> dict:
+    return {"name": name, "path": path, "output_dir": output_dir, "origin": path}
+
+
+def item_label(item) -> str:
+    return item if isinstance(item, str) else item["origin"]
+
+
+# ============================================================
+# 形式の判定
+# ============================================================
+def is_maildir(path: str) -> bool:
+    return os.path.isdir(os.path.join(path, "cur")) and os.path.isdir(os.path.join(path, "new"))
+
+
+def is_mbox(path: str) -> bool:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in MBOX_EXTS:
+        return True
+    if ext:
+        return False
+
+    # 拡張子なし（Thunderbird の Inbox など）は先頭行で判定
+    try:
+        with open(path, "rb") as f:
+            return f.read(5) == b"From "
+    except OSError:
+        return False
+
+
+def html_folder_for(path: str) -> str:
+    """
+    mbox / Maildir の既定の出力先（隣に <名前>_html フォルダを作る）。
+    """
+    path = os.path.normpath(path)
+    name = os.path.splitext(os.path.basename(path))[0] if os.path.isfile(path) else os.path.basename(path)
+    return os.path.join(os.path.dirname(path), name + "_html")
+
+
+# ============================================================
+# mbox（1 通ずつ読み出す。ファイル全体は読み込まない）
+# ============================================================
+def iter_mbox(path: str, output_dir: str | None = None):
+    """
+    "From " 行で区切られた mbox を先頭から 1 回だけ読み、1 通ずつ item を yield する。
+    本文中の ">From " は mboxrd と同じく ">" を 1 つ外して元に戻す。
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    out_dir = output_dir or html_folder_for(path)
+    index = 0
+    lines = None
+
+    def flush():
+        # 区切りの "From " 行の直前の空行はメッセージに含めない
+        if lines and lines[-1].strip() == b"":
+            lines.pop()
+        return message_item(f"{stem}_{index:05d}", b"".join(lines), out_dir, f"{path}#{index}")
+
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b"From "):
+                if lines is not None:
+                    yield flush()
+                    index += 1
+                lines = []
+                continue
+
+            if lines is None:
+                # 先頭の "From " 行より前のゴミは読み飛ばす
+                continue
+
+            if _FROM_ESCAPED_RE.match(line):
+                line = line[1:]
+            lines.append(line)
+
+    if lines is not None:
+        yield flush()
+
+
+# ============================================================
+# Maildir（cur / new のファイルがそのまま 1 通の EML）
+# ============================================================
+def iter_maildir(path: str, output_dir: str | None = None):
+    out_dir = output_dir or html_folder_for(path)
+
+    for sub in ("cur", "new"):
+        folder = os.path.join(path, sub)
+        try:
+            entries = sorted(os.scandir(folder), key=lambda e: e.name)
+        except OSError:
+            continue
+
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+
+            # "1700000000.M1P2.host:2,S" → ":" 以降のフラグは Windows で使えないので外す
+            name = entry.name.split(":", 1)[0].split("!", 1)[0]
+            yield file_item(name, entry.path, out_dir)
+
+
+# ============================================================
+# フォルダの再帰走査
+# ============================================================
+def iter_directory(path: str, output_dir: str | None = None):
+    """
+    path 以下の EML / MSG / mbox / Maildir をたどって item を yield する。
+    output_dir を指定した場合はすべてそこへ出力する。
+    """
+    if is_maildir(path):
+        yield from iter_maildir(path, output_dir)
+
+    try:
+        entries = sorted(os.scandir(path), key=lambda e: e.name)
+    except OSError:
+        return
+
+    maildir = is_maildir(path)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if maildir and entry.name in ("cur", "new", "tmp"):
+                continue
+            if _is_output_folder(entry):
+                continue
+            yield from iter_directory(entry.path, output_dir)
+        elif entry.is_file():
+            yield from iter_file(entry.path, output_dir)
+
+
+def _is_output_folder(entry) -> bool:
+    """
+    以前の変換で作られた <名前>_files / <名前>_html フォルダと添付のストア
+    （添付の .eml を別のメールとして拾わないよう、たどらない）。
+    """
+    name = entry.name
+    parent = os.path.dirname(entry.path)
+    if name == STORE_DIR:
+        return True
+    if name.endswith("_files"):
+        return os.path.exists(os.path.join(parent, name[:-len("_files")] + ".html"))
+    if name.endswith("_html"):
+        stem = name[:-len("_html")]
+        return any(os.path.exists(os.path.join(parent, stem + ext)) for ext in ("",) + MBOX_EXTS)
+    return False
+
+
+def iter_file(path: str, output_dir: str | None = None):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in MESSAGE_EXTS:
+        yield path
+    elif is_mbox(path):
+        yield from iter_mbox(path, output_dir)
+
+
+# ============================================================
+# 入力（ファイル・フォルダ・mbox の混在）をまとめて展開
+# ============================================================
+def iter_sources(inputs, output_dir: str | None = None):
+    """
+    inputs の各パスを、変換対象の item（パス文字列か dict）に遅延展開する。
+    """
+    for p in inputs:
+        if os.path.isdir(p):
+            yield from iter_directory(p, output_dir)
+        elif os.path.isfile(p):
+            yield from iter_file(p, output_dir)
+
+
+def expand_targets(paths, output_dir: str | None = None):
+    """
+    .eml / .msg だけならそのままのリスト（件数が分かる）、
+    フォルダや mbox を含むときは 1 通ずつ取り出すジェネレータを返す。
+    """
+    if all(os.path.splitext(p)[1].lower() in MESSAGE_EXTS for p in paths):
+        return list(paths)
+    return iter_sources(paths, output_dir)
+
+
+def is_supported(path: str) -> bool:
+    """
+    D&D やファイル選択で受け付けるパスか。
+    """
+    if os.path.isdir(path):
+        return True
+    ext = os.path.splitext(path)[1].lower()
+    return os.path.isfile(path) and (ext in MESSAGE_EXTS or is_mbox(path))
\ No newline at end of file
@@ -0,0 +1,404 @@
+import io
+import os
+import re
+import time
+import uuid
+import base64
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import mimetypes
+import urllib.parse
+from html import escape
+from email.header import Header
+from email.utils import encode_rfc2231, formatdate
+
+import metrics
+import search_index
+from common import NameAllocator, image_downloader, render_html, unique_name, write_message
+
+
+# ============================================================
+# 出力形式
+#   files  : <名前>.html + <名前>_files/（従来どおり）
+#   single : 画像・添付を data: URI で埋め込んだ 1 つの HTML
+#   mhtml  : HTML と画像・添付を multipart/related にまとめた 1 つの .mht
+# ============================================================
+LAYOUTS = ("files", "single", "mhtml")
+LAYOUT_EXTS = {"files": ".html", "single": ".html", "mhtml": ".mht"}
+ARCHIVE_EXTS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+B64_CHUNK = 57 * 1024       # base64 で 76 文字 × 1024 行になる大きさ（3 の倍数）
+
+# 参照位置の目印（render_html が link を受け取ると本文の NUL を除くので、本文と紛れない）
+_MARK = "\x00{}\x00"
+_MARK_RE = re.compile("\x00(\\d+)\x00")
+
+
+def output_name(base: str, layout: str) -> str:
+    return base + LAYOUT_EXTS[layout]
+
+
+# ============================================================
+# HTML から参照する添付・画像
+#   render_html に link として渡し、参照位置に番号の目印を置いておく。
+#   目印は書き出すときに data: URI（single）や cid:（mhtml）に置き換える。
+# ============================================================
+class _Resources:
+    def __init__(self, attachments: list):
+        self.items = list(attachments)
+        self._index = {id(att): i for i, att in enumerate(self.items)}
+        self.referenced = set()
+
+    def link(self, att) -> str:
+        return _MARK.format(self._index[id(att)])
+
+    def add(self, item: dict) -> str:
+        self.items.append(item)
+        return _MARK.format(len(self.items) - 1)
+
+    def segments(self, html: str):
+        """
+        html を (文字列, 目印の番号または None) の列に分ける。
+        """
+        pos = 0
+        for m in _MARK_RE.finditer(html):
+            i = int(m.group(1))
+            self.referenced.add(i)
+            yield html[pos:m.start()], i
+            pos = m.end()
+        yield html[pos:], None
+
+
+def _content_type(item: dict) -> str:
+    return (item.get("content_type")
+            or mimetypes.guess_type(item["filename"])[0]
+            or "application/octet-stream")
+
+
+def _open(item: dict):
+    """
+    添付の中身を読むファイルオブジェクト（ストリーミング解析で書き出し済みなら path から）。
+    "read" を持つ添付（MSG）はここで初めて読み込み、閉じれば手放す。
+    """
+    if item.get("data") is not None:
+        return io.BytesIO(item["data"])
+    if "read" in item:
+        return io.BytesIO(item["read"]())
+    return open(item["path"], "rb")
+
+
+def _write_base64(f, item: dict, lines: bool) -> int:
+    """
+    item の中身を base64 にして少しずつ f に書く。lines=True なら 76 文字で改行する。
+    """
+    n = 0
+    with _open(item) as src:
+        while True:
+            chunk = src.read(B64_CHUNK)
+            if not chunk:
+                break
+            n += len(chunk)
+            if lines:
+                f.write(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+            else:
+                f.write(base64.b64encode(chunk))
+    return n
+
+
+def _render(msg_data: dict, save_external_images: bool, tmp_dir: str, slim: bool = False):
+    """
+    目印入りの HTML と _Resources を返す。外部画像は tmp_dir に取得して埋め込み対象に加える。
+    """
+    res = _Resources(msg_data.get("attachments", []))
+
+    download = None
+    if save_external_images:
+        fetch = image_downloader(tmp_dir, NameAllocator(tmp_dir))
+
+        def download(urls):
+            refs = {}
+            for url, ref in fetch(urls).items():
+                name = ref.split("/", 1)[1]
+                refs[url] = res.add({"filename": name, "path": os.path.join(tmp_dir, name)})
+            return refs
+
+    return render_html(msg_data, "", download, res.link, slim), res
+
+
+# ============================================================
+# 1 つの HTML（data: URI で埋め込み）
+# ============================================================
+def write_single_html(f, msg_data: dict, save_external_images: bool = False,
+                      slim: bool = False) -> int:
+    """
+    画像・添付をすべて data: URI で埋め込んだ HTML をバイナリの f に書き、書いたバイト数を返す。
+    本文から参照されていない添付は </body> の前にダウンロードリンクとして並べる。
+    """
+    start = f.tell()
+    with tempfile.TemporaryDirectory() as tmp:
+        html, res = _render(msg_data, save_external_images, tmp, slim)
+
+        pos = html.lower().rfind("</body>")
+        if pos < 0:
+            pos = len(html)
+
+        def write_html(text):
+            for chunk, i in res.segments(text):
+                f.write(chunk.encode("utf-8"))
+                if i is not None:
+                    f.write(f"data:{_content_type(res.items[i])};base64,".encode("ascii"))
+                    _write_base64(f, res.items[i], lines=False)
+
+        write_html(html[:pos])
+
+        rest = [i for i in range(len(msg_data.get("attachments", []))) if i not in res.referenced]
+        if rest:
+            f.write('<hr><div class="email2html-attachments"><ul>'.encode("utf-8"))
+            for i in rest:
+                item = res.items[i]
+                name = escape(item["filename"])
+                f.write(f'<li><a download="{name}" href="data:{_content_type(item)};base64,'
+                        .encode("utf-8"))
+                _write_base64(f, item, lines=False)
+                f.write(f'">{name}</a></li>'.encode("utf-8"))
+            f.write(b"</ul></div>")
+
+        write_html(html[pos:])
+
+    return f.tell() - start
+
+
+# ============================================================
+# MHTML（multipart/related。参照は cid: で結ぶ）
+# ============================================================
+def _header(value: str) -> str:
+    try:
+        value.encode("ascii")
+        return value
+    except UnicodeEncodeError:
+        return Header(value, "utf-8").encode(linesep="\r\n")
+
+
+def write_mhtml(f, msg_data: dict, base: str, save_external_images: bool = False,
+                slim: bool = False) -> int:
+    """
+    HTML を先頭のパートに、画像・添付を続くパートにした MHTML をバイナリの f に書く。
+    パートは 1 つずつ base64 にして書くので、大きな添付もメモリに載せない。
+    """
+    start = f.tell()
+    token = uuid.uuid4().hex
+    boundary = f"----=_email2html_{token}"
+
+    def cid(i):
+        return f"part{i}.{token}@email2html"
+
+    def line(s=""):
+        f.write(s.encode("ascii") + b"\r\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        html, res = _render(msg_data, save_external_images, tmp, slim)
+        html = "".join(chunk + (f"cid:{cid(i)}" if i is not None else "")
+                       for chunk, i in res.segments(html))
+
+        line("From: <Saved by email2html>")
+        line(f"Subject: {_header(msg_data.get('subject') or '')}")
+        line(f"Date: {formatdate(localtime=True)}")
+        line("MIME-Version: 1.0")
+        line(f'Content-Type: multipart/related; type="text/html"; boundary="{boundary}"')
+        line()
+
+        line(f"--{boundary}")
+        line('Content-Type: text/html; charset="utf-8"')
+        line("Content-Transfer-Encoding: base64")
+        line(f"Content-Location: file:///{urllib.parse.quote(base)}.html")
+        line()
+        _write_base64(f, {"data": html.encode("utf-8")}, lines=True)
+
+        for i, item in enumerate(res.items):
+            line(f"--{boundary}")
+            line(f"Content-Type: {_content_type(item)}")
+            line("Content-Transfer-Encoding: base64")
+            line(f"Content-ID: <{cid(i)}>")
+            disp = "inline" if i in res.referenced else "attachment"
+            line(f"Content-Disposition: {disp}; filename*={encode_rfc2231(item['filename'], 'utf-8')}")
+            line()
+            _write_base64(f, item, lines=True)
+
+        line(f"--{boundary}--")
+
+    return f.tell() - start
+
+
+# ============================================================
+# ディスクへの書き出し（eml_to_html / msg_to_html から呼ぶ）
+# ============================================================
+def write_output(msg_data: dict, folder: str, base: str, save_external_images: bool,
+                 layout: str = "files", dedup_attachments: bool = False, slim: bool = False,
+                 transcode: dict | None = None) -> str:
+    """
+    layout の形式で folder に書き出し、本体（.html / .mht）のパスを返す。
+    dedup_attachments・transcode は files 形式のときだけ使う（common.write_message を参照）。
+    slim=True なら HTML 本文を html_slim で軽量化する。
+    """
+    # 全文検索の索引を作るときだけ、本文などをここで取り出しておく
+    search_index.collect(msg_data)
+
+    if layout == "files":
+        return write_message(msg_data, folder, base, save_external_images, dedup_attachments,
+                             slim, transcode)
+
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, output_name(base, layout))
+
+    with metrics.stage("write") as s, open(path, "wb") as f:
+        if layout == "single":
+            s["bytes_out"] = write_single_html(f, msg_data, save_external_images, slim)
+        elif layout == "mhtml":
+            s["bytes_out"] = write_mhtml(f, msg_data, base, save_external_images, slim)
+        else:
+            raise ValueError(f"不明な出力形式です: {layout}")
+
+    return path
+
+
+# ============================================================
+# アーカイブ用（ワーカーで一時フォルダに書き出し、親プロセスが 1 つの ZIP / tar に書く）
+#   プロセス間ではファイルのパスだけを受け渡す（添付の中身を pickle しない）。
+# ============================================================
+def message_entries(msg_data: dict, base: str, save_external_images: bool,
+                    layout: str = "files", prefix: str = "", slim: bool = False) -> list:
+    """
+    1 通分の [(アーカイブ内の名前, 中身を書いた一時ファイルのパス)] を返す。先頭が本体（.html / .mht）。
+    一時ファイルはすべて 1 つの一時フォルダの下に置く（使い終わったら remove_entries で消す）。
+    """
+    search_index.collect(msg_data)
+
+    spool = tempfile.mkdtemp(prefix="email2html-")
+    try:
+        main = os.path.join(spool, output_name(base, layout))
+        entries = [(prefix + output_name(base, layout), main)]
+
+        if layout == "files":
+            # 添付・外部画像は一時フォルダの <名前>_files に書き出す
+            subfolder = base + "_files"
+            attach_folder = os.path.join(spool, subfolder)
+            names = NameAllocator(attach_folder)
+            attachments = msg_data.get("attachments", [])
+            for att in attachments:
+                names.claim(att["saved_name"])
+
+            download = image_downloader(attach_folder, names) if save_external_images else None
+            html = render_html(msg_data, subfolder, download, slim=slim)
+            with open(main, "w", encoding="utf-8", newline="\n") as f:
+                f.write(html)
+            del html
+
+            os.makedirs(attach_folder, exist_ok=True)
+            saved = set()
+            for att in attachments:
+                path = os.path.join(attach_folder, att["saved_name"])
+                with _open(att) as src, open(path, "wb") as dst:
+                    shutil.copyfileobj(src, dst, B64_CHUNK)
+                saved.add(att["saved_name"])
+                entries.append((f"{prefix}{subfolder}/{att['saved_name']}", path))
+            for name in sorted(set(os.listdir(attach_folder)) - saved):
+                entries.append((f"{prefix}{subfolder}/{name}", os.path.join(attach_folder, name)))
+            return entries
+
+        with open(main, "wb") as f:
+            if layout == "single":
+                write_single_html(f, msg_data, save_external_images, slim)
+            elif layout == "mhtml":
+                write_mhtml(f, msg_data, base, save_external_images, slim)
+            else:
+                raise ValueError(f"不明な出力形式です: {layout}")
+        return entries
+    except BaseException:
+        shutil.rmtree(spool, ignore_errors=True)
+        raise
+
+
+def remove_entries(entries: list):
+    """
+    message_entries が書いた一時フォルダを消す。
+    """
+    if entries:
+        shutil.rmtree(os.path.dirname(entries[0][1]), ignore_errors=True)
+
+
+def is_archive_path(path: str) -> bool:
+    return path.lower().endswith(ARCHIVE_EXTS)
+
+
+class ArchiveWriter:
+    """
+    バッチ全体の出力を 1 つの ZIP / tar（拡張子で判定）に、届いた順に追記する。
+    同じ名前のメールが 2 通目以降に来たら <名前>(n)/ の下に入れる。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+
+        lower = path.lower()
+        self._zip = self._tar = None
+        if lower.endswith(".zip"):
+            self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        elif lower.endswith((".tar.gz", ".tgz")):
+            self._tar = tarfile.open(path, "w:gz")
+        elif lower.endswith(".tar"):
+            self._tar = tarfile.open(path, "w")
+        else:
+            raise ValueError(f"ZIP / tar のファイル名を指定してください: {path}")
+
+        self._used = set()
+        self._counters = {}
+
+    def add(self, entries: list) -> list:
+        """
+        1 通分の entries（message_entries）を書き込み、実際に使ったアーカイブ内の名前のリストを返す。
+        """
+        main = entries[0][0]
+        prefix = ""
+        if main.lower() in self._used:
+            stem = os.path.splitext(main)[0]
+            self._used.add(stem.lower())
+            prefix = unique_name(stem, self._used, self._counters) + "/"
+        self._used.add(main.lower())
+
+        names = []
+        now = time.time()
+        for name, path in entries:
+            name = prefix + name
+            size = os.path.getsize(path)
+            with open(path, "rb") as src:
+                if self._zip is not None:
+                    info = zipfile.ZipInfo(name, time.localtime(now)[:6])
+                    # 本体は圧縮、画像などの添付はたいてい圧縮済みなのでそのまま
+                    info.compress_type = zipfile.ZIP_STORED if names else zipfile.ZIP_DEFLATED
+                    # 大きさを入れておくと、4 GB を超える添付でも ZIP64 で書ける
+                    info.file_size = size
+                    with self._zip.open(info, "w") as w:
+                        shutil.copyfileobj(src, w, B64_CHUNK)
+                else:
+                    info = tarfile.TarInfo(name)
+                    info.size = size
+                    info.mtime = now
+                    self._tar.addfile(info, src)
+            names.append(name)
+        return names
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
\ No newline at end of file